@@ -1,59 +1,58 @@
-import os
+from rerank_engine import rerank_documents
+import bm25_index
+import clients
+import embedding_cache
+from cassette import use_cassette
+from fusion import fused_retrieve
+from vector_index import get_index, use_local_index
 
-from supabase import Client, create_client
-import google.generativeai as genai
-from dotenv import load_dotenv
-import supabase
-
-load_dotenv()
-
-# env and clients setup
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-GEMINI_KEY = os.getenv("GEMINI_KEY")
-SUPABASE_CLIENT: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-genai.configure(api_key=GEMINI_KEY)
-model = genai.GenerativeModel("gemini-flash-latest")
+# clients setup: the shared clients from clients.py, created on first use rather than at import
+# CASSETTE_MODE=record|replay routes Gemini, Supabase and embeddings through cassette.py; a replayed run
+# never reaches the real clients, so it needs no credentials
+SUPABASE_CLIENT, model, CASSETTE = use_cassette(clients.supabase, clients.model)
 
 
 # Embeddings 
 def embed_text(text: str):
-    response = genai.embed_content(
-        model="models/embedding-001",
-        content=text
-    )
-    embedding = response["embedding"]
-    return embedding
+    # repeated queries and unchanged chunks are served from the shared cache, see embedding_cache.py
+    return embedding_cache.embed_text(text)
 
 # Retrieve Context
 def dense_retrieve(query: str, top_k: int = 5):
     query_embedding = embed_text(query)
+    if use_local_index():
+        results = get_index().search(query_embedding, top_k) # in-process mmap index, no RPC
+    else:
+        response = SUPABASE_CLIENT.rpc(
+            "match_documents",
+            {
+                "query_embedding": query_embedding,
+                "match_count": top_k # number of similar documents to retrieve
+            }
+        ).execute()
+        results = response.data
     
-    response = SUPABASE_CLIENT.rpc(
-        "match_documents",
-        {
-            "query_embedding": query_embedding,
-            "match_count": top_k # number of similar documents to retrieve
-        }
-    ).execute()
-    
-    results = response.data
     contexts = [item['content'] for item in results]
     return contexts
 
 def sparse_retrieve(query: str, top_k: int = 5):    
-    response = (SUPABASE_CLIENT.table('documents')
-                .select('content,metadata')
-                .text_search('content', query) # for direct text search
-                .limit(top_k)
-                .execute()) 
+    if use_local_index():
+        results = bm25_index.get_index().search(query, top_k) # in-process BM25, no PostgREST hop
+    else:
+        response = (SUPABASE_CLIENT.table('documents')
+                    .select('content,metadata')
+                    .text_search('content', query) # for direct text search
+                    .limit(top_k)
+                    .execute()) 
+        results = response.data
     
-    results = response.data
     contexts = [item['content'] for item in results]
     return contexts
 
 # Hybrid retrieval 
 def hybrid_retrieve(query: str, top_k: int = 10):
+    if use_local_index():
+        return fused_retrieve(query, embed_text, top_k) # in-process BM25 + dense, fused with RRF
     query_embedding = embed_text(query)
     response = SUPABASE_CLIENT.rpc(
         "hybrid_match_documents",
@@ -67,44 +66,18 @@ def hybrid_retrieve(query: str, top_k: int = 10):
     return response.data or []
 
 # Reranking 
-def rerank_prompt(query: str, passage: str):
-    return f"""
-You are a relevance judge for a retrieval system.
-Read the query and passage carefully, Score relevance strictly.
-
-10 = directly answers the query
-7 - 9 = provides key supporting details
-4 - 6 = related but not sufficient alone
-0 - 3 = irrelevant
-Query:
-{query}
-
-Passage:
-{passage}
-
-Score the relevance from 0 (irrelevant) to 10 (highly relevant).
-Return ONLY the number.
-"""
-
-def rerank(query, documents,top_k):
-    scored_docs = []
-    for idx,doc in enumerate(documents): 
+def rerank(query, documents,top_k, mode=None, verbose=True):
+    for idx,doc in enumerate(documents if verbose else []): 
         metadata = doc.get("metadata", {})
         print(f"[Candidate {idx+1}]")
         print(f"Content Preview: {doc['content'][:120]}...")
         print(f"ChunkID: {metadata.get('chunk_id')}")
         print(f"Source: {metadata.get('source')}\n")
-        prompt = rerank_prompt(query, doc['content'])
-        response = model.generate_content(prompt, generation_config={"temperature": 0})
-
-        try:
-            score = float(response.text.strip())
-        except:
-            score = 0.0
-        print(f"Relevance Score: {score}\n")
-        scored_docs.append((score, doc))
+    # candidates are scored concurrently (or in one listwise call), see rerank_engine.py
+    scored_docs = rerank_documents(query, documents, model, mode=mode) # highest relevance first
+    if not verbose:
+        return [doc for _,doc in scored_docs[:top_k]]
     print("--- RERANKING RESULT ---")
-    scored_docs.sort(key=lambda x: x[0], reverse=True) # highest relevance first
     for rank, (score, doc) in enumerate(scored_docs[:top_k], start=1):
         metadata = doc.get("metadata", {})
         print(f"Rank {rank} | Score {score}")
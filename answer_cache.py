@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Semantic answer cache in front of agentic_answer
+# A new question is served a previous answer (and its supporting chunks) when their query embeddings
+# have cosine similarity >= ANSWER_CACHE_THRESHOLD, the entry is younger than ANSWER_CACHE_TTL and
+# it was answered against the current corpus version.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+
+def normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # id -> entry, least recently used first
+        self.version = None
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self._next_id = 0
+        self._matrix = None # stacked embeddings of self.entries, rebuilt lazily after changes
+        self._matrix_ids = []
+        self._lock = threading.Lock()
+
+    def lookup(self, query_embedding, version):
+        """Return the closest fresh entry above the threshold, or None."""
+        query = normalize(query_embedding)
+        with self._lock:
+            self._check_version(version)
+            self._expire()
+            if not self.entries:
+                self.counters["misses"] += 1
+                return None
+
+            if self._matrix is None:
+                self._matrix_ids = list(self.entries)
+                self._matrix = np.stack([self.entries[i]["embedding"] for i in self._matrix_ids])
+            similarities = self._matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.counters["misses"] += 1
+                return None
+
+            entry_id = self._matrix_ids[best]
+            self.entries.move_to_end(entry_id)
+            self.counters["hits"] += 1
+            entry = self.entries[entry_id]
+            return {**entry, "similarity": float(similarities[best])}
+
+    def store(self, query: str, query_embedding, answer: str, documents: list, version):
+        with self._lock:
+            self._check_version(version)
+            self.entries[self._next_id] = {
+                "query": query,
+                "embedding": normalize(query_embedding),
+                "answer": answer,
+                "documents": documents,
+                "created": time.monotonic(),
+            }
+            self._next_id += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._matrix = None
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.entries:
+                self.counters["invalidations"] += 1
+            self.entries.clear()
+            self._matrix = None
+            self.version = version
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        expired = [i for i, entry in self.entries.items() if entry["created"] < cutoff]
+        for entry_id in expired:
+            del self.entries[entry_id]
+        if expired:
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+
+# Shared instance
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_cache():
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = SemanticAnswerCache()
+    return _CACHE
@@ -1,20 +1,43 @@
 import os
-from flask import Flask, request, jsonify, render_template
-from supabase import Client, create_client
-from dotenv import load_dotenv
-from app_rag import agentic_answer
-import google.generativeai as genai
+import json
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
+from app_rag import WARMUP, agent_events, shared_answer, warmup
+from batch_qa import BATCH_MAX_QUESTIONS, answer_batch, parse_questions
+import clients
+import tracing
 
 
-load_dotenv()
 app = Flask(__name__)
 
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_KEY")
-)
-genai.configure(api_key=os.getenv("GEMINI_KEY"))
-model = genai.GenerativeModel("gemini-flash-latest")
+# shared clients (clients.py): built on first use, importing this module connects to nothing
+supabase = clients.supabase
+model = clients.model
+
+# Warm-up before taking traffic: `python app.py` and the ASGI server (lifespan startup) run it first; other
+# WSGI servers should call warm() from their worker start hook. /ready answers 503 until it has run.
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+
+def warm():
+    return warmup(supabase, model)
+
+# Request ids: taken from X-Request-ID when the caller sends one, echoed back and attached to every span
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get("X-Request-ID") or tracing.new_request_id()
+
+@app.after_request
+def count_request(response):
+    response.headers["X-Request-ID"] = g.request_id
+    tracing.count("rag_http_requests_total", endpoint=request.endpoint, status=response.status_code)
+    return response
+
+@app.route("/metrics")
+def metrics():
+    return Response(tracing.render_metrics(), content_type=tracing.CONTENT_TYPE)
+
+@app.route("/ready")
+def ready():
+    return jsonify(WARMUP), 200 if WARMUP["ready"] else 503
 
 @app.route("/")
 def index():
@@ -28,8 +51,70 @@ def chat():
     if not query:
         return jsonify({"error": "Empty message"}), 400
 
-    answer = agentic_answer(query, supabase, model)
+    try:
+        # identical questions already in flight are answered once, see app_rag.shared_answer
+        answer = shared_answer(query, supabase, model, request_id=g.request_id)
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 504
     return jsonify({"answer": answer})
 
+def sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    data = request.json
+    query = data.get("message")
+
+    if not query:
+        return jsonify({"error": "Empty message"}), 400
+
+    request_id = g.request_id
+    def events():
+        try:
+            for event, payload in agent_events(query, supabase, model, stream=True, request_id=request_id):
+                if event == "done":
+                    payload = {
+                        "answer": payload["answer"],
+                        "grounded": payload["grounded"],
+                        "cached": payload["cached"],
+                        "sources": payload["sources"],
+                        "timings": payload["timings"]
+                    }
+                yield sse(event, payload)
+        except Exception as e:
+            yield sse("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    # body: JSONL questions, response: JSONL results in completion order, see batch_qa.py
+    items = parse_questions(request.get_data(as_text=True).splitlines())
+    if not items:
+        return jsonify({"error": "No questions"}), 400
+    if len(items) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch"}), 413
+
+    batch_id = g.request_id
+    def results():
+        try:
+            for result in answer_batch(items, supabase, model, batch_id=batch_id):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return Response(
+        stream_with_context(results()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
+    if WARMUP_ON_START:
+        warm()
     app.run(debug=True)
\ No newline at end of file
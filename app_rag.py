@@ -1,68 +1,78 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 from supabase import Client 
-import google.generativeai as genai
+import answer_cache
+import bm25_index
+import embedding_cache
+import grounding
+import llm_scheduler
+import rerank_cache
+import tracing
+from answer_cache import ANSWER_CACHE_ENABLED
+from context_assembly import CONTEXT_COMPRESSION, assemble_context
+from corpus import get_corpus_version
+from rerank_engine import rerank_documents, rerank_documents_async
+from single_flight import SingleFlight
+from fusion import fused_retrieve
+from query_router import get_router, route, route_async
+from query_text import normalize_query
+from vector_index import get_index, use_local_index
+
+# Speculative mode: hybrid retrieval starts while the planner is still running
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "1") == "1"
+_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="agent")
+
+# Single-flight /chat: concurrent requests for the same normalized question share one agent run
+CHAT_SINGLE_FLIGHT = os.getenv("CHAT_SINGLE_FLIGHT", "1") == "1"
+CHAT_SINGLE_FLIGHT_TIMEOUT = float(os.getenv("CHAT_SINGLE_FLIGHT_TIMEOUT", "60")) # follower wait, seconds
+_CHAT_FLIGHTS = SingleFlight("chat")
+
+# Grounding: the local verifier decides confident answers, borderline ones still get the LLM check
+GROUNDING_VERIFIER = grounding.GROUNDING_VERIFIER
+# adds embedding similarity to the word overlap, at the cost of one embedding call per answer (answer
+# sentences are new text, so the embedding cache rarely has them)
+GROUNDING_EMBEDDINGS = os.getenv("GROUNDING_EMBEDDINGS", "0") == "1"
 
 
 # Embeddings 
 def embed_text(text: str):
-    response = genai.embed_content(
-        model="models/embedding-001",
-        content=text
-    )
-    embedding = response["embedding"]
-    return embedding
+    # repeated queries and unchanged chunks are served from the shared cache, see embedding_cache.py,
+    # and misses are sent through the LLM scheduler (llm_scheduler.py)
+    return embedding_cache.embed_texts([text], embed_fn=scheduled_embed)[0]
+
+def embed_texts(texts: list):
+    return embedding_cache.embed_texts(texts, embed_fn=scheduled_embed)
+
+def scheduled_embed(texts: list, model: str):
+    return llm_scheduler.embed(embedding_cache.get_embed_fn(), texts, model)
 
 # Hybrid retrieval 
 def hybrid_retrieve(query: str, supabase: Client, top_k: int = 10):
+    if use_local_index():
+        return fused_retrieve(query, embed_text, top_k) # in-process BM25 + dense, fused with RRF
     query_embedding = embed_text(query)
-    response = supabase.rpc(
-        "hybrid_match_documents",
-        {
-            "query_embedding": query_embedding,
-            "query_text": query,
-            "match_count": top_k
-        }
-    ).execute()
+    with tracing.span("supabase.hybrid_match_documents", top_k=top_k) as span:
+        response = supabase.rpc(
+            "hybrid_match_documents",
+            {
+                "query_embedding": query_embedding,
+                "query_text": query,
+                "match_count": top_k
+            }
+        ).execute()
+        span.set(rows=len(response.data or []))
 
     return response.data or []
 
 # Reranking 
-def rerank_prompt(query: str, passage: str):
-    return f"""
-You are a relevance judge for a retrieval system.
-Read the query and passage carefully, Score relevance strictly.
-
-10 = directly answers the query
-7 - 9 = provides key supporting details
-4 - 6 = related but not sufficient alone
-0 - 3 = irrelevant
-Query:
-{query}
-
-Passage:
-{passage}
-
-Score the relevance from 0 (irrelevant) to 10 (highly relevant).
-Return ONLY the number.
-"""
-
-def rerank(query, documents, model, top_k):
-    scored_docs = []
-    for idx,doc in enumerate(documents): 
-        # print(f"[Candidate {idx+1}]")
-        # print(f"Content Preview: {doc['content'][:120]}...")
-        prompt = rerank_prompt(query, doc['content'])
-        response = model.generate_content(prompt, generation_config={"temperature": 0})
-        try:
-            score = float(response.text.strip())
-        except:
-            score = 0.0
-        # print(f"Relevance Score: {score}\n")
-        scored_docs.append((score, doc))
-    # print("--- RERANKING RESULT ---")
-    scored_docs.sort(key=lambda x: x[0], reverse=True) # highest relevance first
-    # for rank, (score, doc) in enumerate(scored_docs[:top_k], start=1):
-    #     print(f"Rank {rank} | Score {score}")
-    #     print(f"Snippet: {doc['content'][:120]}...\n")
+def rerank(query, documents, model, top_k, mode=None):
+    # candidates are scored concurrently (or in one listwise call), see rerank_engine.py;
+    # rerank calls are scheduled behind user-facing ones
+    scored_docs = rerank_documents(query, documents, llm_scheduler.ScheduledModel(model, "rerank"), mode=mode)
     return [doc for _,doc in scored_docs[:top_k]]  # keep only top_k documentts
 
 #Agentic Features 
@@ -84,52 +94,199 @@ Query:
 {query}
 """
 def plan(query, model): 
-    response = model.generate_content(
-        plan_prompt(query),
-        generation_config={"temperature": 0}
-    )   
-    print("\n--- Planning Response ---")
-    try : 
-        steps = eval(response.text.strip())
-        print(steps)
-        return steps
-    
-    except :
-        print("Error parsing planning response, defaulting to ['RETRIEVE', 'ANSWER']")
-        return ["RETRIEVE", "ANSWER"]
+    with tracing.span("llm.plan") as span:
+        response = llm_scheduler.generate(
+            model,
+            plan_prompt(query),
+            purpose="plan",
+            generation_config={"temperature": 0}
+        )   
+        tracing.record_llm("plan", response)
+        try : 
+            steps = eval(response.text.strip())
+            span.set(steps=steps)
+            return steps
+        
+        except :
+            # the planning reply goes to the span log instead of stdout
+            span.set(parse_error=response.text.strip()[:200])
+            tracing.count("rag_plan_parse_errors_total")
+            return ["RETRIEVE", "ANSWER"]
+
+# Stage timing
+@contextmanager
+def stage_timer(timings: dict, stage: str):
+    # every stage is also a span, see tracing.py
+    start = time.perf_counter()
+    try:
+        with tracing.span(stage):
+            yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def timed_call(timings: dict, stage: str, fn, *args):
+    with stage_timer(timings, stage):
+        return fn(*args)
+
+UNGROUNDED_ANSWER = "I'm unable to answer confidently based on the provided disclosure."
+REFUSAL_ANSWER = "I'm sorry. This question is outside the scope of FX product disclosures."
+
+def agentic_answer(query: str, supabase, model, request_id: str = None):
+    return run_agent(query, supabase, model, request_id=request_id)["answer"]
+
+def shared_answer(query: str, supabase, model, request_id: str = None):
+    """agentic_answer, joining an identical question already being answered instead of starting another run.
+
+    Waiting requests give up with TimeoutError after CHAT_SINGLE_FLIGHT_TIMEOUT and get the leader's
+    exception if its run fails.
+    """
+    if not CHAT_SINGLE_FLIGHT:
+        return agentic_answer(query, supabase, model, request_id=request_id)
+    return _CHAT_FLIGHTS.do(normalize_query(query), agentic_answer, query, supabase, model,
+                            request_id=request_id, timeout=CHAT_SINGLE_FLIGHT_TIMEOUT)
+
+def run_agent(query: str, supabase, model, request_id: str = None):
+    """Run the agent and return its memory: answer, supporting documents and whether it was cached."""
+    for event, data in agent_events(query, supabase, model, request_id=request_id):
+        pass
+    return data
+
+def agent_events(query: str, supabase, model, stream: bool = False, speculative: bool = SPECULATIVE_RETRIEVAL,
+                 request_id: str = None):
+    """Run the agent step by step, yielding (event, data) pairs.
+
+    Events are "stage" (planning, retrieving, reranking, generating, grounding), "token" (answer text,
+    only when stream=True), "sources" (sent while the grounded check runs, stream=True only) and
+    finally "done" with the agent memory, including per-stage timings in seconds.
+    Every span recorded along the way carries request_id (a fresh one when None).
+    """
+    with tracing.request_context(request_id), tracing.span("request", stream=stream) as span:
+        for event, data in _agent_events(query, supabase, model, stream, speculative):
+            if event == "done":
+                span.set(cached=data["cached"], grounded=data["grounded"])
+            yield event, data
+
+def _agent_events(query: str, supabase, model, stream: bool, speculative: bool):
+    timings = {}
+    started = time.perf_counter()
+
+    # the query embedding feeds the answer cache and the router, and is cached for retrieval
+    with stage_timer(timings, "embed"):
+        query_embedding = embed_text(query)
+
+    # Semantic cache: a near-identical question answered against the current corpus skips every LLM call
+    if ANSWER_CACHE_ENABLED:
+        version = get_corpus_version(supabase)
+        hit = answer_cache.get_cache().lookup(query_embedding, version)
+        tracing.count("rag_answer_cache_lookups_total", result="hit" if hit else "miss")
+        if hit:
+            if stream:
+                yield "token", {"text": hit["answer"]}
+            timings["total"] = time.perf_counter() - started
+            yield "done", {
+                "documents": hit["documents"],
+                "sources": cite_sources(hit["documents"]),
+                "answer": hit["answer"],
+                "grounded": True,
+                "cached": True,
+                "timings": timings
+            }
+            return
+
+    # Speculative retrieval: the plan almost always starts with RETRIEVE, so start it alongside the planner
+    retrieval = None
+    if speculative:
+        retrieval = _EXECUTOR.submit(tracing.propagate(timed_call), timings, "retrieve",
+                                     hybrid_retrieve, query, supabase, 10)
+
+    yield "stage", {"stage": "planning"}
+    plan_started = time.perf_counter()
+    with stage_timer(timings, "plan"):
+        # the local router answers confident cases, plan() only sees the ambiguous ones
+        steps = route(query, query_embedding, model, plan)
+    if retrieval and "RETRIEVE" not in steps:
+        retrieval.cancel() # REFUSE: drop the speculative work (a running call just gets discarded)
+        retrieval = None
 
-def agentic_answer(query: str, supabase, model):
-    steps = plan(query, model)
     memory = {
         "documents" : [],
-        "answer" : None
+        "sources" : [],
+        "answer" : None,
+        "grounded" : False,
+        "cached" : False,
+        "timings" : timings
     }
 
     for step in steps:  
         if step == "RETRIEVE":
-            retrieved_docs = hybrid_retrieve(query, supabase, top_k=10)
-            reranked_docs = rerank(query, retrieved_docs, model, top_k=3)
+            yield "stage", {"stage": "retrieving"}
+            if retrieval:
+                retrieved_docs = retrieval.result()
+                # wall time saved = what plan + retrieve would cost in sequence minus what they took together
+                overlapped = time.perf_counter() - plan_started
+                timings["overlap_saved"] = max(0.0, timings["plan"] + timings["retrieve"] - overlapped)
+            else:
+                retrieved_docs = timed_call(timings, "retrieve", hybrid_retrieve, query, supabase, 10)
+            yield "stage", {"stage": "reranking"}
+            with stage_timer(timings, "rerank"):
+                reranked_docs = rerank(query, retrieved_docs, model, top_k=3)
             memory["documents"] = reranked_docs
 
         elif step == "ANSWER":
-            contexts = [doc["content"] for doc in memory["documents"]]
+            yield "stage", {"stage": "generating"}
+            contexts = prompt_contexts(query, memory["documents"])
             prompt = build_prompt(query, contexts)
-            response = model.generate_content(prompt)
-            answer = response.text.strip()
-            if grounded_check(answer, "\n".join(contexts), model):
+            with stage_timer(timings, "generate"):
+                if stream:
+                    parts, chunk = [], None
+                    for chunk in llm_scheduler.generate(model, prompt, purpose="answer", stream=True):
+                        parts.append(chunk.text)
+                        yield "token", {"text": chunk.text}
+                    if chunk is not None:
+                        tracing.record_llm("answer", chunk) # the last chunk carries the usage totals
+                    answer = "".join(parts).strip()
+                else:
+                    response = llm_scheduler.generate(model, prompt, purpose="answer")
+                    tracing.record_llm("answer", response)
+                    answer = response.text.strip()
+
+            yield "stage", {"stage": "grounding"}
+            # the grounded check runs in the background while the citations are built and sent
+            check = _EXECUTOR.submit(tracing.propagate(timed_call), timings, "ground", verify_grounding,
+                                     answer, contexts, model)
+            memory["sources"] = cite_sources(memory["documents"])
+            if stream:
+                yield "sources", {"sources": memory["sources"]}
+            if check.result():
                 memory["answer"] = answer
+                memory["grounded"] = True
             else:
-                memory["answer"] = "I'm unable to answer confidently based on the provided disclosure."
+                memory["answer"] = UNGROUNDED_ANSWER
 
         elif step == "REFUSE":
-            memory["answer"] = "I'm sorry. This question is outside the scope of FX product disclosures."
+            memory["answer"] = REFUSAL_ANSWER
+            memory["grounded"] = True # a refusal is a final answer, safe to serve again
+            if stream:
+                yield "token", {"text": REFUSAL_ANSWER}
     
-    return memory["answer"]
+    if ANSWER_CACHE_ENABLED and memory["grounded"]:
+        answer_cache.get_cache().store(query, query_embedding, memory["answer"], memory["documents"], version)
+    timings["total"] = time.perf_counter() - started
+    yield "done", memory
+
+def cite_sources(documents: list):
+    return [
+        {
+            "source": doc.get("metadata", {}).get("source"),
+            "chunk_id": doc.get("metadata", {}).get("chunk_id")
+        }
+        for doc in documents
+    ]
 
 # Ground Checking
 
-def grounded_check(answer, contexts, model):
-    prompt = f"""
+def grounded_prompt(answer, contexts):
+    return f"""
         Is the following answer fully supported by the context?
         Answer YES or NO.
 
@@ -139,11 +296,48 @@ def grounded_check(answer, contexts, model):
         Answer:
         {answer}
     """
-    response = model.generate_content(prompt, generation_config={"temperature": 0})
+
+def grounded_check(answer, contexts, model):
+    prompt = grounded_prompt(answer, contexts)
+    with tracing.span("llm.ground"):
+        response = llm_scheduler.generate(model, prompt, purpose="ground", generation_config={"temperature": 0})
+    tracing.record_llm("ground", response)
     return "YES" in response.text.upper()
 
+def local_grounding(answer, contexts):
+    with tracing.span("ground.local") as span:
+        verdict = grounding.local_verdict(answer, contexts, embed_fn=embed_texts if GROUNDING_EMBEDDINGS else None)
+        span.set(grounded=verdict["grounded"], support=verdict["support"])
+    return verdict
+
+def verify_grounding(answer, contexts: list, model):
+    """Grounded verdict, decided locally when the verifier is confident (grounding.py), else by grounded_check."""
+    if grounding.is_no_answer(answer):
+        # the prompt's "I don't have an answer" reply makes no claim to check
+        tracing.count("rag_grounding_verdicts_total", source="no_answer", grounded=True)
+        return True
+    if GROUNDING_VERIFIER == "hybrid":
+        verdict = local_grounding(answer, contexts)
+        if verdict["grounded"] is not None:
+            tracing.count("rag_grounding_verdicts_total", source="local", grounded=verdict["grounded"])
+            return verdict["grounded"]
+    grounded = grounded_check(answer, "\n".join(contexts), model)
+    tracing.count("rag_grounding_verdicts_total", source="llm", grounded=grounded)
+    return grounded
+
 
 # Prompt Building 
+def prompt_contexts(query: str, documents: list):
+    """The reranked chunks as prompt contexts, merged and trimmed to CONTEXT_TOKEN_BUDGET when compression is on."""
+    if not CONTEXT_COMPRESSION:
+        return [doc["content"] for doc in documents]
+    with tracing.span("context.assemble", chunks=len(documents)) as span:
+        contexts, stats = assemble_context(query, documents)
+        span.set(passages=stats["passages"], tokens=stats["tokens"], saved_tokens=stats["saved_tokens"])
+    tracing.count("rag_context_tokens_total", stats["raw_tokens"], kind="raw")
+    tracing.count("rag_context_tokens_total", stats["tokens"], kind="assembled")
+    return contexts
+
 def build_prompt(query: str, contexts: list):
     context_str = "\n\n".join(contexts)
     prompt = f"""Use the following pieces of retrieved context to answer the question. \
@@ -154,6 +348,77 @@ def build_prompt(query: str, contexts: list):
     """
     return prompt
 
+# Cache counters owned by the caches themselves, read when /metrics is scraped
+def cache_metrics():
+    embeddings = embedding_cache.get_cache().stats()
+    for tier in ("memory", "disk"):
+        yield "rag_embedding_cache_hits_total", {"tier": tier}, embeddings[f"{tier}_hits"]
+    yield "rag_embedding_cache_misses_total", {}, embeddings["misses"]
+    answers = answer_cache.get_cache().stats()
+    yield "rag_answer_cache_entries", {}, answers["entries"]
+    yield "rag_answer_cache_evictions_total", {}, answers["evictions"]
+    scores = rerank_cache.get_cache().stats()
+    for tier in ("memory", "disk"):
+        yield "rag_rerank_cache_hits_total", {"tier": tier}, scores[f"{tier}_hits"]
+    yield "rag_rerank_cache_misses_total", {}, scores["misses"]
+    yield "rag_rerank_cache_hit_rate", {}, scores["hit_rate"]
+    yield "rag_rerank_cache_entries", {}, scores["memory_entries"]
+
+tracing.add_collector(cache_metrics)
+
+
+# Warm-up: load what a worker's first request would otherwise pay for, before it takes traffic
+WARMUP = {"ready": False, "start_to_ready": None, "steps": {}}
+
+def warm_vector_index():
+    index = get_index()
+    if len(index):
+        # reads the scanned mmap once so the first searches don't page it in
+        scanned = {"int8": index.int8, "binary": index.binary}.get(index.quantization, index.vectors)
+        scanned.max()
+    return index
+
+def warmup(supabase, model):
+    """Build the clients, open a pooled Supabase connection, load the local indexes, router and caches.
+
+    A step that fails is reported and skipped (the first request needing it pays for it instead).
+    Returns WARMUP: seconds per step and the worker's start-to-ready time, also exported on /metrics.
+    """
+    steps = [
+        ("clients", lambda: (supabase.table, model.generate_content)),
+        ("embedding_cache", embedding_cache.get_cache),
+        ("answer_cache", answer_cache.get_cache),
+        ("rerank_cache", rerank_cache.get_cache),
+        ("corpus_version", lambda: get_corpus_version(supabase)),
+    ]
+    if use_local_index():
+        steps += [("vector_index", warm_vector_index), ("bm25_index", bm25_index.get_index)]
+    else:
+        steps.append(("supabase", lambda: supabase.table("documents").select("metadata").limit(1).execute()))
+    steps.append(("router", get_router))
+
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"warmup.{name}"):
+                step()
+            WARMUP["steps"][name] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            WARMUP["steps"][name] = f"failed: {e}"
+    WARMUP["start_to_ready"] = round(time.time() - tracing.PROCESS_STARTED, 3)
+    WARMUP["ready"] = True
+    print(f"Worker ready {WARMUP['start_to_ready']:.2f}s after start, warm-up steps: {WARMUP['steps']}")
+    return WARMUP
+
+def warmup_metrics():
+    if WARMUP["ready"]:
+        yield "rag_worker_start_to_ready_seconds", {}, WARMUP["start_to_ready"]
+        for name, seconds in WARMUP["steps"].items():
+            if isinstance(seconds, float):
+                yield "rag_warmup_seconds", {"step": name}, seconds
+
+tracing.add_collector(warmup_metrics)
+
 TOOLS = {
     "hybrid_retrieve": hybrid_retrieve,
     "rerank": rerank,
@@ -165,7 +430,221 @@ TOOLS = {
 def answer_query(query, supabase, model):
     retrieved = hybrid_retrieve(query, supabase, top_k=10)
     reranked = rerank(query, retrieved, model)
-    contexts = [doc['content'] for doc in reranked]
-    prompt = build_prompt(query, contexts)
-    response = model.generate_content(prompt)
-    return response.text.strip()
\ No newline at end of file
+    prompt = build_prompt(query, prompt_contexts(query, reranked))
+    response = llm_scheduler.generate(model, prompt, purpose="answer")
+    return response.text.strip()
+
+
+# Async pipeline, served by asgi.py
+# The same agent as agent_events, written as coroutines so a chat waiting on Gemini or Supabase holds no
+# thread: LLM and embedding calls are awaited through the scheduler, blocking Supabase and local index
+# calls run in the default thread pool. The synchronous functions above are unchanged.
+async def embed_text_async(text: str):
+    # the cache's disk tier is SQLite, so lookups and writes run in the thread pool
+    cache = embedding_cache.get_cache()
+    embedding = await asyncio.to_thread(cache.get, embedding_cache.EMBED_MODEL, text)
+    if embedding is None:
+        embeddings = await llm_scheduler.embed_async(embedding_cache.get_embed_fn(), [text],
+                                                     embedding_cache.EMBED_MODEL)
+        embedding = embeddings[0]
+        await asyncio.to_thread(cache.put, embedding_cache.EMBED_MODEL, text, embedding)
+    return embedding
+
+async def hybrid_retrieve_async(query: str, supabase: Client, top_k: int = 10):
+    if use_local_index():
+        return await asyncio.to_thread(tracing.propagate(fused_retrieve), query, embed_text, top_k)
+    query_embedding = await embed_text_async(query)
+    with tracing.span("supabase.hybrid_match_documents", top_k=top_k) as span:
+        response = await asyncio.to_thread(supabase.rpc(
+            "hybrid_match_documents",
+            {
+                "query_embedding": query_embedding,
+                "query_text": query,
+                "match_count": top_k
+            }
+        ).execute)
+        span.set(rows=len(response.data or []))
+
+    return response.data or []
+
+async def rerank_async(query, documents, model, top_k, mode=None):
+    scored_docs = await rerank_documents_async(query, documents, llm_scheduler.ScheduledModel(model, "rerank"),
+                                               mode=mode)
+    return [doc for _,doc in scored_docs[:top_k]]
+
+async def plan_async(query, model):
+    with tracing.span("llm.plan") as span:
+        response = await llm_scheduler.generate_async(
+            model,
+            plan_prompt(query),
+            purpose="plan",
+            generation_config={"temperature": 0}
+        )
+        tracing.record_llm("plan", response)
+        try :
+            steps = eval(response.text.strip())
+            span.set(steps=steps)
+            return steps
+
+        except :
+            span.set(parse_error=response.text.strip()[:200])
+            tracing.count("rag_plan_parse_errors_total")
+            return ["RETRIEVE", "ANSWER"]
+
+async def grounded_check_async(answer, contexts, model):
+    prompt = grounded_prompt(answer, contexts)
+    with tracing.span("llm.ground"):
+        response = await llm_scheduler.generate_async(model, prompt, purpose="ground",
+                                                      generation_config={"temperature": 0})
+    tracing.record_llm("ground", response)
+    return "YES" in response.text.upper()
+
+async def verify_grounding_async(answer, contexts: list, model):
+    if grounding.is_no_answer(answer):
+        tracing.count("rag_grounding_verdicts_total", source="no_answer", grounded=True)
+        return True
+    if GROUNDING_VERIFIER == "hybrid":
+        verdict = await asyncio.to_thread(tracing.propagate(local_grounding), answer, contexts)
+        if verdict["grounded"] is not None:
+            tracing.count("rag_grounding_verdicts_total", source="local", grounded=verdict["grounded"])
+            return verdict["grounded"]
+    grounded = await grounded_check_async(answer, "\n".join(contexts), model)
+    tracing.count("rag_grounding_verdicts_total", source="llm", grounded=grounded)
+    return grounded
+
+async def timed_await(timings: dict, stage: str, awaitable):
+    with stage_timer(timings, stage):
+        return await awaitable
+
+async def agentic_answer_async(query: str, supabase, model, request_id: str = None):
+    return (await run_agent_async(query, supabase, model, request_id=request_id))["answer"]
+
+async def run_agent_async(query: str, supabase, model, request_id: str = None):
+    async for event, data in agent_events_async(query, supabase, model, request_id=request_id):
+        pass
+    return data
+
+async def shared_answer_async(query: str, supabase, model, request_id: str = None):
+    """shared_answer for the async route."""
+    if not CHAT_SINGLE_FLIGHT:
+        return await agentic_answer_async(query, supabase, model, request_id=request_id)
+    return await _CHAT_FLIGHTS.do_async(normalize_query(query), agentic_answer_async, query, supabase, model,
+                                        request_id=request_id, timeout=CHAT_SINGLE_FLIGHT_TIMEOUT)
+
+async def agent_events_async(query: str, supabase, model, stream: bool = False,
+                             speculative: bool = SPECULATIVE_RETRIEVAL, request_id: str = None):
+    """agent_events as an async generator, same events in the same order."""
+    with tracing.request_context(request_id), tracing.span("request", stream=stream) as span:
+        async for event, data in _agent_events_async(query, supabase, model, stream, speculative):
+            if event == "done":
+                span.set(cached=data["cached"], grounded=data["grounded"])
+            yield event, data
+
+async def _agent_events_async(query: str, supabase, model, stream: bool, speculative: bool):
+    timings = {}
+    started = time.perf_counter()
+
+    with stage_timer(timings, "embed"):
+        query_embedding = await embed_text_async(query)
+
+    if ANSWER_CACHE_ENABLED:
+        # a Supabase read once every CORPUS_VERSION_TTL seconds, so off the event loop
+        version = await asyncio.to_thread(get_corpus_version, supabase)
+        hit = answer_cache.get_cache().lookup(query_embedding, version)
+        tracing.count("rag_answer_cache_lookups_total", result="hit" if hit else "miss")
+        if hit:
+            if stream:
+                yield "token", {"text": hit["answer"]}
+            timings["total"] = time.perf_counter() - started
+            yield "done", {
+                "documents": hit["documents"],
+                "sources": cite_sources(hit["documents"]),
+                "answer": hit["answer"],
+                "grounded": True,
+                "cached": True,
+                "timings": timings
+            }
+            return
+
+    retrieval = None
+    if speculative:
+        retrieval = asyncio.create_task(
+            timed_await(timings, "retrieve", hybrid_retrieve_async(query, supabase, 10)))
+
+    yield "stage", {"stage": "planning"}
+    plan_started = time.perf_counter()
+    try:
+        with stage_timer(timings, "plan"):
+            steps = await route_async(query, query_embedding, model, plan_async)
+    except BaseException:
+        if retrieval:
+            retrieval.cancel()
+        raise
+    if retrieval and "RETRIEVE" not in steps:
+        retrieval.cancel()
+        retrieval = None
+
+    memory = {
+        "documents" : [],
+        "sources" : [],
+        "answer" : None,
+        "grounded" : False,
+        "cached" : False,
+        "timings" : timings
+    }
+
+    for step in steps:
+        if step == "RETRIEVE":
+            yield "stage", {"stage": "retrieving"}
+            if retrieval:
+                retrieved_docs = await retrieval
+                overlapped = time.perf_counter() - plan_started
+                timings["overlap_saved"] = max(0.0, timings["plan"] + timings["retrieve"] - overlapped)
+            else:
+                retrieved_docs = await timed_await(timings, "retrieve", hybrid_retrieve_async(query, supabase, 10))
+            yield "stage", {"stage": "reranking"}
+            with stage_timer(timings, "rerank"):
+                reranked_docs = await rerank_async(query, retrieved_docs, model, top_k=3)
+            memory["documents"] = reranked_docs
+
+        elif step == "ANSWER":
+            yield "stage", {"stage": "generating"}
+            contexts = prompt_contexts(query, memory["documents"])
+            prompt = build_prompt(query, contexts)
+            with stage_timer(timings, "generate"):
+                if stream:
+                    parts, chunk = [], None
+                    async for chunk in await llm_scheduler.generate_async(model, prompt, purpose="answer",
+                                                                          stream=True):
+                        parts.append(chunk.text)
+                        yield "token", {"text": chunk.text}
+                    if chunk is not None:
+                        tracing.record_llm("answer", chunk)
+                    answer = "".join(parts).strip()
+                else:
+                    response = await llm_scheduler.generate_async(model, prompt, purpose="answer")
+                    tracing.record_llm("answer", response)
+                    answer = response.text.strip()
+
+            yield "stage", {"stage": "grounding"}
+            check = asyncio.create_task(
+                timed_await(timings, "ground", verify_grounding_async(answer, contexts, model)))
+            memory["sources"] = cite_sources(memory["documents"])
+            if stream:
+                yield "sources", {"sources": memory["sources"]}
+            if await check:
+                memory["answer"] = answer
+                memory["grounded"] = True
+            else:
+                memory["answer"] = UNGROUNDED_ANSWER
+
+        elif step == "REFUSE":
+            memory["answer"] = REFUSAL_ANSWER
+            memory["grounded"] = True
+            if stream:
+                yield "token", {"text": REFUSAL_ANSWER}
+
+    if ANSWER_CACHE_ENABLED and memory["grounded"]:
+        answer_cache.get_cache().store(query, query_embedding, memory["answer"], memory["documents"], version)
+    timings["total"] = time.perf_counter() - started
+    yield "done", memory
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+import tracing
+from app_rag import agent_events_async, shared_answer_async
+
+# ASGI entry point: `uvicorn asgi:app`
+# /chat and /chat/stream run the async agent (app_rag.agent_events_async), so an in-flight chat waiting on
+# Gemini or Supabase is a suspended coroutine rather than a blocked worker thread. Everything else (the
+# page, static files, /metrics) is served by the Flask app. ASYNC_MAX_INFLIGHT caps the chats held in
+# memory at once; past it requests get a 503 instead of queueing without bound.
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "512"))
+MAX_BODY_BYTES = 64 * 1024
+
+_FLASK = WsgiToAsgi(flask_app.app)
+_inflight = 0
+
+
+async def read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        return None
+
+async def send_json(send, status: int, payload: dict, headers: list):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json")] + headers
+    })
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode("utf-8")})
+
+def request_id_of(scope):
+    for name, value in scope["headers"]:
+        if name == b"x-request-id":
+            return value.decode("latin-1")
+    return tracing.new_request_id()
+
+
+async def chat(request_id, query, send, headers):
+    try:
+        answer = await shared_answer_async(query, flask_app.supabase, flask_app.model, request_id=request_id)
+    except TimeoutError as e:
+        await send_json(send, 504, {"error": str(e)}, headers)
+        return 504
+    await send_json(send, 200, {"answer": answer}, headers)
+    return 200
+
+async def chat_stream(request_id, query, send, headers):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no")] + headers
+    })
+    try:
+        async for event, payload in agent_events_async(query, flask_app.supabase, flask_app.model, stream=True,
+                                                       request_id=request_id):
+            if event == "done":
+                payload = {
+                    "answer": payload["answer"],
+                    "grounded": payload["grounded"],
+                    "cached": payload["cached"],
+                    "sources": payload["sources"],
+                    "timings": payload["timings"]
+                }
+            await send({"type": "http.response.body", "body": flask_app.sse(event, payload).encode("utf-8"),
+                        "more_body": True})
+    except Exception as e:
+        await send({"type": "http.response.body", "body": flask_app.sse("error", {"error": str(e)}).encode("utf-8"),
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+    return 200
+
+ROUTES = {
+    "/chat": ("chat", chat),
+    "/chat/stream": ("chat_stream", chat_stream),
+}
+
+
+async def app(scope, receive, send):
+    global _inflight
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # the server takes no connections until startup completes, so the first chat finds a warm worker
+                if flask_app.WARMUP_ON_START:
+                    await asyncio.to_thread(flask_app.warm)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    route = ROUTES.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+    if route is None:
+        return await _FLASK(scope, receive, send)
+
+    endpoint, handler = route
+    request_id = request_id_of(scope)
+    headers = [(b"x-request-id", request_id.encode("latin-1"))]
+    data = await read_json(receive)
+    query = data.get("message") if isinstance(data, dict) else None
+    if not query:
+        status = 400
+        await send_json(send, status, {"error": "Empty message"}, headers)
+    elif _inflight >= ASYNC_MAX_INFLIGHT:
+        status = 503
+        await send_json(send, status, {"error": "Too many chats in flight, retry shortly"},
+                        headers + [(b"retry-after", b"1")])
+    else:
+        _inflight += 1
+        try:
+            status = await handler(request_id, query, send, headers)
+        finally:
+            _inflight -= 1
+    tracing.count("rag_http_requests_total", endpoint=endpoint, status=status)
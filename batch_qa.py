@@ -0,0 +1,153 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import tracing
+from app_rag import embed_texts, run_agent
+from query_text import normalize_query
+
+# Batch question answering, behind POST /chat/batch and `python batch_qa.py questions.jsonl`
+# Input is JSONL, one {"id": ..., "question": ...} per line ("message" / "query" are accepted too, a bare
+# JSON string is a question without id).
+#   embed  : all questions are embedded up front, BATCH_EMBED_SIZE per request; the vectors land in the
+#            embedding cache, so the agent runs below never embed a question again
+#   dedupe : questions that normalise to the same text, or whose embeddings have a cosine similarity of at
+#            least BATCH_DEDUP_SIMILARITY, run once; the copies share its retrieval, rerank and answer and
+#            are marked duplicate_of the question that ran
+#   answer : the distinct questions go through the agent BATCH_CONCURRENCY at a time and results are
+#            emitted as JSONL in completion order, each with its stage timings (plus "queued", the time it
+#            waited for a worker)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_EMBED_SIZE = int(os.getenv("BATCH_EMBED_SIZE", "100"))
+BATCH_DEDUP_SIMILARITY = float(os.getenv("BATCH_DEDUP_SIMILARITY", "0.97"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+
+
+def parse_questions(lines):
+    """JSONL lines -> [{"id", "question"}], question is None for lines that hold no question."""
+    items = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if isinstance(record, str):
+            record = {"question": record}
+        if not isinstance(record, dict):
+            items.append({"id": number, "question": None})
+            continue
+        question = record.get("question") or record.get("message") or record.get("query")
+        items.append({"id": record.get("id", number), "question": question if isinstance(question, str) else None})
+    return items
+
+def embed_questions(questions: list, batch_size: int = BATCH_EMBED_SIZE):
+    vectors = []
+    for start in range(0, len(questions), batch_size):
+        vectors.extend(embed_texts(questions[start:start + batch_size]))
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(questions), -1)
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+
+def dedupe(questions: list, vectors, similarity: float = BATCH_DEDUP_SIMILARITY):
+    """Group near-identical questions; returns {leader index: [member indexes, leader first]}."""
+    groups, leaders, by_text = {}, [], {}
+    for i, question in enumerate(questions):
+        leader = by_text.get(normalize_query(question))
+        if leader is None and leaders:
+            scores = vectors[leaders] @ vectors[i]
+            best = int(np.argmax(scores))
+            if scores[best] >= similarity:
+                leader = leaders[best]
+        if leader is None:
+            leader = i
+            leaders.append(i)
+            groups[i] = []
+        by_text.setdefault(normalize_query(question), leader)
+        groups[leader].append(i)
+    return groups
+
+
+def answer_batch(items: list, supabase, model, concurrency: int = BATCH_CONCURRENCY, batch_id: str = None):
+    """Answer parsed questions, yielding one result dict per item as soon as its answer is ready."""
+    batch_id = batch_id or tracing.new_request_id()
+    started = time.perf_counter()
+
+    for item in items:
+        if not item["question"]:
+            yield {"id": item["id"], "question": None, "error": "No question on this line"}
+    valid = [item for item in items if item["question"]]
+    if not valid:
+        return
+
+    questions = [item["question"] for item in valid]
+    with tracing.request_context(batch_id), tracing.span("batch.embed", questions=len(questions)):
+        embed_started = time.perf_counter()
+        groups = dedupe(questions, embed_questions(questions))
+        embed_seconds = time.perf_counter() - embed_started
+    tracing.count("rag_batch_questions_total", len(questions), kind="asked")
+    tracing.count("rag_batch_questions_total", len(groups), kind="answered")
+
+    def run(leader: int):
+        queued = time.perf_counter() - started
+        memory = run_agent(questions[leader], supabase, model, request_id=f"{batch_id}-{leader}")
+        return memory, queued
+
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        futures = {pool.submit(tracing.propagate(run), leader): leader for leader in groups}
+        for future in as_completed(futures):
+            leader = futures[future]
+            try:
+                memory, queued = future.result()
+                result = {
+                    "answer": memory["answer"],
+                    "grounded": memory["grounded"],
+                    "cached": memory["cached"],
+                    "sources": memory["sources"],
+                    "timings": {"batch_embed": embed_seconds, "queued": queued, **memory["timings"]},
+                }
+            except Exception as e:
+                result = {"error": str(e)}
+            for member in groups[leader]:
+                yield {
+                    "id": valid[member]["id"],
+                    "question": questions[member],
+                    **result,
+                    "duplicate_of": valid[leader]["id"] if member != leader else None,
+                }
+    finally:
+        # a client that stops reading (closed connection) drops the questions not yet started
+        pool.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == "__main__":
+    import argparse
+    from agentic_rag import SUPABASE_CLIENT, model
+
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions, writing JSONL results")
+    parser.add_argument("questions", help="JSONL file, - for stdin")
+    parser.add_argument("--output", "-o", help="results file (default stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    args = parser.parse_args()
+
+    source = sys.stdin if args.questions == "-" else open(args.questions)
+    with source:
+        items = parse_questions(source)
+    out = open(args.output, "w") if args.output else sys.stdout
+
+    started = time.perf_counter()
+    counts = {"results": 0, "errors": 0, "duplicates": 0}
+    with out:
+        for result in answer_batch(items, SUPABASE_CLIENT, model, args.concurrency):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            counts["results"] += 1
+            counts["errors"] += "error" in result
+            counts["duplicates"] += result.get("duplicate_of") is not None
+    print(f"{counts['results']} results ({counts['duplicates']} duplicates, {counts['errors']} errors) "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
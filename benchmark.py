@@ -0,0 +1,272 @@
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import app_rag
+import embedding_cache
+import llm_scheduler
+import query_router
+import rerank_cache
+from embedding_cache import EmbeddingCache
+from rerank_cache import RerankCache
+from fakes import FakeEmbedder, FakeModel, FakeSupabase
+
+# Latency benchmark for the chat pipeline, runnable offline
+#   stages: times every stage of the agent (embed, plan, retrieve, rerank, generate, ground) per query
+#   load  : drives concurrent requests at the Flask /chat route and reports p50/p95/p99 latency and QPS
+#   batch : posts --batch questions (the queries repeated with case and punctuation changes) to /chat/batch
+# Gemini and Supabase are replaced by fakes.py backends with configurable injected latency, and the
+# results are written as JSON so runs on different commits can be compared with --compare.
+
+STAGES = ["embed", "plan", "retrieve", "rerank", "generate", "ground", "total"]
+
+
+def percentile(values: list, pct: float):
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+def summarize(seconds: list):
+    ms = [s * 1000 for s in seconds]
+    return {
+        "n": len(ms),
+        "mean_ms": sum(ms) / len(ms),
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+    }
+
+
+# Backends
+def configure_backends(args):
+    embedding_cache.set_cache(EmbeddingCache(path=""))
+    embedding_cache.set_embed_fn(FakeEmbedder(latency=args.embed_latency))
+    rerank_cache.set_cache(RerankCache(path=""))
+    rerank_cache.RERANK_CACHE_ENABLED = args.rerank_cache
+    app_rag.ANSWER_CACHE_ENABLED = args.answer_cache
+    query_router.ROUTER_ENABLED = args.router
+    llm_scheduler.LLM_SCHEDULER_ENABLED = not args.no_scheduler
+    app_rag.CHAT_SINGLE_FLIGHT = not args.no_single_flight
+    if args.llm_quota:
+        # keep the scheduler just under the fake quota, which is counted per second
+        llm_scheduler.set_scheduler(llm_scheduler.LLMScheduler(rpm=args.llm_quota * 60 * 0.9, burst_seconds=0.5))
+    else:
+        # the fakes have no quota, don't let the production LLM_RPM default throttle the pipeline timings
+        llm_scheduler.set_scheduler(llm_scheduler.LLMScheduler(rpm=0, tpm=0))
+    model = FakeModel(latency=args.llm_latency, jitter=args.llm_jitter, token_latency=args.token_latency,
+                      quota=args.llm_quota)
+    store = FakeSupabase(latency=args.store_latency)
+    return model, store
+
+
+# Stage timings
+def bench_stages(queries: list, store, model, rounds: int):
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()): # the agent prints its plan for every query
+        for _ in range(rounds):
+            for query in queries:
+                memory = app_rag.run_agent(query, store, model)
+                for stage, seconds in memory["timings"].items():
+                    timings.setdefault(stage, []).append(seconds)
+    ordered = STAGES + sorted(set(timings) - set(STAGES))
+    return {stage: summarize(timings[stage]) for stage in ordered if stage in timings}
+
+
+# Load against the Flask app
+def load_app(store, model):
+    import app
+    app.supabase = store
+    app.model = model
+    return app.app
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def bench_load(flask_app, queries: list, requests: int, concurrency: int):
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/chat"
+
+    def send(i):
+        body = json.dumps({"message": queries[i % len(queries)]}).encode("utf-8")
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+            ok = True
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(send, range(requests)))
+        wall = time.perf_counter() - start
+    server.shutdown()
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(not ok for _, ok in results),
+        "seconds": wall,
+        "qps": requests / wall,
+        "latency": summarize([seconds for seconds, _ in results]),
+    }
+
+
+def bench_batch(flask_app, queries: list, size: int, model):
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    variants = [str.lower, str.upper, lambda q: q.rstrip("?") + " ?"]
+    lines = []
+    for i in range(size):
+        query = queries[i % len(queries)]
+        if i >= len(queries):
+            query = variants[(i // len(queries)) % len(variants)](query)
+        lines.append(json.dumps({"id": i, "question": query}))
+    request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}/chat/batch",
+                                     data="\n".join(lines).encode("utf-8"),
+                                     headers={"Content-Type": "application/x-ndjson"})
+
+    calls_before = model.calls
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        results, first = [], None
+        with urllib.request.urlopen(request, timeout=600) as response:
+            for line in response:
+                first = first or time.perf_counter() - start
+                results.append(json.loads(line))
+        wall = time.perf_counter() - start
+    server.shutdown()
+
+    return {
+        "questions": size,
+        "results": len(results),
+        "errors": sum("error" in r for r in results),
+        "duplicates": sum(r.get("duplicate_of") is not None for r in results),
+        "seconds": wall,
+        "first_result_seconds": first,
+        "llm_calls": model.calls - calls_before,
+        "latency": summarize([r["timings"]["queued"] + r["timings"]["total"] for r in results if "timings" in r]),
+    }
+
+
+# Reporting
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def flatten(results: dict):
+    metrics = {}
+    for stage, summary in results.get("stages", {}).items():
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            metrics[f"stage.{stage}.{key}"] = summary[key]
+    load = results.get("load")
+    if load:
+        metrics["load.qps"] = load["qps"]
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            metrics[f"load.{key}"] = load["latency"][key]
+    return metrics
+
+def print_comparison(current: dict, baseline: dict):
+    print(f"\n=== {baseline.get('commit')} -> {current.get('commit')} ===")
+    before, after = flatten(baseline), flatten(current)
+    for name in sorted(after):
+        if name in before and before[name]:
+            change = (after[name] - before[name]) / before[name] * 100
+            print(f"{name:<28} {before[name]:>10.1f} {after[name]:>10.1f} {change:>+8.1f}%")
+
+def print_results(results: dict):
+    print("\n=== STAGE LATENCY (ms) ===")
+    print(f"{'stage':<14}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}")
+    for stage, s in results["stages"].items():
+        print(f"{stage:<14}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['mean_ms']:>10.1f}")
+    llm = results.get("llm")
+    if llm:
+        print(f"\nLLM calls {llm['calls']} | rate limited {llm['rate_limited']} | scheduler {llm.get('scheduler')}")
+        if "rerank_cache" in llm:
+            print(f"Rerank cache {llm['rerank_cache']}")
+    load = results.get("load")
+    if load:
+        print(f"\n=== /chat LOAD ({load['requests']} requests, concurrency {load['concurrency']}) ===")
+        print(f"{load['distinct']} distinct questions | {load['llm_calls']} LLM calls "
+              f"({load['llm_calls'] / load['requests']:.1f} per request)")
+        print(f"QPS {load['qps']:.1f} | errors {load['errors']} | p50 {load['latency']['p50_ms']:.1f} ms | "
+              f"p95 {load['latency']['p95_ms']:.1f} ms | p99 {load['latency']['p99_ms']:.1f} ms")
+    batch = results.get("batch")
+    if batch:
+        print(f"\n=== /chat/batch ({batch['questions']} questions) ===")
+        print(f"{batch['results']} results | {batch['duplicates']} deduplicated | errors {batch['errors']} | "
+              f"{batch['llm_calls']} LLM calls")
+        print(f"first result {batch['first_result_seconds'] * 1000:.0f} ms | all {batch['seconds']:.1f}s | "
+              f"per question p50 {batch['latency']['p50_ms']:.1f} ms | p95 {batch['latency']['p95_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency benchmark for the chat pipeline")
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the queries for stage timings")
+    parser.add_argument("--requests", type=int, default=200, help="requests sent to /chat, 0 skips the load test")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per fake LLM call")
+    parser.add_argument("--llm-jitter", type=float, default=0.02)
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per streamed token")
+    parser.add_argument("--llm-quota", type=int, default=0, help="fake LLM calls allowed per second, 0 for none")
+    parser.add_argument("--no-scheduler", action="store_true", help="call the model directly (LLM_SCHEDULER_ENABLED=0)")
+    parser.add_argument("--no-single-flight", action="store_true", help="every /chat request runs its own agent")
+    parser.add_argument("--distinct", type=int, default=0, help="burst: load test with only the first N questions")
+    parser.add_argument("--batch", type=int, default=0, help="questions posted to /chat/batch, 0 skips it")
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--store-latency", type=float, default=0.02)
+    parser.add_argument("--answer-cache", action="store_true", help="keep the semantic answer cache on")
+    parser.add_argument("--rerank-cache", action="store_true", help="keep the rerank score cache on")
+    parser.add_argument("--router", action="store_true", help="keep the local query router on")
+    parser.add_argument("--queries", default="ground_truth.json")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = [item["query"] for item in json.load(f)]
+
+    model, store = configure_backends(args)
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "stages": bench_stages(queries, store, model, args.rounds),
+    }
+    if args.requests:
+        calls_before = model.calls
+        load_queries = queries[:args.distinct] if args.distinct else queries
+        results["load"] = bench_load(load_app(store, model), load_queries, args.requests, args.concurrency)
+        results["load"]["distinct"] = len(load_queries)
+        results["load"]["llm_calls"] = model.calls - calls_before
+    if args.batch:
+        results["batch"] = bench_batch(load_app(store, model), queries, args.batch, model)
+    results["llm"] = {"calls": model.calls, "rate_limited": model.rate_limited}
+    if rerank_cache.RERANK_CACHE_ENABLED:
+        results["llm"]["rerank_cache"] = rerank_cache.get_cache().stats()
+    if llm_scheduler.LLM_SCHEDULER_ENABLED:
+        results["llm"]["scheduler"] = llm_scheduler.get_scheduler().stats()
+
+    print_results(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
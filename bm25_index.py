@@ -0,0 +1,178 @@
+import json
+import math
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+
+from corpus import get_corpus_version
+
+# Local BM25 index
+#   vocab.json   : term -> term id
+#   offsets.npy  : postings for term t live in [offsets[t], offsets[t+1])
+#   doc_ids.npy  : int32 row ids, grouped by term
+#   tfs.npy      : uint16 term frequencies, parallel to doc_ids
+#   lengths.npy  : token count per row
+#   chunks.json  : content + metadata (source, chunk_id) per row
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", "index_bm25")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "i", "if", "in", "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "when", "where", "which", "who", "why", "will", "with", "you", "your"
+}
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text: str):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, vocab: dict, offsets, doc_ids, tfs, lengths, records: list,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.lengths = lengths
+        self.records = records
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(lengths.mean()) if len(lengths) else 0.0
+
+    @classmethod
+    def build(cls, records: list):
+        """Build from {"content", "metadata"} records, e.g. the chunk_text output of each PDF."""
+        postings = {}
+        lengths = np.zeros(len(records), dtype=np.int32)
+        for row, record in enumerate(records):
+            tokens = tokenize(record["content"])
+            lengths[row] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((row, count))
+
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for term, term_id in vocab.items():
+            offsets[term_id + 1] = len(postings[term])
+        offsets = np.cumsum(offsets)
+
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for term, term_id in vocab.items():
+            start, end = offsets[term_id], offsets[term_id + 1]
+            rows, counts = zip(*postings[term])
+            doc_ids[start:end] = rows
+            tfs[start:end] = np.minimum(counts, np.iinfo(np.uint16).max)
+
+        records = [{"content": r["content"], "metadata": r["metadata"]} for r in records]
+        return cls(vocab, offsets, doc_ids, tfs, lengths, records)
+
+    def save(self, path: str = BM25_INDEX_DIR):
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in ("offsets", "doc_ids", "tfs", "lengths"):
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, "vocab.json"), "w") as f:
+            json.dump(self.vocab, f)
+        with open(os.path.join(tmp_path, "chunks.json"), "w") as f:
+            json.dump(self.records, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        print(f"Built BM25 index with {len(self.records)} chunks, {len(self.vocab)} terms at {path}")
+
+    @classmethod
+    def load(cls, path: str = BM25_INDEX_DIR):
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ("offsets", "doc_ids", "tfs", "lengths")
+        }
+        with open(os.path.join(path, "vocab.json")) as f:
+            vocab = json.load(f)
+        with open(os.path.join(path, "chunks.json")) as f:
+            records = json.load(f)
+        return cls(vocab, records=records, **arrays)
+
+    def __len__(self):
+        return len(self.records)
+
+    def scores(self, query: str):
+        scores = np.zeros(len(self.records), dtype=np.float32)
+        n = len(self.records)
+        for token in set(tokenize(query)):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[rows] / self.avg_length)
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, top_k: int = 10):
+        if not len(self):
+            return []
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        top_k = min(top_k, len(hits))
+        top = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {
+                "content": self.records[i]["content"],
+                "metadata": self.records[i]["metadata"],
+                "bm25_score": float(scores[i])
+            }
+            for i in top
+        ]
+
+
+# Shared instance
+_INDEX = None # (corpus version, index)
+_INDEX_LOCK = threading.Lock()
+
+def get_index(path: str = BM25_INDEX_DIR):
+    """The shared index, reloaded once the corpus version moves so workers pick up a rebuild by ingest."""
+    global _INDEX
+    version = get_corpus_version()
+    loaded = _INDEX
+    if loaded is None or loaded[0] != version:
+        with _INDEX_LOCK:
+            loaded = _INDEX
+            if loaded is None or loaded[0] != version:
+                _INDEX = loaded = (version, BM25Index.load(path))
+    return loaded[1]
+
+def reset_index():
+    global _INDEX
+    with _INDEX_LOCK:
+        _INDEX = None
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from supabase import create_client
+    from vector_index import fetch_rows
+
+    parser = argparse.ArgumentParser(description="Build the local BM25 index from the Supabase documents table")
+    parser.add_argument("--out", default=BM25_INDEX_DIR)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+    BM25Index.build(fetch_rows(client, columns="content,metadata")).save(args.out)
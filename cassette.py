@@ -0,0 +1,172 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import embedding_cache
+import rerank_cache
+from embedding_cache import EMBED_MODEL, EmbeddingCache
+from rerank_cache import RerankCache
+
+# Record / replay of every Gemini and Supabase call made by agentic_rag.py
+#   record : calls go to the live services and each response is saved in the cassette file
+#   replay : responses come from the cassette, nothing touches the network and no credentials are needed
+# Entries are keyed by a hash of the request (prompt + generation config, RPC name + params, query chain,
+# embedding model + text), so replayed calls can run in any order and in parallel.
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off") # off | record | replay
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassettes/evaluation.json")
+
+MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(KeyError):
+    """A replayed request that was never recorded, re-record with CASSETTE_MODE=record."""
+
+
+def request_key(kind: str, request: dict):
+    payload = json.dumps({"kind": kind, **request}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str = CASSETTE_PATH, mode: str = "replay"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.entries = {}
+        self.counters = {"replayed": 0, "recorded": 0}
+        self._lock = threading.Lock()
+        # recording starts from an empty cassette so requests that are no longer made drop out
+        if mode == "replay":
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def call(self, kind: str, request: dict, live_fn):
+        """Return the recorded response for this request, calling live_fn() to record it first."""
+        key = request_key(kind, request)
+        if self.mode == "replay":
+            with self._lock:
+                entry = self.entries.get(key)
+                self.counters["replayed"] += 1
+            if entry is None:
+                raise CassetteMiss(f"No recorded {kind} response for {json.dumps(request, default=str)[:200]}")
+            return entry["response"]
+
+        response = live_fn()
+        with self._lock:
+            self.entries[key] = {"kind": kind, "request": request, "response": response}
+            self.counters["recorded"] += 1
+        return response
+
+    def save(self):
+        if self.mode != "record":
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._lock, open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "entries": len(self.entries)}
+
+
+# Gemini
+class CassetteResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class CassetteModel:
+    """Wraps genai.GenerativeModel; only the response text is kept."""
+
+    def __init__(self, model, cassette: Cassette, model_name: str = None):
+        self.model = model
+        self.cassette = cassette
+        self.model_name = model_name or getattr(model, "model_name", None)
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None):
+        # request_options only carries timeouts, it doesn't change the answer
+        request = {"model": self.model_name, "prompt": prompt, "generation_config": generation_config}
+
+        def live():
+            if not stream:
+                return self.model.generate_content(prompt, generation_config=generation_config,
+                                                   request_options=request_options).text
+            chunks = self.model.generate_content(prompt, generation_config=generation_config, stream=True,
+                                                 request_options=request_options)
+            return "".join(chunk.text for chunk in chunks)
+
+        text = self.cassette.call("generate", request, live)
+        return iter([CassetteResponse(text)]) if stream else CassetteResponse(text)
+
+
+# Supabase
+class CassetteQuery:
+    """Records the builder chain (rpc, table, select, eq, ...) and keys the cassette entry on it at execute()."""
+
+    def __init__(self, client, cassette: Cassette, chain: list):
+        self.client = client
+        self.cassette = cassette
+        self.chain = chain
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: CassetteQuery(self.client, self.cassette,
+                                                     self.chain + [[name, list(args), kwargs]])
+
+    def execute(self):
+        def live():
+            target = self.client
+            for name, args, kwargs in self.chain:
+                target = getattr(target, name)(*args, **kwargs)
+            return target.execute().data
+
+        return SimpleNamespace(data=self.cassette.call("supabase", {"chain": self.chain}, live))
+
+
+class CassetteSupabase:
+    def __init__(self, client, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+
+    def rpc(self, name: str, params: dict):
+        return CassetteQuery(self.client, self.cassette, [["rpc", [name, params], {}]])
+
+    def table(self, name: str):
+        return CassetteQuery(self.client, self.cassette, [["table", [name], {}]])
+
+
+# Embeddings
+def cassette_embed_fn(cassette: Cassette, embed_fn):
+    """embedding_cache backend that records one entry per text, so batches can be split differently on replay."""
+    def embed(texts: list, model: str = EMBED_MODEL):
+        if cassette.mode == "replay":
+            return [cassette.call("embed", {"model": model, "text": text}, None) for text in texts]
+        embeddings = embed_fn(texts, model=model)
+        for text, embedding in zip(texts, embeddings):
+            cassette.call("embed", {"model": model, "text": text}, lambda: list(embedding))
+        return embeddings
+    return embed
+
+
+def use_cassette(supabase_client, model, mode: str = CASSETTE_MODE, path: str = CASSETTE_PATH):
+    """Route the clients (and the query embedder) through a cassette; returns them unchanged when mode is off."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown cassette mode: {mode}")
+    if mode == "off":
+        return supabase_client, model, None
+
+    cassette = Cassette(path, mode)
+    # in-memory embedding and rerank caches, otherwise hits from the SQLite caches would never reach the cassette
+    embedding_cache.set_cache(EmbeddingCache(path=""))
+    rerank_cache.set_cache(RerankCache(path=""))
+    embedding_cache.set_embed_fn(cassette_embed_fn(cassette, embedding_cache.gemini_embed))
+    if mode == "record":
+        atexit.register(cassette.save)
+    return CassetteSupabase(supabase_client, cassette), CassetteModel(model, cassette), cassette
@@ -0,0 +1,192 @@
+import re
+
+from pypdf import PdfReader
+
+# Streaming PDF loading and chunking
+# Pages are read one at a time and chunks are yielded as soon as they are complete, so peak memory is
+# one page plus one chunk regardless of document length. Every chunk carries the page it starts on
+# (and ends on) and its character offset within that page.
+#   fixed      : the original 800/100 character windows, byte-for-byte the same chunks as
+#                chunk_text(load_pdf(path)), so existing chunk_ids and ground_truth.json stay valid
+#   structured : sentence / section / table-row aware chunks packed under a token budget
+
+SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[A-Z0-9(\"'•-])")
+TABLE_ROW_RE = re.compile(r"\S(?: {2,}|\t)\S.*\S(?: {2,}|\t)\S") # three or more columns
+HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?\s+)?[A-Z][^.!?:;]{0,78}$")
+LINE_RE = re.compile(r"[^\n]*\n?")
+
+
+def iter_pdf_pages(file_path: str):
+    """Yield (page_number, text) for every page with text, starting at 1."""
+    reader = PdfReader(file_path)
+    for page_number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text()
+        if text:
+            yield page_number, text
+
+def estimate_tokens(text: str):
+    return max(1, len(text) // 4)
+
+
+# Fixed windows
+def iter_fixed_chunks(pages, chunk_size: int = 800, overlap: int = 100):
+    step = chunk_size - overlap
+    buffer, buffer_start = "", 0 # buffer holds the document text from global offset buffer_start
+    total, start = 0, 0
+    page_starts = []             # (global offset, page number) of pages still in the buffer
+
+    def make_chunk(start):
+        while len(page_starts) > 1 and page_starts[1][0] <= start:
+            page_starts.pop(0)
+        end = min(start + chunk_size, total)
+        page_offset, page_number = page_starts[0]
+        page_end = page_number
+        for offset, number in page_starts:
+            if offset < end:
+                page_end = number
+        return {
+            "text": buffer[start - buffer_start:end - buffer_start],
+            "page": page_number,
+            "page_end": page_end,
+            "char_start": max(0, start - page_offset)
+        }
+
+    for page_number, text in pages:
+        if total:
+            buffer += "\n" # pages are joined the same way load_pdf joins them
+            total += 1
+        page_starts.append((total, page_number))
+        buffer += text
+        total += len(text)
+        while start + chunk_size <= total:
+            yield make_chunk(start)
+            start += step
+            buffer, buffer_start = buffer[start - buffer_start:], start
+
+    while start < total:
+        yield make_chunk(start)
+        start += step
+
+
+# Structure-aware chunks
+def looks_like_heading(line: str):
+    if not HEADING_RE.match(line) or len(line.split()) > 10:
+        return False
+    if re.match(r"\d+(?:\.\d+)*\.?\s", line) or line.isupper():
+        return True
+    # wrapped sentence fragments start with a capital too, headings capitalise most of their words
+    words = [w for w in line.split() if len(w) > 3]
+    return bool(words) and sum(w[0].isupper() for w in words) / len(words) >= 0.6
+
+def iter_units(page_number: int, text: str):
+    """Split a page into headings, table rows and sentences, keeping their offsets in the page."""
+    paragraph, paragraph_start = "", 0
+    offset = 0
+
+    def flush_paragraph():
+        if not paragraph.strip():
+            return
+        cursor = 0
+        for match in list(SENTENCE_BREAK_RE.finditer(paragraph)) + [None]:
+            end = match.start() if match else len(paragraph)
+            sentence = " ".join(paragraph[cursor:end].split())
+            if sentence:
+                yield {"kind": "sentence", "text": sentence, "page": page_number, "offset": paragraph_start + cursor}
+            cursor = match.end() if match else end
+
+    for line in LINE_RE.findall(text):
+        stripped = line.strip()
+        line_start = offset
+        offset += len(line)
+        if not line:
+            break
+        kind = None
+        if not stripped:
+            kind = "blank"
+        elif TABLE_ROW_RE.search(stripped):
+            kind = "table"
+        elif looks_like_heading(stripped) and (not paragraph.strip() or paragraph.rstrip()[-1] in ".!?:"):
+            kind = "heading"
+
+        if kind is None:
+            if not paragraph:
+                paragraph_start = line_start
+            paragraph += line
+            continue
+
+        yield from flush_paragraph()
+        paragraph = ""
+        if kind != "blank":
+            yield {"kind": kind, "text": " ".join(stripped.split()), "page": page_number, "offset": line_start}
+    yield from flush_paragraph()
+
+def split_long_unit(unit: dict, max_tokens: int):
+    words = unit["text"].split()
+    part = []
+    for word in words:
+        if part and estimate_tokens(" ".join(part + [word])) > max_tokens:
+            yield {**unit, "text": " ".join(part)}
+            part = []
+        part.append(word)
+    if part:
+        yield {**unit, "text": " ".join(part)}
+
+def iter_structured_chunks(pages, max_tokens: int = 200, overlap_tokens: int = 25):
+    current, section = [], None
+
+    def make_chunk(units):
+        text = ""
+        for unit in units:
+            if text:
+                text += " " if unit["kind"] == "sentence" and prev_kind == "sentence" else "\n"
+            text += unit["text"]
+            prev_kind = unit["kind"]
+        return {
+            "text": text,
+            "page": units[0]["page"],
+            "page_end": units[-1]["page"],
+            "char_start": units[0]["offset"],
+            "section": section
+        }
+
+    def overlap_tail(units):
+        # carry the last sentences (never a heading) into the next chunk
+        tail, tokens = [], 0
+        for unit in reversed(units):
+            tokens += estimate_tokens(unit["text"])
+            if unit["kind"] == "heading" or tokens > overlap_tokens:
+                break
+            tail.insert(0, unit)
+        return tail
+
+    for page_number, text in pages:
+        for unit in iter_units(page_number, text):
+            if unit["kind"] == "heading":
+                # a new section never shares a chunk with the previous one
+                if current and any(u["kind"] != "heading" for u in current):
+                    yield make_chunk(current)
+                    current = []
+                section = unit["text"]
+                current.append(unit)
+                continue
+
+            pieces = [unit]
+            if estimate_tokens(unit["text"]) > max_tokens:
+                pieces = list(split_long_unit(unit, max_tokens))
+            for piece in pieces:
+                size = sum(estimate_tokens(u["text"]) for u in current)
+                if current and size + estimate_tokens(piece["text"]) > max_tokens:
+                    yield make_chunk(current)
+                    current = overlap_tail(current)
+                    if sum(estimate_tokens(u["text"]) for u in current) + estimate_tokens(piece["text"]) > max_tokens:
+                        current = []
+                current.append(piece)
+
+    if current:
+        yield make_chunk(current)
+
+
+CHUNKERS = {
+    "fixed": iter_fixed_chunks,
+    "structured": iter_structured_chunks,
+}
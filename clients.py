@@ -0,0 +1,97 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+# Shared clients, built on first use
+# Importing a module never connects anywhere or needs credentials: the Supabase client is created, and Gemini
+# configured, the first time something calls them, once per process, and every module shares the result.
+#   supabase : one client whose PostgREST / storage / functions calls share a single httpx connection pool
+#              (HTTP_POOL_SIZE keep-alive connections) for the life of the process
+#   gemini   : genai.configure runs once; generate and embed calls reuse the SDK's per-process gRPC channel
+# `supabase` and `model` below are stand-ins that resolve the shared client on every attribute access, so
+# modules can bind them at import time; set_supabase / set_model swap in other clients (fakes, cassettes).
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+GEMINI_KEY = os.getenv("GEMINI_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "120"))
+
+_LOCK = threading.Lock()
+_SUPABASE = None
+_MODELS = {}
+_GEMINI_CONFIGURED = False
+
+
+def create_supabase():
+    from supabase import create_client
+    try:
+        import httpx
+        from supabase import ClientOptions
+        pool = httpx.Client(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+        )
+        options = ClientOptions(httpx_client=pool)
+    except (ImportError, TypeError):
+        options = None # supabase-py without httpx_client: each sub-client keeps its own pool
+    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY, options)
+
+def get_supabase():
+    global _SUPABASE
+    if _SUPABASE is None:
+        with _LOCK:
+            if _SUPABASE is None:
+                _SUPABASE = create_supabase()
+    return _SUPABASE
+
+def set_supabase(client):
+    global _SUPABASE
+    with _LOCK:
+        _SUPABASE = client
+
+
+def configure_gemini():
+    global _GEMINI_CONFIGURED
+    if not _GEMINI_CONFIGURED:
+        with _LOCK:
+            if not _GEMINI_CONFIGURED:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_KEY)
+                _GEMINI_CONFIGURED = True
+
+def get_model(name: str = GEMINI_MODEL):
+    model = _MODELS.get(name)
+    if model is None:
+        configure_gemini()
+        with _LOCK:
+            model = _MODELS.get(name)
+            if model is None:
+                import google.generativeai as genai
+                model = _MODELS[name] = genai.GenerativeModel(name)
+    return model
+
+def set_model(model, name: str = GEMINI_MODEL):
+    with _LOCK:
+        _MODELS[name] = model
+
+
+class LazyClient:
+    """Stands in for a shared client, forwarding every attribute to what `getter` returns."""
+
+    def __init__(self, getter, *args):
+        self._getter = getter
+        self._args = args
+
+    def __getattr__(self, name):
+        return getattr(self._getter(*self._args), name)
+
+    def __repr__(self):
+        return f"LazyClient({self._getter.__name__}{self._args or ''})"
+
+supabase = LazyClient(get_supabase)
+model = LazyClient(get_model)
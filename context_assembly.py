@@ -0,0 +1,138 @@
+import os
+import re
+
+from bm25_index import tokenize
+from chunking import SENTENCE_BREAK_RE, estimate_tokens
+from grounding import stem
+
+# Context assembly between reranking and build_prompt
+#   merge   : chunks of the same source with consecutive chunk_ids are joined into one passage and the text
+#             they share (the 100-character chunk overlap) is kept once
+#   dedup   : a sentence already present in an earlier passage is dropped
+#   budget  : if the passages are still over CONTEXT_TOKEN_BUDGET tokens, the sentences most relevant to the
+#             query are kept (rerank order breaks ties) and the rest elided, keeping document order
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "1") == "1"
+# 0 merges and dedups only; trimming stays off until evaluation.py shows a budget costs no grounded answers
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+
+MIN_OVERLAP = 20  # shortest shared text treated as chunk overlap, in characters
+MAX_OVERLAP = 400
+ELISION = " ... "
+
+
+def overlap_length(left: str, right: str):
+    """Length of the longest suffix of left that is also a prefix of right."""
+    for size in range(min(len(left), len(right), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def merge_chunks(documents: list):
+    """Join consecutive chunks of the same source, in rerank order of each group's best chunk."""
+    passages = []
+    by_key = {} # (source, chunk_id) -> passage holding that chunk
+    for rank, doc in enumerate(documents):
+        metadata = doc.get("metadata") or {}
+        source, chunk_id = metadata.get("source"), metadata.get("chunk_id")
+        passage = {"rank": rank, "source": source, "chunks": [(chunk_id, doc["content"])]}
+        passages.append(passage)
+        if source is not None and isinstance(chunk_id, int):
+            by_key[(source, chunk_id)] = passage
+
+    # fold each chunk's successor into its passage, so runs like 7, 8, 9 end up in one
+    for source, chunk_id in list(by_key):
+        passage = by_key[(source, chunk_id)]
+        neighbour = by_key.get((source, chunk_id + 1))
+        if neighbour is not None and neighbour is not passage:
+            passage["chunks"] += neighbour["chunks"]
+            passage["rank"] = min(passage["rank"], neighbour["rank"])
+            for key, value in by_key.items():
+                if value is neighbour:
+                    by_key[key] = passage
+            passages.remove(neighbour)
+
+    for passage in passages:
+        chunks = sorted(passage["chunks"], key=lambda c: c[0] if isinstance(c[0], int) else -1)
+        text = chunks[0][1]
+        for _, content in chunks[1:]:
+            text += content[overlap_length(text, content):]
+        passage["chunk_ids"] = [c[0] for c in chunks]
+        passage["text"] = text
+    return sorted(passages, key=lambda p: p["rank"])
+
+
+def split_sentences(text: str):
+    parts, cursor = [], 0
+    for match in SENTENCE_BREAK_RE.finditer(text):
+        parts.append(text[cursor:match.start()])
+        cursor = match.end()
+    parts.append(text[cursor:])
+    return [" ".join(part.split()) for part in parts if part.strip()]
+
+def normalize_sentence(sentence: str):
+    return re.sub(r"[^a-z0-9]+", " ", sentence.lower()).strip()
+
+def sentence_score(sentence: str, query_terms: set, rank: int):
+    terms = {stem(t) for t in tokenize(sentence)}
+    if not terms:
+        return 0.0
+    return len(terms & query_terms) / len(terms) ** 0.5 + 0.1 / (1 + rank)
+
+
+def assemble_context(query: str, documents: list, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """Build the prompt contexts from the reranked documents; returns (contexts, stats)."""
+    raw_tokens = sum(estimate_tokens(doc["content"]) for doc in documents)
+    passages = merge_chunks(documents)
+
+    seen = set()
+    for passage in passages:
+        sentences = []
+        for sentence in split_sentences(passage["text"]):
+            key = normalize_sentence(sentence)
+            if key and key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+        passage["sentences"] = sentences
+
+    total = sum(estimate_tokens(s) for p in passages for s in p["sentences"])
+    if token_budget and total > token_budget:
+        query_terms = {stem(t) for t in tokenize(query)}
+        candidates = []
+        for i, passage in enumerate(passages):
+            for j, sentence in enumerate(passage["sentences"]):
+                candidates.append((-sentence_score(sentence, query_terms, passage["rank"]), passage["rank"], j, i))
+        candidates.sort() # most relevant first, then rerank order, then position in the passage
+
+        keep, used = set(), 0
+        for _, _, j, i in candidates:
+            tokens = estimate_tokens(passages[i]["sentences"][j])
+            if keep and used + tokens > token_budget:
+                continue # a shorter sentence further down may still fit
+            keep.add((i, j))
+            used += tokens
+        for i, passage in enumerate(passages):
+            passage["kept"] = [(i, j) in keep for j in range(len(passage["sentences"]))]
+    else:
+        for passage in passages:
+            passage["kept"] = [True] * len(passage["sentences"])
+
+    contexts = []
+    for passage in passages:
+        text, elided = "", False
+        for sentence, kept in zip(passage["sentences"], passage["kept"]):
+            if not kept:
+                elided = True
+                continue
+            text += (ELISION if elided and text else " " if text else "") + sentence
+            elided = False
+        if text:
+            contexts.append(text)
+
+    tokens = sum(estimate_tokens(c) for c in contexts)
+    return contexts, {
+        "chunks": len(documents),
+        "passages": len(contexts),
+        "raw_tokens": raw_tokens,
+        "tokens": tokens,
+        "saved_tokens": raw_tokens - tokens,
+    }
@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+import clients
+import tracing
+
+# Corpus version counter, bumped whenever ingestion changes the documents table.
+# Downstream caches stamp entries with the version they were built against and drop them once it moves.
+# The counter is a single row in Supabase, so an ingest run from any host reaches the app workers on every
+# other host; a worker re-reads it at most every CORPUS_VERSION_TTL seconds. Ingest bumps it through the
+# CORPUS_VERSION_FUNCTION rpc, an atomic increment in Postgres; the table and function are in sql/corpus_version.sql.
+CORPUS_VERSION_TABLE = os.getenv("CORPUS_VERSION_TABLE", "corpus_version")
+CORPUS_VERSION_FUNCTION = os.getenv("CORPUS_VERSION_FUNCTION", "bump_corpus_version")
+CORPUS_VERSION_TTL = float(os.getenv("CORPUS_VERSION_TTL", "5"))
+
+_LOCK = threading.Lock()
+_CACHED = {"read": None, "version": 0, "failing": False}
+
+
+def read_corpus_version(client, table: str = CORPUS_VERSION_TABLE):
+    rows = client.table(table).select("version").eq("id", 1).execute().data
+    return int(rows[0]["version"]) if rows else 0
+
+def get_corpus_version(client=None, ttl: float = CORPUS_VERSION_TTL):
+    """The current corpus version, read from Supabase at most once per ttl seconds per process."""
+    read = _CACHED["read"]
+    if read is not None and time.monotonic() - read < ttl:
+        return _CACHED["version"]
+    with _LOCK:
+        read = _CACHED["read"]
+        if read is not None and time.monotonic() - read < ttl:
+            return _CACHED["version"] # another thread refreshed it while this one waited
+        try:
+            _CACHED["version"] = read_corpus_version(client or clients.supabase)
+            _CACHED["failing"] = False
+        except Exception as e:
+            # keep the last known version, so an unreachable table never empties the caches
+            tracing.count("rag_corpus_version_errors_total")
+            if not _CACHED["failing"]:
+                print(f"Reading the corpus version failed, keeping version {_CACHED['version']}: {e}")
+            _CACHED["failing"] = True
+        _CACHED["read"] = time.monotonic()
+        return _CACHED["version"]
+
+def bump_corpus_version(client=None, function: str = CORPUS_VERSION_FUNCTION):
+    """Increment the version in Postgres; returns None when it can't, without failing the ingest."""
+    client = client or clients.supabase
+    try:
+        version = int(client.rpc(function, {}).execute().data)
+    except Exception as e:
+        # the documents are already written; caches just keep serving until their own TTLs run out
+        tracing.count("rag_corpus_version_errors_total")
+        print(f"Warning: bumping the corpus version failed, run sql/corpus_version.sql to create it: {e}")
+        return None
+    with _LOCK:
+        _CACHED.update(version=version, read=time.monotonic(), failing=False)
+    print(f"Corpus version is now {version}")
+    return version
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+import google.generativeai as genai
+
+import clients
+
+# Two-tier embedding cache shared by the query path and the ingest path
+#   tier 1: in-process LRU of float32 arrays, evicted by total size in bytes
+#   tier 2: SQLite file on disk, survives restarts and re-ingests
+# Keys are sha256(model name + text), so an unchanged chunk or a repeated question is never re-embedded.
+EMBED_MODEL = "models/embedding-001"
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", ".embedding_cache.sqlite") # '' keeps it in memory only
+
+
+def cache_key(model: str, text: str):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_bytes: int = EMBED_CACHE_MAX_BYTES, path: str = EMBED_CACHE_PATH):
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)"
+            )
+            self.db.commit()
+
+    def get(self, model: str, text: str):
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return vector.tolist()
+
+            if self.db is not None:
+                row = self.db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vector = array("f")
+                    vector.frombytes(row[0])
+                    self._remember(key, vector)
+                    self.counters["disk_hits"] += 1
+                    return vector.tolist()
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, model: str, text: str, embedding: list):
+        self.put_many(model, [text], [embedding])
+
+    def put_many(self, model: str, texts: list, embeddings: list):
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model, text)
+                vector = array("f", embedding)
+                self._remember(key, vector)
+                rows.append((key, model, vector.tobytes()))
+            if self.db is not None:
+                self.db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+                self.db.commit()
+
+    def _remember(self, key, vector):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key)) * vector.itemsize
+        self.memory[key] = vector
+        self.memory_bytes += len(vector) * vector.itemsize
+        while self.memory_bytes > self.max_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted) * evicted.itemsize
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.counters.values())
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+            }
+
+
+# Shared instance
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_cache():
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = EmbeddingCache()
+    return _CACHE
+
+def set_cache(cache):
+    global _CACHE
+    with _CACHE_LOCK:
+        _CACHE = cache
+
+
+# Embedding through the cache
+def gemini_embed(texts: list, model: str = EMBED_MODEL):
+    clients.configure_gemini()
+    response = genai.embed_content(model=model, content=texts)
+    return response["embedding"]
+
+_EMBED_FN = gemini_embed
+
+def set_embed_fn(embed_fn):
+    """Swap the backend used for cache misses, e.g. a fakes.FakeEmbedder for offline runs."""
+    global _EMBED_FN
+    _EMBED_FN = embed_fn
+
+def get_embed_fn():
+    return _EMBED_FN
+
+def embed_texts(texts: list, model: str = EMBED_MODEL, embed_fn=None, cache=None):
+    """Embed texts, only sending cache misses to embed_fn (in one batched call)."""
+    embed_fn = embed_fn or _EMBED_FN
+    cache = cache or get_cache()
+    embeddings = [cache.get(model, text) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        # duplicates inside one batch are embedded once
+        unique = list(dict.fromkeys(texts[i] for i in missing))
+        fresh = dict(zip(unique, embed_fn(unique, model=model)))
+        cache.put_many(model, unique, [fresh[text] for text in unique])
+        for i in missing:
+            embeddings[i] = fresh[texts[i]]
+    return embeddings
+
+def embed_text(text: str, model: str = EMBED_MODEL):
+    return embed_texts([text], model=model)[0]
+
+
+class CachedEmbedder:
+    """Wrap an ingest embedder (anything with embed_batch) with the shared cache."""
+
+    def __init__(self, embedder, model: str = None, cache=None):
+        self.embedder = embedder
+        self.model = model or getattr(embedder, "model", EMBED_MODEL)
+        self.cache = cache
+
+    def embed_batch(self, texts: list):
+        return embed_texts(
+            texts,
+            model=self.model,
+            embed_fn=lambda batch, model: self.embedder.embed_batch(batch),
+            cache=self.cache
+        )
@@ -1,5 +1,52 @@
 import json
-from agentic_rag import hybrid_retrieve, rerank
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from agentic_rag import CASSETTE, embed_text, hybrid_retrieve, model, plan, rerank
+from app_rag import GROUNDING_EMBEDDINGS, build_prompt, embed_texts, grounded_check
+from cassette import CASSETTE_MODE
+from chunking import estimate_tokens
+from context_assembly import CONTEXT_TOKEN_BUDGET, assemble_context, normalize_sentence, split_sentences
+from fusion import fused_retrieve
+from grounding import GROUNDING_ACCEPT, GROUNDING_REJECT, local_verdict
+from query_router import compare_with_planner, confusion_matrix, load_router, suggest_thresholds
+from vector_index import LOCAL_INDEX_DIR, VectorIndex, use_local_index
+
+# Queries evaluated at once; replayed runs (CASSETTE_MODE=replay) make no network calls so default to parallel
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "8" if CASSETTE_MODE == "replay" else "1"))
+
+# Token budget evaluate_context_compression trims to when CONTEXT_TOKEN_BUDGET is 0 (trimming off)
+EVAL_CONTEXT_BUDGET = int(os.getenv("EVAL_CONTEXT_BUDGET", "450"))
+
+# Questions the assistant must refuse, labelled out of scope for evaluate_router; every ground truth query is
+# in scope. The last few are banking questions the FX disclosures don't cover, the hardest to tell apart.
+OUT_OF_SCOPE_QUERIES = [
+    "What's the weather going to be like in Singapore tomorrow?",
+    "Can you recommend a good Italian restaurant nearby?",
+    "Write me a short poem about the ocean.",
+    "Who won the football world cup in 2018?",
+    "How do I boil an egg so the yolk stays soft?",
+    "What is the capital of Australia?",
+    "Explain how photosynthesis works.",
+    "How many calories are in a banana?",
+    "What is the best programming language for beginners?",
+    "Translate 'good morning' into Japanese.",
+    "How do I reset my online banking password?",
+    "What are the opening hours of the nearest branch?",
+    "How do I apply for a home loan?",
+    "What is the interest rate on a fixed deposit account?",
+    "How can I dispute a credit card charge?",
+]
+
+# RRF settings compared by evaluate_fusion_settings (local retrieval backend only)
+FUSION_GRID = [
+    {"rrf_k": 60, "dense_weight": 1.0, "sparse_weight": 1.0},
+    {"rrf_k": 20, "dense_weight": 1.0, "sparse_weight": 1.0},
+    {"rrf_k": 60, "dense_weight": 1.0, "sparse_weight": 0.5},
+    {"rrf_k": 60, "dense_weight": 0.5, "sparse_weight": 1.0},
+    {"rrf_k": 60, "dense_weight": 1.0, "sparse_weight": 0.0},
+    {"rrf_k": 60, "dense_weight": 0.0, "sparse_weight": 1.0},
+]
 
 
 def normalize_retrieved_docs(docs):
@@ -27,33 +74,44 @@ def precision_recall_at_k(retrieved_docs, relevant_chunks, k):
     return precision, recall
 
 
-def evaluate_ground_truth(ground_truth_data, gen_k=3, retrieve_k=10):
-    precision_at_3, recall_at_10 = [], []
+def evaluate_query(item, gen_k=3, retrieve_k=10, verbose=True):
+    query = item["query"]
+    relevant_chunks = item["relevant_chunks"]
 
-    for item in ground_truth_data:
-        query = item["query"]
-        relevant_chunks = item["relevant_chunks"]
+    # Stage 1: retrieval
+    retrieved_docs = hybrid_retrieve(query, top_k=retrieve_k)
 
-        if not relevant_chunks:
-            print(f"Skipping (no ground truth): {query}")
-            continue
+    # Stage 2: reranking (keep enough to evaluate)
+    reranked_docs = rerank(query, retrieved_docs, top_k=retrieve_k, verbose=verbose)
 
-        # Stage 1: retrieval
-        retrieved_docs = hybrid_retrieve(query, top_k=retrieve_k)
+    # Evaluation
+    _, r_10 = precision_recall_at_k(
+        retrieved_docs, relevant_chunks, retrieve_k
+    )
+    # precision at 3 , are generated contexts relevant
+    p_3, _ = precision_recall_at_k(
+        reranked_docs, relevant_chunks, gen_k
+    )
+    return p_3, r_10
 
-        # Stage 2: reranking (keep enough to evaluate)
-        reranked_docs = rerank(query, retrieved_docs, top_k=retrieve_k)
 
-        # Evaluation
-        _, r_10 = precision_recall_at_k(
-            retrieved_docs, relevant_chunks, retrieve_k
-        )
-        # precision at 3 , are generated contexts relevant
-        p_3, _ = precision_recall_at_k(
-            reranked_docs, relevant_chunks, gen_k
-        )
+def evaluate_ground_truth(ground_truth_data, gen_k=3, retrieve_k=10, workers=EVAL_WORKERS):
+    items = []
+    for item in ground_truth_data:
+        if not item["relevant_chunks"]:
+            print(f"Skipping (no ground truth): {item['query']}")
+            continue
+        items.append(item)
+
+    start = time.perf_counter()
+    # queries run in parallel, results are printed in ground truth order once they are all back
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda item: evaluate_query(item, gen_k, retrieve_k, verbose=workers == 1), items))
+    elapsed = time.perf_counter() - start
 
-        print(f"\nQuery: {query}")
+    precision_at_3, recall_at_10 = [], []
+    for item, (p_3, r_10) in zip(items, results):
+        print(f"\nQuery: {item['query']}")
         print(f"Recall@{retrieve_k}:     {r_10:.2f}")
         print(f"Precision@{gen_k}:       {p_3:.2f}")
 
@@ -65,10 +123,242 @@ def evaluate_ground_truth(ground_truth_data, gen_k=3, retrieve_k=10):
     print("\n=== OVERALL METRICS ===")
     print(f"Average Precision@{gen_k}: {avg_p3:.2f}")
     print(f"Average Recall@{retrieve_k}: {avg_r10:.2f}")
+    print(f"Evaluated {len(items)} queries in {elapsed:.1f}s ({workers} workers)")
     return avg_p3, avg_r10
 
 
-with open("ground_truth.json") as f:
-    ground_truth_data = json.load(f)
+def evaluate_fusion_settings(ground_truth_data, settings_grid=FUSION_GRID, retrieve_k=10):
+    query_embeddings = {}
+    def embed_once(query):
+        # every setting reuses the same query embedding, only the fusion changes
+        if query not in query_embeddings:
+            query_embeddings[query] = embed_text(query)
+        return query_embeddings[query]
+
+    results = []
+    print(f"\n=== FUSION SETTINGS (Recall@{retrieve_k}) ===")
+    for settings in settings_grid:
+        recalls = []
+        for item in ground_truth_data:
+            if not item["relevant_chunks"]:
+                continue
+            docs = fused_retrieve(item["query"], embed_once, top_k=retrieve_k, settings=settings)
+            _, recall = precision_recall_at_k(docs, item["relevant_chunks"], retrieve_k)
+            recalls.append(recall)
+
+        avg_recall = sum(recalls) / len(recalls)
+        print(f"rrf_k={settings['rrf_k']:<3} dense={settings['dense_weight']:<4} "
+              f"sparse={settings['sparse_weight']:<4} Recall@{retrieve_k}: {avg_recall:.2f}")
+        results.append({**settings, f"recall@{retrieve_k}": avg_recall})
+    return results
+
+
+def evaluate_quantization(ground_truth_data, retrieve_k=10, repeats=20, path=LOCAL_INDEX_DIR):
+    """Float32 dense search vs the int8 and binary scans with float rescoring (local index only)."""
+    items = [item for item in ground_truth_data if item["relevant_chunks"]]
+    query_embeddings = [embed_text(item["query"]) for item in items]
+    baseline = None
+
+    results = []
+    print(f"\n=== QUANTIZED INDEX (dense only, Recall@{retrieve_k}) ===")
+    for quantization in ("none", "int8", "binary"):
+        index = VectorIndex.load(path, quantization)
+        if index.quantization != quantization:
+            continue
+        ranked = [index.search(embedding, retrieve_k) for embedding in query_embeddings]
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for embedding in query_embeddings:
+                index.search(embedding, retrieve_k)
+        latency = (time.perf_counter() - start) / (repeats * len(query_embeddings))
+
+        recall = sum(precision_recall_at_k(docs, item["relevant_chunks"], retrieve_k)[1]
+                     for docs, item in zip(ranked, items)) / len(items)
+        rows = [normalize_retrieved_docs(docs) for docs in ranked]
+        baseline = baseline or rows
+        # share of the float32 top-k the quantized search still returns
+        overlap = sum(len(a & b) / len(b) for a, b in zip(rows, baseline) if b) / len(items)
+        print(f"{quantization:<7} memory {index.memory_bytes() / 1024:8.1f} KiB | "
+              f"latency {latency * 1000:6.2f} ms | Recall@{retrieve_k} {recall:.2f} | "
+              f"float top-{retrieve_k} kept {overlap:.2f}")
+        results.append({"quantization": quantization, "memory_bytes": index.memory_bytes(),
+                        "latency": latency, f"recall@{retrieve_k}": recall, "overlap": overlap})
+    return results
+
+
+def suggest_grounding_thresholds(scored):
+    """(weakest sentence support, LLM verdict) pairs -> the loosest GROUNDING_ACCEPT / GROUNDING_REJECT
+    that would not have contradicted the LLM check on any of them."""
+    grounded = [support for support, llm in scored if llm]
+    ungrounded = [support for support, llm in scored if not llm]
+    # accept strictly above every answer the LLM rejected, reject strictly below every answer it accepted;
+    # without examples on one side the current setting stands
+    accept = min(1.0, round(max(ungrounded) + 0.01, 2)) if ungrounded else GROUNDING_ACCEPT
+    reject = round(min(grounded), 2) if grounded else GROUNDING_REJECT
+    return accept, reject
+
+
+def evaluate_grounding(ground_truth_data, gen_k=3, retrieve_k=10, workers=EVAL_WORKERS):
+    """Local grounding verifier vs the LLM grounded check on freshly generated answers."""
+    def judge(item):
+        query = item["query"]
+        docs = rerank(query, hybrid_retrieve(query, top_k=retrieve_k), top_k=gen_k, verbose=False)
+        contexts = [doc["content"] for doc in docs]
+        answer = model.generate_content(build_prompt(query, contexts)).text.strip()
+
+        start = time.perf_counter()
+        llm = grounded_check(answer, "\n".join(contexts), model)
+        llm_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        verdict = local_verdict(answer, contexts, embed_fn=embed_texts if GROUNDING_EMBEDDINGS else None)
+        local_seconds = time.perf_counter() - start
+        return llm, verdict["grounded"], llm_seconds, local_seconds, verdict["support"]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(judge, ground_truth_data))
+
+    decided = [(llm, local) for llm, local, _, _, _ in results if local is not None]
+    hybrid_agree = sum(llm == (local if local is not None else llm) for llm, local, _, _, _ in results)
+    # each locally decided answer skips one LLM check, every answer pays for the local pass
+    saved = sum(llm_s for _, local, llm_s, _, _ in results if local is not None) - sum(r[3] for r in results)
+    scored = [(support, llm) for llm, _, _, _, support in results if support is not None]
+    accept, reject = suggest_grounding_thresholds(scored)
+    print("\n=== GROUNDING: LOCAL VERIFIER VS LLM CHECK ===")
+    print(f"Decided locally:           {len(decided)}/{len(results)}")
+    print(f"Agreement when decided:    {sum(l == v for l, v in decided) / len(decided) if decided else 0.0:.2f}")
+    print(f"Hybrid agreement overall:  {hybrid_agree / len(results):.2f}")
+    print(f"LLM check mean latency:    {sum(r[2] for r in results) / len(results) * 1000:.0f} ms")
+    print(f"Local check mean latency:  {sum(r[3] for r in results) / len(results) * 1000:.0f} ms")
+    print(f"Check time saved:          {saved:.1f}s over {len(results)} answers")
+    print("Weakest sentence support by LLM verdict:")
+    for verdict in (True, False):
+        supports = sorted(support for support, llm in scored if llm == verdict)
+        print(f"  {'grounded' if verdict else 'not grounded':<13} {len(supports):>3}  "
+              + " ".join(f"{s:.2f}" for s in supports))
+    print(f"Suggested GROUNDING_ACCEPT={accept} (now {GROUNDING_ACCEPT}), "
+          f"GROUNDING_REJECT={reject} (now {GROUNDING_REJECT})"
+          + ("" if GROUNDING_EMBEDDINGS else ", local rejects need GROUNDING_EMBEDDINGS=1"))
+    return {
+        "answers": len(results),
+        "decided_locally": len(decided),
+        "agreement": sum(l == v for l, v in decided) / len(decided) if decided else 0.0,
+        "hybrid_agreement": hybrid_agree / len(results),
+        "seconds_saved": saved,
+        "suggested_accept": accept,
+        "suggested_reject": reject,
+    }
+
+
+def evaluate_context_compression(ground_truth_data, gen_k=3, retrieve_k=10, workers=EVAL_WORKERS,
+                                 token_budget=CONTEXT_TOKEN_BUDGET or EVAL_CONTEXT_BUDGET):
+    """Answers generated from the raw reranked chunks vs from the assembled (merged, trimmed) context."""
+    def compare(item):
+        query = item["query"]
+        docs = rerank(query, hybrid_retrieve(query, top_k=retrieve_k), top_k=gen_k, verbose=False)
+        raw = [doc["content"] for doc in docs]
+        assembled, stats = assemble_context(query, docs, token_budget)
+
+        row = {"raw_tokens": estimate_tokens(build_prompt(query, raw)),
+               "tokens": estimate_tokens(build_prompt(query, assembled))}
+        for name, contexts in (("raw", raw), ("assembled", assembled)):
+            start = time.perf_counter()
+            answer = model.generate_content(build_prompt(query, contexts)).text.strip()
+            row[f"{name}_seconds"] = time.perf_counter() - start
+            # both answers are judged against the full chunks, trimming must not cost grounding
+            row[f"{name}_grounded"] = grounded_check(answer, "\n".join(raw), model)
+
+        # a relevant chunk is retained when at least one of its sentences made it into the prompt
+        kept = normalize_sentence(" ".join(assembled))
+        relevant = {(c["source"], c["chunk_id"]) for c in item["relevant_chunks"]}
+        hits = [doc for doc in docs if (doc["metadata"].get("source"), doc["metadata"].get("chunk_id")) in relevant]
+        row["relevant"] = len(hits)
+        row["retained"] = sum(
+            any(normalize_sentence(sentence) in kept for sentence in split_sentences(doc["content"]))
+            for doc in hits
+        )
+        return row
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(compare, ground_truth_data))
+
+    n = len(rows)
+    raw_tokens, tokens = sum(r["raw_tokens"] for r in rows), sum(r["tokens"] for r in rows)
+    relevant = sum(r["relevant"] for r in rows)
+    retention = sum(r["retained"] for r in rows) / relevant if relevant else 1.0
+    print(f"\n=== CONTEXT COMPRESSION: RAW CHUNKS VS ASSEMBLED CONTEXT (budget {token_budget} tokens) ===")
+    print(f"Prompt tokens (mean):      {raw_tokens / n:.0f} -> {tokens / n:.0f} "
+          f"({1 - tokens / raw_tokens:.0%} fewer)")
+    print(f"Generation latency (mean): {sum(r['raw_seconds'] for r in rows) / n * 1000:.0f} ms -> "
+          f"{sum(r['assembled_seconds'] for r in rows) / n * 1000:.0f} ms")
+    print(f"Grounded answers:          {sum(r['raw_grounded'] for r in rows)}/{n} -> "
+          f"{sum(r['assembled_grounded'] for r in rows)}/{n}")
+    print(f"Relevant chunks retained:  {retention:.2f}")
+    return {
+        "queries": n,
+        "token_budget": token_budget,
+        "raw_tokens": raw_tokens / n,
+        "tokens": tokens / n,
+        "raw_grounded": sum(r["raw_grounded"] for r in rows) / n,
+        "assembled_grounded": sum(r["assembled_grounded"] for r in rows) / n,
+        "retention": retention,
+    }
+
+
+def evaluate_router(ground_truth_data, router, out_of_scope_queries=OUT_OF_SCOPE_QUERIES):
+    """Router and LLM planner on labelled queries: ground truth in scope, OUT_OF_SCOPE_QUERIES out of scope."""
+    queries = [item["query"] for item in ground_truth_data] + list(out_of_scope_queries)
+    labels = ["in_scope"] * len(ground_truth_data) + ["out_of_scope"] * len(out_of_scope_queries)
+    result = compare_with_planner(queries, embed_text, model, plan, router=router)
+    decisions = [decision for decision, _ in result["decisions"]]
+    matrix = confusion_matrix(labels, decisions)
+    planner = {label: sum("REFUSE" in steps for l, (_, steps) in zip(labels, result["decisions"]) if l == label)
+               for label in matrix}
+    refused = sum(row["out_of_scope"] for row in matrix.values())
+    suggested = suggest_thresholds(labels, decisions)
+
+    print("\n=== ROUTER VS LLM PLANNER ===")
+    print(f"Router decided locally: {result['router_decided']}/{result['queries']}")
+    print(f"Agreement with planner: {result['agreement']:.2f}")
+    print(f"{'label':<14}{'in_scope':>10}{'refuse':>8}{'low':>6}{'planner refuse':>16}")
+    for label, row in matrix.items():
+        print(f"{label:<14}{row['in_scope']:>10}{row['out_of_scope']:>8}{row['low']:>6}{planner[label]:>16}")
+    print(f"Router REFUSE precision: {matrix['out_of_scope']['out_of_scope'] / refused if refused else 0.0:.2f} "
+          f"({refused} refused)")
+    print("Suggested thresholds: " + ", ".join(f"{name}={value}" for name, value in suggested.items()))
+    return {**{k: v for k, v in result.items() if k != "decisions"}, "confusion": matrix,
+            "planner_refusals": planner, "suggested": suggested}
+
+
+def main(path: str = "ground_truth.json", grounding: bool = False, compression: bool = False):
+    with open(path) as f:
+        ground_truth_data = json.load(f)
+
+    evaluate_ground_truth(ground_truth_data, gen_k=3)
+    if use_local_index():
+        evaluate_fusion_settings(ground_truth_data)
+        evaluate_quantization(ground_truth_data)
+    router = load_router() # evaluated even while ROUTER_ENABLED=0, that's how its thresholds get calibrated
+    if router is not None:
+        evaluate_router(ground_truth_data, router)
+    # each of these generates every answer again (plus checks), so they only run when asked for
+    if grounding:
+        evaluate_grounding(ground_truth_data)
+    if compression:
+        evaluate_context_compression(ground_truth_data)
+    if CASSETTE is not None:
+        CASSETTE.save()
+        print(f"\nCassette ({CASSETTE_MODE}): {CASSETTE.stats()}")
+
+
+if __name__ == "__main__":
+    import argparse
 
-evaluate_ground_truth(ground_truth_data, gen_k=3)
+    parser = argparse.ArgumentParser(description="Evaluate retrieval and answers against the ground truth")
+    parser.add_argument("path", nargs="?", default="ground_truth.json")
+    parser.add_argument("--grounding", action="store_true",
+                        help="also compare the local grounding verifier with the LLM check")
+    parser.add_argument("--compression", action="store_true",
+                        help="also compare answers from raw and assembled (trimmed) contexts")
+    args = parser.parse_args()
+    main(args.path, grounding=args.grounding, compression=args.compression)
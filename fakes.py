@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+# Local stand-ins for Gemini and Supabase, used to exercise pipelines without network access
+
+
+class FakeEmbedder:
+    """Deterministic hash-based embeddings with optional per-call latency."""
+
+    def __init__(self, dim: int = 768, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+        self.texts_embedded = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str):
+        values = []
+        counter = 0
+        while len(values) < self.dim:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend((b - 127.5) / 127.5 for b in digest)
+            counter += 1
+        return values[:self.dim]
+
+    def embed_batch(self, texts: list):
+        with self._lock:
+            self.calls += 1
+            self.texts_embedded += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def __call__(self, texts: list, model: str = None):
+        # same signature as embedding_cache.gemini_embed, see embedding_cache.set_embed_fn
+        return self.embed_batch(texts)
+
+
+class MemoryStore:
+    """In-memory replacement for the Supabase `documents` table."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.rows = []
+        self.insert_calls = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def insert_rows(self, rows: list):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.insert_calls += 1
+            for row in rows:
+                self.rows.append({**row, "id": self._next_id})
+                self._next_id += 1
+
+    def update_metadata(self, rows: list):
+        with self._lock:
+            by_id = {row["id"]: row for row in self.rows}
+            for row in rows:
+                by_id[row["id"]]["metadata"] = row["metadata"]
+
+    def delete_rows(self, ids: list):
+        with self._lock:
+            ids = set(ids)
+            self.rows = [row for row in self.rows if row["id"] not in ids]
+
+    def fetch_source(self, source: str):
+        with self._lock:
+            return [dict(row) for row in self.rows if row["metadata"].get("source") == source]
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt: str = ""):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=len(prompt) // 4,
+            candidates_token_count=len(text) // 4,
+            total_token_count=(len(prompt) + len(text)) // 4
+        )
+
+
+class FakeRateLimitError(Exception):
+    """Shaped like google.api_core.exceptions.ResourceExhausted."""
+    code = 429
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel, answering each agent prompt with a plausible reply.
+
+    latency is the time per call (plus up to `jitter` extra), token_latency the time per streamed token.
+    With a quota, calls beyond `quota` per second fail with FakeRateLimitError like an exhausted API quota.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, token_latency: float = 0.0,
+                 plan: str = '["RETRIEVE", "ANSWER"]', seed: int = 0, quota: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.plan = plan
+        self.quota = quota
+        self.calls = 0
+        self.rate_limited = 0
+        self.prompts = []
+        self._window = [] # start times of the calls in the last second
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def reply(self, prompt: str):
+        if "Decide the steps needed" in prompt:
+            return self.plan
+        if "Return ONLY a JSON list" in prompt:
+            count = len(re.findall(r"^\[\d+\]$", prompt, re.M))
+            return "[" + ", ".join(str(self._score(f"{prompt}{i}")) for i in range(count)) + "]"
+        if "Return ONLY the number" in prompt:
+            return str(self._score(prompt))
+        if "fully supported by the context" in prompt:
+            return "YES"
+        context = re.search(r"Context:\s*(.*?)\s*Question:", prompt, re.S)
+        if context and context.group(1).strip():
+            # answer from the first passage, like a well-grounded model would
+            sentences = re.split(r"(?<=[.!?])\s+", context.group(1).strip().split("\n\n")[0])
+            return " ".join(sentences[:2])
+        return ("FX transactions are priced at the Bank's exchange rate, which includes a margin over the "
+                "wholesale rate. Fees and the cost of service are set out in the disclosure.")
+
+    def _score(self, text: str):
+        return int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % 11
+
+    def _delay(self):
+        with self._lock:
+            if self.quota:
+                now = time.monotonic()
+                self._window = [t for t in self._window if now - t < 1.0]
+                if len(self._window) >= self.quota:
+                    self.rate_limited += 1
+                    raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+                self._window.append(now)
+            self.calls += 1
+            return self.latency + (self._random.random() * self.jitter if self.jitter else 0.0)
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None):
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.prompts.append(prompt)
+        text = self.reply(prompt)
+        if not stream:
+            return FakeResponse(text, prompt)
+        return self._stream(text, prompt)
+
+    def _stream(self, text, prompt):
+        for token in re.findall(r"\S+\s*", text):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield FakeResponse(token, prompt)
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, request_options=None):
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        with self._lock:
+            self.prompts.append(prompt)
+        text = self.reply(prompt)
+        if not stream:
+            return FakeResponse(text, prompt)
+        return self._stream_async(text, prompt)
+
+    async def _stream_async(self, text, prompt):
+        for token in re.findall(r"\S+\s*", text):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield FakeResponse(token, prompt)
+
+
+class FakeQuery:
+    """Minimal PostgREST query builder: every filter is accepted, execute() returns rows."""
+
+    def __init__(self, rows: list, latency: float = 0.0):
+        self.rows = rows
+        self.latency = latency
+        self._limit = None
+
+    def __getattr__(self, name):
+        # select, eq, text_search, range, in_, ... all chain
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def execute(self):
+        if self.latency:
+            time.sleep(self.latency)
+        rows = self.rows[:self._limit] if self._limit else self.rows
+        return SimpleNamespace(data=rows)
+
+
+class FakeSupabase:
+    """Stands in for the Supabase client: the match RPCs return deterministic slices of a corpus."""
+
+    def __init__(self, corpus: list = None, latency: float = 0.0, size: int = 200):
+        self.latency = latency
+        self.corpus = corpus or [
+            {
+                "content": f"Synthetic FX disclosure passage {i}: exchange rates, margins and fees for "
+                           f"spot and forward transactions, settlement periods and the cost of service.",
+                "metadata": {"source": "documents/synthetic.pdf", "chunk_id": i}
+            }
+            for i in range(size)
+        ]
+        self.calls = 0
+
+    def rpc(self, name: str, params: dict):
+        self.calls += 1
+        count = params.get("match_count", 10)
+        key = params.get("query_text") or str(params.get("query_embedding", "")[:4])
+        start = int(hashlib.sha256(key.encode("utf-8")).hexdigest(), 16) % len(self.corpus)
+        rows = [self.corpus[(start + i) % len(self.corpus)] for i in range(count)]
+        return FakeQuery(rows, self.latency)
+
+    def table(self, name: str):
+        self.calls += 1
+        if name == "corpus_version":
+            return FakeQuery([{"id": 1, "version": 0}], self.latency)
+        return FakeQuery(self.corpus, self.latency)
@@ -0,0 +1,62 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bm25_index
+import tracing
+import vector_index
+
+# Reciprocal-rank fusion of dense (vector index) and sparse (BM25) results
+#   score(chunk) = sum over retrievers of weight / (rrf_k + rank)
+RRF_K = int(os.getenv("RRF_K", "60"))
+DENSE_WEIGHT = float(os.getenv("RRF_DENSE_WEIGHT", "1.0"))
+SPARSE_WEIGHT = float(os.getenv("RRF_SPARSE_WEIGHT", "1.0"))
+RRF_CANDIDATES = int(os.getenv("RRF_CANDIDATES", "20")) # results pulled from each retriever
+
+FUSION_SETTINGS = {
+    "rrf_k": RRF_K,
+    "dense_weight": DENSE_WEIGHT,
+    "sparse_weight": SPARSE_WEIGHT,
+    "candidates": RRF_CANDIDATES,
+}
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fusion")
+
+
+def doc_key(doc: dict):
+    # chunks are matched on their text, not (source, chunk_id): an incremental ingest renumbers chunks and
+    # the dense index is only rebuilt by `python vector_index.py`, so one position can hold different text
+    # in the two indexes
+    metadata = doc.get("metadata") or {}
+    return metadata.get("content_hash") or hashlib.sha256(doc["content"].encode("utf-8")).hexdigest()
+
+def reciprocal_rank_fusion(result_lists: list, weights: list, rrf_k: int = RRF_K, top_k: int = 10):
+    fused = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, doc in enumerate(results, start=1):
+            key = doc_key(doc)
+            if key not in fused:
+                fused[key] = [0.0, doc]
+            fused[key][0] += weight / (rrf_k + rank)
+
+    ranked = sorted(fused.values(), key=lambda x: x[0], reverse=True)
+    return [dict(doc, rrf_score=score) for score, doc in ranked[:top_k]]
+
+def fused_retrieve(query: str, embed_fn, top_k: int = 10, settings: dict = None):
+    """Run BM25 and dense search concurrently and merge them with RRF.
+
+    BM25 doesn't need the query embedding, so it runs while embed_fn is still waiting on the API.
+    """
+    settings = {**FUSION_SETTINGS, **(settings or {})}
+    candidates = max(settings["candidates"], top_k)
+
+    # propagated, so the embedding call and its spans stay in the request's trace
+    sparse = _EXECUTOR.submit(tracing.propagate(bm25_index.get_index().search), query, candidates)
+    dense = _EXECUTOR.submit(tracing.propagate(lambda: vector_index.get_index().search(embed_fn(query), candidates)))
+
+    return reciprocal_rank_fusion(
+        [dense.result(), sparse.result()],
+        [settings["dense_weight"], settings["sparse_weight"]],
+        rrf_k=settings["rrf_k"],
+        top_k=top_k
+    )
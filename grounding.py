@@ -0,0 +1,124 @@
+import os
+import re
+
+import numpy as np
+
+from bm25_index import tokenize
+
+# Local grounding verifier in front of the LLM grounded check
+# Every answer sentence is scored against the reranked chunks on
+#   overlap   : share of its content words (light-stemmed) and word bigrams found in the context
+#   numbers   : every figure it quotes (rates, fees, days, percentages) must appear in the context
+#   entities  : capitalised names and acronyms must appear in the context
+#   embedding : cosine similarity to the closest chunk, when an embed function is given
+# Confident cases are decided here: all sentences well supported -> grounded. A sentence with almost no support
+# is only rejected here when embeddings are on and agree that nothing in the context is close to it; word
+# overlap alone scores paraphrases and closing lines ("You can ask your banker for more details.") near 0.
+# Everything else, including a quoted figure whose value isn't in the context, goes to the LLM check.
+# Both thresholds are starting points; `python evaluation.py --grounding` suggests values from the LLM verdicts. The prompt's own "I don't have an answer" fallback and the out-of-scope refusal aren't
+# claims about the context and are passed as they are.
+GROUNDING_VERIFIER = os.getenv("GROUNDING_VERIFIER", "hybrid") # hybrid | llm (always ask the model)
+GROUNDING_ACCEPT = float(os.getenv("GROUNDING_ACCEPT", "0.7"))   # every sentence at least this -> grounded
+GROUNDING_REJECT = float(os.getenv("GROUNDING_REJECT", "0.25"))  # a sentence below this on overlap and embeddings -> not grounded
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+ENTITY_RE = re.compile(r"(?<!^)(?<![.!?]\s)\b(?:[A-Z]{2,}|[A-Z][a-z]+(?:\s[A-Z][a-z]+)*)\b")
+EMBED_FLOOR, EMBED_CEIL = 0.5, 0.9 # cosine range mapped onto 0..1, unrelated text still scores ~0.5
+MIN_TOKENS = 3                     # shorter sentences ("Yes.") aren't scored
+NO_ANSWER_PHRASES = ("don t have an answer", "do not have an answer", "outside the scope")
+
+
+def stem(token: str):
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(token) > len(suffix) + 3 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+def content_terms(text: str):
+    return [stem(t) for t in tokenize(text)]
+
+def numbers_in(text: str):
+    # compared as values, so "0.5%" matches "0.50%" and "1,000" matches "1000"
+    numbers = set()
+    for n in NUMBER_RE.findall(text):
+        n = n.replace(",", "").rstrip(".")
+        try:
+            numbers.add(float(n))
+        except ValueError:
+            numbers.add(n) # dotted identifiers like 2.1.3 are kept as text
+    return numbers
+
+def split_sentences(text: str):
+    return [s.strip() for s in SENTENCE_RE.split(text.strip()) if s.strip()]
+
+def is_no_answer(answer: str):
+    """True for the prompt's "I'm sorry I don't have an answer" fallback and the out-of-scope refusal."""
+    text = re.sub(r"[^a-z]+", " ", answer.lower()).strip()
+    return (text.startswith(("i m sorry", "i am sorry", "sorry")) and len(split_sentences(answer)) <= 2
+            and any(phrase in text for phrase in NO_ANSWER_PHRASES))
+
+
+def sentence_support(sentence: str, context_terms: set, context_bigrams: set, context_numbers: set,
+                     context_lower: str, similarity=None):
+    terms = content_terms(sentence)
+    unigram = sum(t in context_terms for t in set(terms)) / len(set(terms))
+    bigrams = set(zip(terms, terms[1:]))
+    bigram = sum(b in context_bigrams for b in bigrams) / len(bigrams) if bigrams else unigram
+
+    semantic = None
+    if similarity is None:
+        support = (0.5 * unigram + 0.2 * bigram) / 0.7
+    else:
+        semantic = min(1.0, max(0.0, (similarity - EMBED_FLOOR) / (EMBED_CEIL - EMBED_FLOOR)))
+        support = 0.5 * unigram + 0.2 * bigram + 0.3 * semantic
+
+    return {
+        "text": sentence,
+        "support": round(support, 3),
+        "semantic": None if semantic is None else round(semantic, 3),
+        "missing_numbers": sorted(numbers_in(sentence) - context_numbers, key=str),
+        "missing_entities": sorted({e for e in ENTITY_RE.findall(sentence) if e.lower() not in context_lower}),
+    }
+
+def local_verdict(answer: str, contexts: list, embed_fn=None,
+                  accept: float = GROUNDING_ACCEPT, reject: float = GROUNDING_REJECT):
+    """Score the answer against the contexts; grounded is True/False when confident, None to ask the LLM.
+
+    embed_fn(texts) -> vectors adds embedding similarity to the word overlap.
+    """
+    if is_no_answer(answer):
+        return {"grounded": True, "support": None, "sentences": [], "no_answer": True}
+
+    context = "\n".join(contexts)
+    context_terms_list = content_terms(context)
+    context_terms = set(context_terms_list)
+    context_bigrams = set(zip(context_terms_list, context_terms_list[1:]))
+    context_numbers = numbers_in(context)
+    context_lower = context.lower()
+
+    sentences = [s for s in split_sentences(answer) if len(content_terms(s)) >= MIN_TOKENS]
+    if not sentences or not contexts:
+        return {"grounded": None, "support": None, "sentences": []}
+
+    similarities = [None] * len(sentences)
+    if embed_fn is not None:
+        vectors = np.asarray(embed_fn(sentences + list(contexts)), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        similarities = (vectors[:len(sentences)] @ vectors[len(sentences):].T).max(axis=1).tolist()
+
+    scored = [
+        sentence_support(s, context_terms, context_bigrams, context_numbers, context_lower, similarity)
+        for s, similarity in zip(sentences, similarities)
+    ]
+    weakest_sentence = min(scored, key=lambda s: s["support"])
+    weakest = weakest_sentence["support"]
+
+    semantic = weakest_sentence["semantic"]
+    if weakest < reject and semantic is not None and semantic < reject:
+        grounded = False
+    elif weakest >= accept and not any(s["missing_numbers"] or s["missing_entities"] for s in scored):
+        grounded = True
+    else:
+        grounded = None
+    return {"grounded": grounded, "support": weakest, "sentences": scored}
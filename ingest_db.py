@@ -1,31 +1,23 @@
-import os
+import argparse
 
-from dotenv import load_dotenv
-from supabase.client import Client, create_client
-import google.generativeai as genai  
 from pypdf import PdfReader
-from tqdm import tqdm
+import bm25_index
+import clients
+import embedding_cache
+import rerank_cache
+import vector_index
+from corpus import bump_corpus_version, get_corpus_version
+from chunking import CHUNKERS, iter_pdf_pages
+from ingest_pipeline import GeminiEmbedder, IngestPipeline, SupabaseStore
 
-load_dotenv() 
-
-# env and clients setup
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-GEMINI_KEY = os.getenv("GEMINI_KEY")
-SUPABASE_CLIENT: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-genai.configure(api_key=GEMINI_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
-# print("Supabase and OpenAI API keys loaded successfully.")
+# clients setup: shared with the app (clients.py), nothing connects until the first ingest
+SUPABASE_CLIENT = clients.supabase
+model = clients.LazyClient(clients.get_model, "gemini-1.5-flash")
 
 # embedding text
-def embed_text(text:str): 
-    response = genai.embed_content(
-        model="models/embedding-001",
-        content=text
-    )
-    embedding = response["embedding"]
-    # print("Text embedded successfully." + str(embedding))
-    return embedding
+def embed_text(text: str):
+    # repeated queries and unchanged chunks are served from the shared cache, see embedding_cache.py
+    return embedding_cache.embed_text(text)
 
 # pdf loader
 def load_pdf(file_path: str) : 
@@ -54,24 +46,82 @@ def chunk_text(text: str, chunk_size: int = 800, overlap: int = 100):
     return chunks
 
 
-def ingest_text(text: str, source: str):
-    chunk = chunk_text(text)
-    for i, chunk in enumerate(tqdm(chunk)):
-        embedding = embed_text(chunk)
-        data = {
-            "content": chunk,
-            "embedding": embedding,
-            "metadata": {
-                "source": source,
-                "chunk_id": i
-                }
-        }
-        SUPABASE_CLIENT.table("documents").insert(data).execute()
+def build_pipeline(chunker: str = "fixed", **options):
+    return IngestPipeline(
+        embedder=embedding_cache.CachedEmbedder(GeminiEmbedder()),
+        store=SupabaseStore(SUPABASE_CLIENT),
+        chunker=CHUNKERS[chunker],
+        **options
+    )
+
+def ingest_text(text: str, source: str, **options):
+    # chunks are embedded in batches and bulk inserted, see ingest_pipeline.py
+    return run_jobs([(source, lambda: [(1, text)])], **options)
+
+def ingest_pdf(file_path: str, **options): 
+    return ingest_pdfs([file_path], **options)
 
-def ingest_pdf(file_path: str): 
-    text = load_pdf(file_path)
-    ingest_text(text, source=file_path)
+def ingest_pdfs(file_paths: list, **options):
+    # pages are streamed into the chunker one at a time, see chunking.py
+    jobs = [(path, lambda path=path: iter_pdf_pages(path)) for path in file_paths]
+    return run_jobs(jobs, **options)
+
+def rebuild_local_indexes(index_dir: str, bm25_dir: str):
+    # one snapshot of the table feeds both indexes, so dense and BM25 search always see the same chunks;
+    # each is written to a tmp dir and swapped in, running workers reload on the corpus version bump
+    rows = vector_index.fetch_rows(SUPABASE_CLIENT)
+    if index_dir:
+        vector_index.build_index(rows, index_dir)
+        vector_index.reset_index()
+    if bm25_dir:
+        bm25_index.BM25Index.build(rows).save(bm25_dir)
+        bm25_index.reset_index()
+
+def run_jobs(jobs: list, index_dir: str = None, bm25_dir: str = None, **options):
+    # the local indexes only serve the local backend, elsewhere nothing is rebuilt
+    local = vector_index.use_local_index()
+    if index_dir is None:
+        index_dir = vector_index.LOCAL_INDEX_DIR if local else ""
+    if bm25_dir is None:
+        bm25_dir = bm25_index.BM25_INDEX_DIR if local else ""
+
+    pipeline = build_pipeline(**options)
+    stats = pipeline.run(jobs)
+    if pipeline.removed_hashes:
+        rerank_cache.get_cache().forget_chunks(pipeline.removed_hashes) # scores of chunks that are gone
+    if stats["changed"]:
+        if index_dir or bm25_dir:
+            rebuild_local_indexes(index_dir, bm25_dir)
+        # invalidates answer caches built against the old corpus and tells workers to reload the local indexes
+        bump_corpus_version(SUPABASE_CLIENT)
+    return stats
 
 if __name__ == "__main__":
-    pdf_path = "documents/fx-cost-of-service-client-disclosure.pdf"  # Replace with PDF file path
-    ingest_pdf(pdf_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Embed PDF disclosures into the Supabase documents table")
+    parser.add_argument("pdfs", nargs="*", default=["documents/fx-cost-of-service-client-disclosure.pdf"])
+    parser.add_argument("--batch-size", type=int, default=32, help="chunks per embedding call and insert")
+    parser.add_argument("--workers", type=int, default=4, help="PDFs processed in parallel")
+    parser.add_argument("--queue-size", type=int, default=8, help="embedded batches buffered ahead of the writer")
+    parser.add_argument("--checkpoint", default=".ingest_checkpoint.json", help="resume file, '' to disable")
+    parser.add_argument("--chunker", choices=sorted(CHUNKERS), default="fixed",
+                        help="fixed 800/100 character windows or sentence/section aware chunks")
+    parser.add_argument("--index-dir", default=None,
+                        help="local dense index, '' to skip (default: LOCAL_INDEX_DIR on the local backend only)")
+    parser.add_argument("--bm25-dir", default=None,
+                        help="local BM25 index, '' to skip (default: BM25_INDEX_DIR on the local backend only)")
+    args = parser.parse_args()
+
+    stats = ingest_pdfs(
+        args.pdfs,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        checkpoint_path=args.checkpoint or None,
+        index_dir=args.index_dir,
+        bm25_dir=args.bm25_dir,
+        chunker=args.chunker
+    )
+    print(f"Embedded {stats['chunks']} new or changed chunks ({stats['unchanged']} unchanged, "
+          f"{stats['moved']} renumbered, {stats['deleted']} deleted, {stats['skipped']} already done) "
+          f"in {stats['seconds']:.1f}s: {stats['chunks_per_second']:.1f} chunks/s")
+    print(f"Corpus version: {get_corpus_version(SUPABASE_CLIENT, ttl=0)}")
@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import google.generativeai as genai
+from tqdm import tqdm
+
+import clients
+
+# Ingestion pipeline
+#   PDF workers  : load + chunk several documents in parallel and embed chunks in batches
+#   writer thread: drains a bounded queue of embedded batches into bulk multi-row inserts
+#   checkpoint   : records every batch that reached the store, so a rerun skips it
+#   incremental  : chunks are content-addressed (sha256 in metadata.content_hash); a rerun diffs against
+#                  the stored rows and only embeds new or changed chunks, deleting the ones that are gone
+# Chunks are streamed from the chunker, so a document is never held in memory as a whole.
+
+EMBED_MODEL = "models/embedding-001"
+_DONE = object()
+
+
+# Backends
+class GeminiEmbedder:
+    def __init__(self, model: str = EMBED_MODEL):
+        self.model = model
+
+    def embed_batch(self, texts: list):
+        clients.configure_gemini()
+        response = genai.embed_content(model=self.model, content=texts)
+        return response["embedding"]
+
+
+class SupabaseStore:
+    def __init__(self, client, table: str = "documents"):
+        self.client = client
+        self.table = table
+
+    def insert_rows(self, rows: list):
+        self.client.table(self.table).insert(rows).execute()
+
+    def update_metadata(self, rows: list):
+        # a plain UPDATE per row: an upsert of {id, metadata} is an INSERT ... ON CONFLICT for PostgREST,
+        # which needs every other column to accept the missing values
+        for row in rows:
+            self.client.table(self.table).update({"metadata": row["metadata"]}).eq("id", row["id"]).execute()
+
+    def delete_rows(self, ids: list):
+        self.client.table(self.table).delete().in_("id", ids).execute()
+
+    def fetch_source(self, source: str, page_size: int = 1000):
+        """Stored rows of a source, id and metadata only; content is fetched for rows without a content_hash."""
+        rows = []
+        while True:
+            response = (self.client.table(self.table)
+                        .select("id,metadata")
+                        .eq("metadata->>source", source)
+                        .range(len(rows), len(rows) + page_size - 1)
+                        .execute())
+            rows.extend(response.data)
+            if len(response.data) < page_size:
+                break
+
+        # rows written before chunks were content-addressed need their text to be hashed
+        legacy = {row["id"]: row for row in rows if not row["metadata"].get("content_hash")}
+        ids = list(legacy)
+        for start in range(0, len(ids), page_size):
+            response = (self.client.table(self.table)
+                        .select("id,content")
+                        .in_("id", ids[start:start + page_size])
+                        .execute())
+            for row in response.data:
+                legacy[row["id"]]["content"] = row["content"]
+        return rows
+
+
+# Checkpointing
+class Checkpoint:
+    """JSON file of the fingerprints of every batch per source that reached the store."""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.state = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def completed(self, source: str):
+        with self._lock:
+            return set(self.state.get(source, []))
+
+    def mark(self, source: str, fingerprint: str):
+        with self._lock:
+            self.state.setdefault(source, []).append(fingerprint)
+            self._save()
+
+    def clear(self, sources: list):
+        with self._lock:
+            for source in sources:
+                self.state.pop(source, None)
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+def content_hash_of(chunk: str):
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+def chunk_metadata(source: str, chunk_id: int, content_hash: str, extra: dict = None):
+    return {
+        "source": source,
+        "chunk_id": chunk_id,
+        "content_hash": content_hash,
+        **(extra or {})
+    }
+
+def fingerprint_batch(batch: list):
+    digest = hashlib.sha256()
+    for chunk_id, _, content_hash, _ in batch:
+        digest.update(f"{chunk_id}:{content_hash}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+def split_chunk(chunk):
+    """Chunkers yield plain strings or dicts with "text" plus extra metadata (page, char_start, ...)."""
+    if isinstance(chunk, str):
+        return chunk, {}
+    extra = {k: v for k, v in chunk.items() if k != "text"}
+    return chunk["text"], extra
+
+
+# Pipeline
+class IngestPipeline:
+    def __init__(self, embedder, store, chunker, batch_size: int = 32,
+                 workers: int = 4, queue_size: int = 8, checkpoint_path: str = None,
+                 incremental: bool = True):
+        self.embedder = embedder
+        self.store = store
+        self.chunker = chunker
+        self.batch_size = batch_size
+        self.workers = workers
+        self.queue_size = queue_size
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.incremental = incremental # diff against stored rows instead of inserting every chunk
+        self.removed_hashes = set() # content hashes of the rows deleted by the last runs
+        self._stats_lock = threading.Lock()
+
+    def run(self, jobs: list):
+        """Ingest (source, loader) jobs; chunker(loader()) yields the chunks of one document."""
+        batches = queue.Queue(maxsize=self.queue_size)
+        stats = {"chunks": 0, "skipped": 0, "inserts": 0, "unchanged": 0, "moved": 0, "deleted": 0}
+        errors = []
+        progress = tqdm(unit="chunk")
+
+        writer = threading.Thread(target=self._write, args=(batches, stats, errors, progress))
+        writer.start()
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for future in [pool.submit(self._embed_job, source, loader, batches, stats, errors)
+                               for source, loader in jobs]:
+                    future.result()
+        finally:
+            batches.put(_DONE)
+            writer.join()
+            progress.close()
+        if errors:
+            raise errors[0]
+        self.checkpoint.clear([source for source, _ in jobs]) # every job finished, nothing to resume
+
+        stats["changed"] = stats["chunks"] + stats["moved"] + stats["deleted"]
+        stats["seconds"] = time.perf_counter() - start
+        stats["chunks_per_second"] = stats["chunks"] / stats["seconds"] if stats["seconds"] else 0.0
+        return stats
+
+    def _embed_job(self, source, loader, batches, stats, errors):
+        """Stream the chunks of one document, diffing each against the stored rows by content hash.
+
+        Unchanged chunks are skipped, rows whose content is unchanged but whose chunk_id or metadata
+        moved get a metadata-only update, new or changed chunks are embedded in batches, and stored
+        rows no chunk matched are deleted once the document is done.
+        """
+        stored = {}
+        for row in self.store.fetch_source(source) if self.incremental else []:
+            content_hash = row["metadata"].get("content_hash") or content_hash_of(row["content"])
+            stored.setdefault(content_hash, []).append(row)
+        done = self.checkpoint.completed(source)
+
+        batch, moves, unchanged = [], [], 0
+        for chunk_id, chunk in enumerate(self.chunker(loader())):
+            if errors:
+                return # the writer failed, stop embedding work that can't be stored
+            text, extra = split_chunk(chunk)
+            content_hash = content_hash_of(text)
+            metadata = chunk_metadata(source, chunk_id, content_hash, extra)
+
+            if stored.get(content_hash):
+                row = stored[content_hash].pop(0)
+                unchanged += 1
+                if row["metadata"] != metadata:
+                    moves.append({"id": row["id"], "metadata": metadata})
+                continue
+
+            batch.append((chunk_id, text, content_hash, metadata))
+            if len(batch) == self.batch_size:
+                self._embed_batch(source, batch, done, batches, stats)
+                batch = []
+        if batch:
+            self._embed_batch(source, batch, done, batches, stats)
+
+        with self._stats_lock:
+            stats["unchanged"] += unchanged
+        # deletes go last so a reader never sees a document with chunks missing
+        deletes = [row["id"] for rows in stored.values() for row in rows]
+        with self._stats_lock:
+            self.removed_hashes.update(content_hash for content_hash, rows in stored.items() if rows)
+        if moves:
+            batches.put(("move", source, None, moves))
+        if deletes:
+            batches.put(("delete", source, None, deletes))
+
+    def _embed_batch(self, source, batch, done, batches, stats):
+        fingerprint = fingerprint_batch(batch)
+        if fingerprint in done:
+            with self._stats_lock:
+                stats["skipped"] += len(batch)
+            return
+        embeddings = self.embedder.embed_batch([text for _, text, _, _ in batch])
+        rows = [
+            {
+                "content": text,
+                "embedding": embedding,
+                "metadata": metadata
+            }
+            for (_, text, _, metadata), embedding in zip(batch, embeddings)
+        ]
+        batches.put(("write", source, fingerprint, rows)) # blocks while the writer is behind
+
+    def _write(self, batches, stats, errors, progress):
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                return
+            if errors:
+                continue # keep draining so producers never block on a dead writer
+            op, source, fingerprint, payload = item
+            try:
+                if op == "write":
+                    self.store.insert_rows(payload)
+                elif op == "move":
+                    self.store.update_metadata(payload)
+                elif op == "delete":
+                    self.store.delete_rows(payload)
+            except Exception as e:
+                errors.append(e)
+                continue
+
+            if op == "write":
+                self.checkpoint.mark(source, fingerprint)
+                stats["chunks"] += len(payload)
+                stats["inserts"] += 1
+                progress.update(len(payload))
+            elif op == "move":
+                stats["moved"] += len(payload)
+            elif op == "delete":
+                stats["deleted"] += len(payload)
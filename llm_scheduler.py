@@ -0,0 +1,403 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import tracing
+
+# Central scheduler for Gemini calls (generate_content and embed_content) made by app_rag.py
+#   rate limits : token buckets on requests and on (estimated) tokens per minute, so bursts queue up here
+#                 instead of coming back as 429s
+#   priorities  : one dispatcher hands out quota highest priority first, user-facing generation ahead of
+#                 planning and grounding, reranking last
+#   coalescing  : identical in-flight non-streaming calls share one request and its response
+#   retries     : rate limit and transient server errors are retried with full-jitter exponential backoff
+# Sync calls run on the scheduler's worker threads. Async calls (submit_async) are only granted their slot
+# and quota by the dispatcher and then awaited on the caller's event loop, so they hold no thread.
+# A streamed call keeps its slot until its chunks have been read (StreamLease), the generation is still
+# running upstream until then; its token usage is charged from the last chunk.
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "1") == "1"
+LLM_RPM = float(os.getenv("LLM_RPM", "1000"))         # requests per minute, 0 for no limit
+LLM_TPM = float(os.getenv("LLM_TPM", "1000000"))      # tokens per minute, 0 for no limit
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", "10")) # bucket capacity, in seconds worth of quota
+
+RETRY_CODES = {429, 500, 503, 504}
+
+PRIORITIES = {
+    "answer": 0,
+    "plan": 1,
+    "ground": 1,
+    "embed": 1,
+    "rerank": 2,
+}
+
+
+def estimate_tokens(text: str):
+    return max(1, len(text) // 4)
+
+def is_retryable(error: Exception):
+    # google.api_core exceptions carry the HTTP status in .code (ResourceExhausted is 429)
+    code = getattr(error, "code", None)
+    return code in RETRY_CODES or "429" in str(error)
+
+def backoff_delay(attempt: int, base: float = LLM_BACKOFF_BASE, cap: float = LLM_BACKOFF_MAX):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Refills at `per_minute / 60` per second up to `capacity`; take() blocks until the amount is available."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float = 1):
+        amount = min(amount, self.capacity) # oversized requests wait for a full bucket, not forever
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def debit(self, amount: float):
+        """Charge usage found out after the fact (can go negative, later callers then wait)."""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+    def drain(self):
+        # the API said 429, so the quota is spent whatever our estimate says
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+
+class StreamLease:
+    """A streamed response that holds its scheduler slot until it is read to the end, fails or is closed."""
+
+    def __init__(self, response, release):
+        self.response = response
+        self._release = release
+        self._usage = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def __iter__(self):
+        try:
+            for chunk in self.response:
+                self._usage = getattr(chunk, "usage_metadata", None) or self._usage
+                yield chunk
+        finally:
+            self.close()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.response:
+                self._usage = getattr(chunk, "usage_metadata", None) or self._usage
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            release, self._release = self._release, None
+        if release is not None:
+            release(self._usage)
+
+    def __del__(self):
+        self.close() # a stream dropped unread must not keep the slot
+
+
+class Job:
+    def __init__(self, purpose: str, fn, tokens: int, key=None, stream: bool = False):
+        self.purpose = purpose
+        self.priority = PRIORITIES.get(purpose, 1)
+        self.fn = fn
+        self.tokens = tokens
+        self.key = key
+        self.stream = stream
+        self.attempt = 0
+        self.future = Future()
+        self.permit = None # async jobs: resolved by the dispatcher once the call may start
+        self.queued = time.perf_counter()
+
+
+class LLMScheduler:
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM, concurrency: int = LLM_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES, burst_seconds: float = LLM_BURST_SECONDS):
+        self.requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self.tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        self.max_retries = max_retries
+        self.counters = {"calls": 0, "coalesced": 0, "retries": 0, "failures": 0}
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count() # FIFO within a priority
+        self._slots = threading.Semaphore(concurrency)
+        self._workers = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm")
+        self._inflight = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._dispatch, daemon=True, name="llm-dispatch").start()
+
+    def submit(self, purpose: str, fn, tokens: int = 1, key=None, stream: bool = False):
+        """Schedule fn() and return a Future; calls with the same key share one in-flight request.
+
+        With stream=True fn returns a streamed response, resolved as a StreamLease holding the slot.
+        """
+        with self._lock:
+            if key is not None and key in self._inflight:
+                self.counters["coalesced"] += 1
+                tracing.count("rag_llm_coalesced_total", purpose=purpose)
+                return self._inflight[key]
+            job = Job(purpose, tracing.propagate(fn), tokens, key, stream)
+            if key is not None:
+                self._inflight[key] = job.future
+        self._enqueue(job)
+        return job.future
+
+    def call(self, purpose: str, fn, tokens: int = 1, key=None, stream: bool = False):
+        return self.submit(purpose, fn, tokens, key, stream).result()
+
+    def submit_async(self, purpose: str, coro_fn, tokens: int = 1, key=None, stream: bool = False):
+        """submit() for coroutine calls, from inside a running event loop.
+
+        The call runs as a task on that loop once it is granted a slot and quota; it is not tied to the
+        caller, so a caller that stops waiting doesn't cancel it for coalesced ones.
+        """
+        with self._lock:
+            if key is not None and key in self._inflight:
+                self.counters["coalesced"] += 1
+                tracing.count("rag_llm_coalesced_total", purpose=purpose)
+                return self._inflight[key]
+            job = Job(purpose, coro_fn, tokens, key, stream)
+            if key is not None:
+                self._inflight[key] = job.future
+        task = asyncio.get_running_loop().create_task(self._run_async(job))
+        self._tasks.add(task) # the loop only keeps weak references to tasks
+        task.add_done_callback(self._tasks.discard)
+        return job.future
+
+    def _enqueue(self, job: Job):
+        self._queue.put((job.priority, next(self._order), job))
+
+    def _dispatch(self):
+        while True:
+            self._slots.acquire() # only take a job once it can run, so a later urgent job isn't stuck behind
+            _, _, job = self._queue.get()
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(job.tokens)
+            tracing.observe("rag_llm_queue_seconds", time.perf_counter() - job.queued, purpose=job.purpose)
+            if job.permit is not None:
+                if not job.permit.set_running_or_notify_cancel():
+                    self._slots.release() # the waiting task was cancelled before its turn came
+                    continue
+                job.permit.set_result(None)
+            else:
+                self._workers.submit(self._run, job)
+
+    def _run(self, job: Job):
+        self._count_call(job)
+        try:
+            result = job.fn()
+        except Exception as e:
+            delay = self._after_error(job, e)
+            if delay is not None:
+                threading.Timer(delay, self._enqueue, args=(job,)).start()
+            return
+        self._after_result(job, result)
+
+    async def _run_async(self, job: Job):
+        holding = False # whether this task holds a concurrency slot that nothing else will release
+        try:
+            while True:
+                job.permit = Future()
+                self._enqueue(job)
+                try:
+                    await asyncio.wrap_future(job.permit)
+                finally:
+                    # also true when the task is cancelled just as the dispatcher grants the slot
+                    holding = job.permit.done() and not job.permit.cancelled()
+                self._count_call(job)
+                try:
+                    result = await job.fn()
+                except Exception as e:
+                    holding = False
+                    delay = self._after_error(job, e)
+                    if delay is not None:
+                        await asyncio.sleep(delay)
+                        continue
+                    return
+                holding = False
+                self._after_result(job, result)
+                return
+        finally:
+            # cancelled (CancelledError is a BaseException): free the slot and fail the shared future so
+            # callers coalesced onto this job don't wait forever
+            if holding:
+                self._slots.release()
+            if not job.future.done():
+                self._finish(job, error=asyncio.CancelledError())
+
+    def _count_call(self, job: Job):
+        with self._lock:
+            self.counters["calls"] += 1
+        tracing.count("rag_llm_requests_total", purpose=job.purpose)
+
+    def _after_error(self, job: Job, error: Exception):
+        """Free the slot, then return the backoff delay if the job should be retried, else fail it."""
+        self._slots.release()
+        if is_retryable(error) and job.attempt < self.max_retries:
+            if self.requests and getattr(error, "code", 429) == 429:
+                self.requests.drain()
+            delay = backoff_delay(job.attempt)
+            job.attempt += 1
+            job.queued = time.perf_counter() + delay
+            with self._lock:
+                self.counters["retries"] += 1
+            tracing.count("rag_llm_retries_total", purpose=job.purpose)
+            return delay
+        with self._lock:
+            self.counters["failures"] += 1
+        self._finish(job, error=error)
+        return None
+
+    def _after_result(self, job: Job, result):
+        if job.stream:
+            self._finish(job, result=StreamLease(result, lambda usage: self._release(job, usage)))
+            return
+        self._release(job, getattr(result, "usage_metadata", None))
+        self._finish(job, result=result)
+
+    def _release(self, job: Job, usage):
+        """Free the slot and charge the tokens used beyond the estimate taken up front."""
+        self._slots.release()
+        total = getattr(usage, "total_token_count", None) if usage is not None else None
+        if self.tokens and total and total > job.tokens:
+            self.tokens.debit(total - job.tokens)
+
+    def _finish(self, job: Job, result=None, error=None):
+        with self._lock:
+            if job.key is not None:
+                self._inflight.pop(job.key, None)
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "queued": self._queue.qsize(), "inflight": len(self._inflight)}
+
+
+# Shared instance
+_SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+def get_scheduler():
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        with _SCHEDULER_LOCK:
+            if _SCHEDULER is None:
+                _SCHEDULER = LLMScheduler()
+    return _SCHEDULER
+
+def set_scheduler(scheduler):
+    global _SCHEDULER
+    _SCHEDULER = scheduler
+
+
+# Call helpers
+def request_key(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def generate(model, prompt, purpose: str, generation_config=None, stream: bool = False, request_options=None):
+    """model.generate_content through the scheduler (called directly when LLM_SCHEDULER_ENABLED=0)."""
+    def call():
+        return model.generate_content(prompt, generation_config=generation_config, stream=stream,
+                                      request_options=request_options)
+    if not LLM_SCHEDULER_ENABLED:
+        return call()
+    # a stream belongs to one consumer, only complete responses are shared
+    key = None if stream else request_key("generate", id(model), prompt, generation_config)
+    return get_scheduler().call(purpose, call, estimate_tokens(prompt), key, stream)
+
+def embed(embed_fn, texts: list, model: str):
+    """Batch embedding call (an embedding_cache backend) through the scheduler."""
+    if not LLM_SCHEDULER_ENABLED:
+        return embed_fn(texts, model=model)
+    key = request_key("embed", model, texts)
+    tokens = sum(estimate_tokens(text) for text in texts)
+    return get_scheduler().call("embed", lambda: embed_fn(texts, model=model), tokens, key)
+
+
+# Async call helpers
+async def _wait_for(future):
+    # shielded, so a caller that gives up doesn't cancel a call that coalesced callers are waiting on
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+async def generate_async(model, prompt, purpose: str, generation_config=None, stream: bool = False,
+                         request_options=None):
+    """generate() for the async pipeline; with stream=True the result is an async iterator of chunks."""
+    if not LLM_SCHEDULER_ENABLED:
+        return await model.generate_content_async(prompt, generation_config=generation_config, stream=stream,
+                                                  request_options=request_options)
+    def call():
+        return model.generate_content_async(prompt, generation_config=generation_config, stream=stream,
+                                            request_options=request_options)
+    key = None if stream else request_key("generate", id(model), prompt, generation_config)
+    return await _wait_for(get_scheduler().submit_async(purpose, call, estimate_tokens(prompt), key, stream))
+
+async def embed_async(embed_fn, texts: list, model: str):
+    if not LLM_SCHEDULER_ENABLED:
+        return await asyncio.to_thread(embed_fn, texts, model=model)
+    key = request_key("embed", model, texts)
+    tokens = sum(estimate_tokens(text) for text in texts)
+    # embedding backends are sync functions, only the call itself borrows a thread
+    call = lambda: asyncio.to_thread(embed_fn, texts, model=model)
+    return await _wait_for(get_scheduler().submit_async("embed", call, tokens, key))
+
+
+class ScheduledModel:
+    """Drop-in for a GenerativeModel whose calls all go through the scheduler under one purpose,
+    for code that takes a model, like rerank_engine."""
+
+    def __init__(self, model, purpose: str):
+        self.model = model
+        self.purpose = purpose
+
+    @property
+    def model_name(self):
+        return getattr(self.model, "model_name", None)
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None):
+        return generate(self.model, prompt, self.purpose, generation_config=generation_config, stream=stream,
+                        request_options=request_options)
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, request_options=None):
+        return await generate_async(self.model, prompt, self.purpose, generation_config=generation_config,
+                                    stream=stream, request_options=request_options)
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+import vector_index
+
+# Local fast-path router in front of the LLM planner
+# A query is in scope when its embedding is close to one of the centroids of the ingested FX chunks,
+# and out of scope when it is far from all of them and mentions nothing from the FX lexicon.
+# Anything in between is low confidence and goes to plan() as before. The lexicon only holds FX-specific terms:
+# a generic word like "rate" or "bank" next to a middling similarity says nothing about scope.
+# Off by default: the thresholds depend on the embedding model and corpus, so calibrate them first with the
+# router pass of evaluation.py (confusion matrix on labelled in / out of scope queries, suggested thresholds).
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "0") == "1"
+ROUTER_IN_SCOPE = float(os.getenv("ROUTER_IN_SCOPE", "0.75"))       # similarity alone is enough
+ROUTER_KEYWORD_SCOPE = float(os.getenv("ROUTER_KEYWORD_SCOPE", "0.6")) # enough with a lexicon hit
+ROUTER_OUT_OF_SCOPE = float(os.getenv("ROUTER_OUT_OF_SCOPE", "0.5"))  # below this, with no hit, refuse
+ROUTER_CENTROIDS = int(os.getenv("ROUTER_CENTROIDS", "16"))
+ROUTER_CENTROIDS_PATH = os.getenv("ROUTER_CENTROIDS_PATH", ".router_centroids.npy")
+ROUTER_LOG_PATH = os.getenv("ROUTER_LOG_PATH", "") # opt-in, it stores the raw questions; '' disables the log
+
+IN_SCOPE_STEPS = ["RETRIEVE", "ANSWER"]
+OUT_OF_SCOPE_STEPS = ["REFUSE"]
+
+FX_LEXICON = {
+    "fx", "forex", "currency", "currencies", "multicurrency", "markup", "hedging", "counterparty",
+    "usd", "eur", "gbp", "jpy", "sgd", "aud", "cad", "chf", "hkd", "cny", "euro", "euros", "yen"
+}
+FX_PHRASES = (
+    "exchange rate", "foreign exchange", "spot rate", "spot trade", "forward rate", "forward contract",
+    "fx swap", "currency swap", "bid ask spread"
+)
+WORD_RE = re.compile(r"[a-z]+")
+
+
+def kmeans(vectors, k: int, iterations: int = 10):
+    """Spherical k-means over L2-normalised rows."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    centroids = vectors[np.linspace(0, len(vectors) - 1, k).astype(int)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(k):
+            members = vectors[assignment == c]
+            if len(members):
+                mean = members.mean(axis=0)
+                centroids[c] = mean / (np.linalg.norm(mean) or 1.0)
+    return centroids
+
+
+class QueryRouter:
+    def __init__(self, centroids, lexicon: set = FX_LEXICON, phrases: tuple = FX_PHRASES,
+                 in_scope: float = ROUTER_IN_SCOPE, keyword_scope: float = ROUTER_KEYWORD_SCOPE,
+                 out_of_scope: float = ROUTER_OUT_OF_SCOPE):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.lexicon = lexicon
+        self.phrases = phrases
+        self.in_scope = in_scope
+        self.keyword_scope = keyword_scope
+        self.out_of_scope = out_of_scope
+
+    @classmethod
+    def from_vectors(cls, vectors, k: int = ROUTER_CENTROIDS, **thresholds):
+        return cls(kmeans(vectors, k), **thresholds)
+
+    def classify(self, query: str, query_embedding):
+        """Return the steps to run (None when the router isn't confident) with the evidence used."""
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        similarity = float(np.max(self.centroids @ vector))
+        words = WORD_RE.findall(query.lower())
+        text = f" {' '.join(words)} "
+        keywords = sorted(set(words) & self.lexicon | {p for p in self.phrases if f" {p}" in text})
+
+        if similarity >= self.in_scope or (keywords and similarity >= self.keyword_scope):
+            steps, confidence = IN_SCOPE_STEPS, "in_scope"
+        elif similarity < self.out_of_scope and not keywords:
+            steps, confidence = OUT_OF_SCOPE_STEPS, "out_of_scope"
+        else:
+            steps, confidence = None, "low"
+        return {"steps": steps, "confidence": confidence, "similarity": similarity, "keywords": keywords}
+
+
+# Decision log, one JSON line per routed query so router and planner agreement can be measured
+_LOG_LOCK = threading.Lock()
+
+def log_decision(query: str, decision: dict, llm_steps=None, path: str = ROUTER_LOG_PATH):
+    if not path:
+        return
+    record = {
+        "time": time.time(),
+        "query": query,
+        "router": decision["steps"],
+        "confidence": decision["confidence"],
+        "similarity": round(decision["similarity"], 4),
+        "keywords": decision["keywords"],
+        "llm": llm_steps,
+    }
+    with _LOG_LOCK, open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def route(query: str, query_embedding, model, plan_fn):
+    """Pick the agent steps locally when confident, otherwise ask the LLM planner."""
+    router = get_router()
+    if router is None:
+        return plan_fn(query, model)
+    decision = router.classify(query, query_embedding)
+    if decision["steps"] is not None:
+        log_decision(query, decision)
+        return decision["steps"]
+    steps = plan_fn(query, model)
+    log_decision(query, decision, llm_steps=steps)
+    return steps
+
+async def route_async(query: str, query_embedding, model, plan_fn):
+    """route() for the async pipeline, plan_fn is a coroutine function."""
+    router = get_router()
+    if router is None:
+        return await plan_fn(query, model)
+    decision = router.classify(query, query_embedding)
+    if decision["steps"] is not None:
+        await asyncio.to_thread(log_decision, query, decision) # file append, off the event loop
+        return decision["steps"]
+    steps = await plan_fn(query, model)
+    await asyncio.to_thread(log_decision, query, decision, steps)
+    return steps
+
+def compare_with_planner(queries: list, embed_fn, model, plan_fn, router=None):
+    """Run router and LLM planner on every query, log both and return the agreement rate and decisions."""
+    router = router or get_router()
+    agree, decided, decisions = 0, 0, []
+    for query in queries:
+        decision = router.classify(query, embed_fn(query))
+        llm_steps = plan_fn(query, model)
+        log_decision(query, decision, llm_steps=llm_steps)
+        decisions.append((decision, llm_steps))
+        if decision["steps"] is not None:
+            decided += 1
+            agree += ("REFUSE" in decision["steps"]) == ("REFUSE" in llm_steps)
+    return {
+        "queries": len(queries),
+        "router_decided": decided,
+        "agreement": agree / decided if decided else 0.0,
+        "decisions": decisions,
+    }
+
+def confusion_matrix(labels: list, decisions: list):
+    """labels[i] in ("in_scope", "out_of_scope") vs the router's confidence for query i."""
+    matrix = {label: {"in_scope": 0, "out_of_scope": 0, "low": 0} for label in ("in_scope", "out_of_scope")}
+    for label, decision in zip(labels, decisions):
+        matrix[label][decision["confidence"]] += 1
+    return matrix
+
+def suggest_thresholds(labels: list, decisions: list):
+    """The loosest thresholds that route none of the labelled queries to the wrong side.
+
+    Out of scope queries must stay below ROUTER_IN_SCOPE (and below ROUTER_KEYWORD_SCOPE when they hit the
+    lexicon); in scope queries without a lexicon hit must stay at or above ROUTER_OUT_OF_SCOPE. Without
+    examples for a threshold the current setting stands.
+    """
+    outside = [d for label, d in zip(labels, decisions) if label == "out_of_scope"]
+    inside = [d for label, d in zip(labels, decisions) if label == "in_scope" and not d["keywords"]]
+    with_keywords = [d["similarity"] for d in outside if d["keywords"]]
+    return {
+        "ROUTER_IN_SCOPE": round(max(d["similarity"] for d in outside) + 0.01, 2) if outside else ROUTER_IN_SCOPE,
+        "ROUTER_KEYWORD_SCOPE": round(max(with_keywords) + 0.01, 2) if with_keywords else ROUTER_KEYWORD_SCOPE,
+        "ROUTER_OUT_OF_SCOPE": round(min(d["similarity"] for d in inside), 2) if inside else ROUTER_OUT_OF_SCOPE,
+    }
+
+
+# Shared instance: centroids saved by `python query_router.py`, else built from the local vector index.
+# Looked up once per process, also when neither exists, so requests don't stat both files every time.
+_ROUTER = None
+_ROUTER_LOADED = False
+_ROUTER_LOCK = threading.Lock()
+
+def load_router():
+    """A router from the saved centroids or the local vector index, None when neither exists."""
+    if os.path.exists(ROUTER_CENTROIDS_PATH):
+        return QueryRouter(np.load(ROUTER_CENTROIDS_PATH))
+    if os.path.exists(os.path.join(vector_index.LOCAL_INDEX_DIR, vector_index.VECTORS_FILE)):
+        return QueryRouter.from_vectors(vector_index.get_index().vectors)
+    return None
+
+def get_router():
+    global _ROUTER, _ROUTER_LOADED
+    if not ROUTER_ENABLED:
+        return None
+    if not _ROUTER_LOADED:
+        with _ROUTER_LOCK:
+            if not _ROUTER_LOADED:
+                _ROUTER = load_router()
+                _ROUTER_LOADED = True
+    return _ROUTER
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Build router centroids from the Supabase documents table")
+    parser.add_argument("--out", default=ROUTER_CENTROIDS_PATH)
+    parser.add_argument("-k", type=int, default=ROUTER_CENTROIDS)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+    rows = vector_index.fetch_rows(client, columns="embedding")
+    vectors = np.array([vector_index.parse_embedding(r["embedding"]) for r in rows], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.save(args.out, kmeans(vectors, args.k))
+    print(f"Saved {min(args.k, len(vectors))} router centroids to {args.out}")
@@ -0,0 +1,9 @@
+import re
+
+# Question text normalisation shared by the single-flight /chat key (app_rag.py), batch de-duplication
+# (batch_qa.py) and the rerank score cache key (rerank_cache.py)
+
+
+def normalize_query(query: str):
+    # case, spacing and trailing punctuation don't change the question
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from query_text import normalize_query
+
+# Rerank score cache
+# A pointwise relevance score only depends on the question, the chunk text, the judging prompt and the model, so
+# scores are kept under sha256(prompt version, model, normalised query, chunk content hash). Listwise scores
+# also depend on the other candidates in the prompt and aren't cached.
+#   tier 1: in-process LRU of RERANK_CACHE_MAX_ENTRIES scores
+#   tier 2: SQLite file on disk, shared by workers and kept across restarts ('' turns it off)
+# The prompt version is a hash of the prompt template, so editing the prompt starts a fresh set of scores. A
+# chunk whose text changes gets a new content hash and is scored again; ingest drops the scores of chunks it
+# deletes (forget_chunks). Failed or timed-out calls are never cached.
+RERANK_CACHE_ENABLED = os.getenv("RERANK_CACHE_ENABLED", "1") == "1"
+RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "50000"))
+RERANK_CACHE_PATH = os.getenv("RERANK_CACHE_PATH", ".rerank_cache.sqlite") # '' keeps it in memory only
+
+
+def chunk_hash(doc: dict):
+    # the ingest pipeline stores the same sha256 in metadata.content_hash
+    metadata = doc.get("metadata") or {}
+    return metadata.get("content_hash") or hashlib.sha256(doc["content"].encode("utf-8")).hexdigest()
+
+def score_key(prompt_version: str, model_name: str, query: str, content_hash: str):
+    query_hash = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{prompt_version}\0{model_name}\0{query_hash}\0{content_hash}".encode("utf-8")).hexdigest()
+
+
+class RerankCache:
+    def __init__(self, max_entries: int = RERANK_CACHE_MAX_ENTRIES, path: str = RERANK_CACHE_PATH):
+        self.max_entries = max_entries
+        self.memory = OrderedDict() # key -> (score, chunk hash)
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, chunk_hash TEXT, score REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS scores_chunk ON scores (chunk_hash)")
+            self.db.commit()
+
+    def get_many(self, keys: list):
+        """Cached score per key, None for misses."""
+        scores = []
+        with self._lock:
+            for key in keys:
+                entry = self.memory.get(key)
+                if entry is not None:
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    scores.append(entry[0])
+                    continue
+
+                if self.db is not None:
+                    row = self.db.execute("SELECT score, chunk_hash FROM scores WHERE key = ?", (key,)).fetchone()
+                    if row:
+                        self._remember(key, (row[0], row[1]))
+                        self.counters["disk_hits"] += 1
+                        scores.append(row[0])
+                        continue
+
+                self.counters["misses"] += 1
+                scores.append(None)
+        return scores
+
+    def put_many(self, entries: list):
+        """Store (key, chunk hash, score) entries."""
+        with self._lock:
+            for key, content_hash, score in entries:
+                self._remember(key, (score, content_hash))
+            if self.db is not None and entries:
+                self.db.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?)",
+                                    [(key, content_hash, score) for key, content_hash, score in entries])
+                self.db.commit()
+
+    def forget_chunks(self, content_hashes):
+        """Drop every score of these chunks, e.g. after ingest deleted them."""
+        content_hashes = set(content_hashes)
+        with self._lock:
+            for key in [k for k, (_, h) in self.memory.items() if h in content_hashes]:
+                del self.memory[key]
+            if self.db is not None and content_hashes:
+                self.db.executemany("DELETE FROM scores WHERE chunk_hash = ?", [(h,) for h in content_hashes])
+                self.db.commit()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.counters.values())
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+            }
+
+
+# Shared instance
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_cache():
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = RerankCache()
+    return _CACHE
+
+def set_cache(cache):
+    global _CACHE
+    with _CACHE_LOCK:
+        _CACHE = cache
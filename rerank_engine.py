@@ -0,0 +1,304 @@
+import asyncio
+import hashlib
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+
+import rerank_cache
+import tracing
+
+# Reranking engine shared by app_rag.py and agentic_rag.py
+#   concurrent : one pointwise prompt per candidate, scored through a bounded worker pool
+#   listwise   : every candidate in a single prompt, scores parsed out of the reply
+# Pointwise scores already in the rerank cache (rerank_cache.py) are reused and only the other candidates reach
+# the model. Listwise scores aren't cached: each one is relative to the other passages in the same prompt.
+# Every request scores at most RERANK_MAX_WORKERS candidates at once; how many LLM calls run across requests
+# is left to the scheduler (llm_scheduler.py). RERANK_TIMEOUT bounds each call from the moment it is sent, so
+# time spent queued behind other requests never counts against it. A call that fails, times out or replies
+# without a number is counted in rag_rerank_unscored_total{reason} (the error is on the llm.rerank span), is
+# not cached, and its candidate ranks after every scored one. A listwise reply that fails or misses passages
+# is counted in rag_rerank_listwise_fallbacks_total{reason} and those passages are scored pointwise.
+RERANK_MODE = os.getenv("RERANK_MODE", "concurrent")
+RERANK_MAX_WORKERS = int(os.getenv("RERANK_MAX_WORKERS", "8"))
+RERANK_TIMEOUT = float(os.getenv("RERANK_TIMEOUT", "20"))
+
+
+def rerank_prompt(query: str, passage: str):
+    return f"""
+You are a relevance judge for a retrieval system.
+Read the query and passage carefully, Score relevance strictly.
+
+10 = directly answers the query
+7 - 9 = provides key supporting details
+4 - 6 = related but not sufficient alone
+0 - 3 = irrelevant
+Query:
+{query}
+
+Passage:
+{passage}
+
+Score the relevance from 0 (irrelevant) to 10 (highly relevant).
+Return ONLY the number.
+"""
+
+def listwise_prompt(query: str, passages: list):
+    numbered = "\n\n".join(f"[{i}]\n{passage}" for i, passage in enumerate(passages))
+    return f"""
+You are a relevance judge for a retrieval system.
+Read the query and every numbered passage carefully, Score each passage strictly.
+
+10 = directly answers the query
+7 - 9 = provides key supporting details
+4 - 6 = related but not sufficient alone
+0 - 3 = irrelevant
+Query:
+{query}
+
+Passages:
+{numbered}
+
+Score the relevance of every passage from 0 (irrelevant) to 10 (highly relevant).
+Return ONLY a JSON list with one number per passage, in passage order.
+Example for three passages:
+[8, 2, 5]
+"""
+
+
+# Score parsing
+def parse_score(text: str):
+    try:
+        return float(text.strip())
+    except (TypeError, ValueError):
+        match = re.search(r"\d+(?:\.\d+)?", text or "")
+        return float(match.group()) if match else None
+
+def parse_listwise_scores(text: str, count: int):
+    """Return a list of `count` scores, None where the reply had no score."""
+    scores = [None] * count
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", (text or "").strip())
+
+    def json_scores(candidate):
+        try:
+            values = json.loads(candidate)
+        except ValueError:
+            return None
+        if isinstance(values, list) and len(values) == count:
+            return [float(v) for v in values]
+        return None
+
+    # the asked-for format: the whole reply is the list
+    if text.startswith("["):
+        values = json_scores(text)
+        if values is not None:
+            return values
+
+    # "[i] score" / "i: score" lines come before a list found inside the text, since "[0] 8" would
+    # otherwise read as the one-element list [0]
+    pattern = r"(?:\[(\d+)\]\s*[:=\-]?|(\d+)\s*[:=\-)])\s*(\d+(?:\.\d+)?)"
+    pairs = re.findall(pattern, text)
+    for bracketed, plain, score in pairs:
+        idx = int(bracketed or plain)
+        if 0 <= idx < count:
+            scores[idx] = float(score)
+    if pairs:
+        return scores
+
+    for match in re.finditer(r"\[[\d\s.,]*\]", text):
+        values = json_scores(match.group())
+        if values is not None:
+            return values
+    return scores
+
+
+# Scoring modes
+def failure_reason(error: Exception):
+    # DeadlineExceeded from the SDK is a 504
+    if isinstance(error, TimeoutError) or getattr(error, "code", None) == 504:
+        return "timeout"
+    return "error"
+
+def score_one(query, doc, model, timeout=RERANK_TIMEOUT):
+    prompt = rerank_prompt(query, doc["content"])
+    try:
+        with tracing.span("llm.rerank", mode="pointwise"):
+            response = model.generate_content(
+                prompt,
+                generation_config={"temperature": 0},
+                request_options={"timeout": timeout}
+            )
+        tracing.record_llm("rerank", response)
+        score = parse_score(response.text)
+    except Exception as e:
+        tracing.count("rag_rerank_unscored_total", reason=failure_reason(e))
+        return None
+    if score is None:
+        tracing.count("rag_rerank_unscored_total", reason="unparsable")
+    return score
+
+def score_concurrent(query, documents, model, timeout=RERANK_TIMEOUT):
+    score = tracing.propagate(score_one) # keeps the request id on the worker threads
+    # the request's own workers: its candidates never wait behind another request's calls
+    with ThreadPoolExecutor(max_workers=min(RERANK_MAX_WORKERS, len(documents)) or 1,
+                            thread_name_prefix="rerank") as pool:
+        return list(pool.map(score, repeat(query), documents, repeat(model), repeat(timeout)))
+
+def score_listwise(query, documents, model, timeout=RERANK_TIMEOUT):
+    prompt = listwise_prompt(query, [doc["content"] for doc in documents])
+    try:
+        with tracing.span("llm.rerank", mode="listwise", candidates=len(documents)):
+            response = model.generate_content(
+                prompt,
+                generation_config={"temperature": 0},
+                request_options={"timeout": timeout}
+            )
+        tracing.record_llm("rerank", response)
+        scores = parse_listwise_scores(response.text, len(documents))
+        if None in scores:
+            tracing.count("rag_rerank_listwise_fallbacks_total", reason="unparsable")
+    except Exception as e:
+        tracing.count("rag_rerank_listwise_fallbacks_total", reason=failure_reason(e))
+        scores = [None] * len(documents)
+
+    # anything the listwise reply missed is scored pointwise
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        retried = score_concurrent(query, [documents[i] for i in missing], model, timeout)
+        for i, score in zip(missing, retried):
+            scores[i] = score
+    return scores
+
+SCORERS = {
+    "concurrent": score_concurrent,
+    "listwise": score_listwise,
+}
+
+
+# Score cache
+def prompt_version():
+    template = rerank_prompt("{query}", "{passage}")
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+PROMPT_VERSION = prompt_version()
+
+def cached_scores(query, documents, model, mode):
+    """(scores, keys): cached scores with None where the model still has to be asked, keys to store them under."""
+    if not rerank_cache.RERANK_CACHE_ENABLED or mode != "concurrent":
+        return [None] * len(documents), None
+    model_name = getattr(model, "model_name", None) or ""
+    keys = [(rerank_cache.score_key(PROMPT_VERSION, model_name, query, rerank_cache.chunk_hash(doc)),
+             rerank_cache.chunk_hash(doc)) for doc in documents]
+    scores = rerank_cache.get_cache().get_many([key for key, _ in keys])
+    hits = sum(score is not None for score in scores)
+    tracing.count("rag_rerank_cache_lookups_total", hits, result="hit")
+    tracing.count("rag_rerank_cache_lookups_total", len(documents) - hits, result="miss")
+    return scores, keys
+
+def store_scores(keys, missing, fresh):
+    if keys is None:
+        return
+    rerank_cache.get_cache().put_many([
+        (keys[i][0], keys[i][1], score) for i, score in zip(missing, fresh) if score is not None
+    ])
+
+def sort_scored(scores, documents):
+    # unscored candidates (score None) come after every scored one; the sort is stable, so ties and the
+    # unscored keep retrieval order
+    scored_docs = list(zip(scores, documents))
+    scored_docs.sort(key=lambda x: (x[0] is not None, x[0] or 0.0), reverse=True)
+    return scored_docs
+
+def rerank_documents(query, documents, model, mode=None):
+    """Score every candidate and return (score, doc) pairs, highest relevance first (None: no score)."""
+    if not documents:
+        return []
+    mode = mode or RERANK_MODE
+    if mode not in SCORERS:
+        raise ValueError(f"Unknown rerank mode: {mode}")
+
+    scores, keys = cached_scores(query, documents, model, mode)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        fresh = SCORERS[mode](query, [documents[i] for i in missing], model)
+        store_scores(keys, missing, fresh)
+        for i, score in zip(missing, fresh):
+            scores[i] = score
+    return sort_scored(scores, documents)
+
+
+# Async scoring, for app_rag's async pipeline: same prompts and fallbacks, no thread held per call
+async def score_one_async(query, doc, model, timeout=RERANK_TIMEOUT):
+    prompt = rerank_prompt(query, doc["content"])
+    try:
+        with tracing.span("llm.rerank", mode="pointwise"):
+            response = await model.generate_content_async(
+                prompt,
+                generation_config={"temperature": 0},
+                request_options={"timeout": timeout}
+            )
+        tracing.record_llm("rerank", response)
+        score = parse_score(response.text)
+    except Exception as e:
+        tracing.count("rag_rerank_unscored_total", reason=failure_reason(e))
+        return None
+    if score is None:
+        tracing.count("rag_rerank_unscored_total", reason="unparsable")
+    return score
+
+async def score_concurrent_async(query, documents, model, timeout=RERANK_TIMEOUT):
+    slots = asyncio.Semaphore(RERANK_MAX_WORKERS) # same fan-out per query as the thread pool
+
+    async def score(doc):
+        async with slots:
+            return await score_one_async(query, doc, model, timeout)
+    return list(await asyncio.gather(*(score(doc) for doc in documents)))
+
+async def score_listwise_async(query, documents, model, timeout=RERANK_TIMEOUT):
+    prompt = listwise_prompt(query, [doc["content"] for doc in documents])
+    try:
+        with tracing.span("llm.rerank", mode="listwise", candidates=len(documents)):
+            response = await model.generate_content_async(
+                prompt,
+                generation_config={"temperature": 0},
+                request_options={"timeout": timeout}
+            )
+        tracing.record_llm("rerank", response)
+        scores = parse_listwise_scores(response.text, len(documents))
+        if None in scores:
+            tracing.count("rag_rerank_listwise_fallbacks_total", reason="unparsable")
+    except Exception as e:
+        tracing.count("rag_rerank_listwise_fallbacks_total", reason=failure_reason(e))
+        scores = [None] * len(documents)
+
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        retried = await score_concurrent_async(query, [documents[i] for i in missing], model, timeout)
+        for i, score in zip(missing, retried):
+            scores[i] = score
+    return scores
+
+ASYNC_SCORERS = {
+    "concurrent": score_concurrent_async,
+    "listwise": score_listwise_async,
+}
+
+async def rerank_documents_async(query, documents, model, mode=None):
+    """rerank_documents for coroutines; model needs generate_content_async."""
+    if not documents:
+        return []
+    mode = mode or RERANK_MODE
+    if mode not in ASYNC_SCORERS:
+        raise ValueError(f"Unknown rerank mode: {mode}")
+
+    # the cache reads and writes SQLite, so it runs off the event loop
+    scores, keys = await asyncio.to_thread(tracing.propagate(cached_scores), query, documents, model, mode)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        fresh = await ASYNC_SCORERS[mode](query, [documents[i] for i in missing], model)
+        if keys is not None:
+            await asyncio.to_thread(store_scores, keys, missing, fresh)
+        for i, score in zip(missing, fresh):
+            scores[i] = score
+    return sort_scored(scores, documents)
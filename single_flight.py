@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import tracing
+
+# Single-flight: concurrent calls with the same key run fn once, every caller gets its result
+# The first caller (the leader) runs fn in its own thread; callers arriving while it runs wait for the same
+# outcome, bounded by `timeout`, and receive its exception if it fails. Nothing is kept once the call
+# returns, so this deduplicates bursts only; later repeats are the answer cache's job.
+# do_async is the same for coroutines on one event loop (the ASGI server's); there the call runs as a task of
+# its own, so cancelling the leader (a disconnected client) still lets the followers get the answer.
+
+
+class SingleFlight:
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self.counters = {"leaders": 0, "shared": 0, "timeouts": 0}
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, timeout: float = None, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.counters["leaders"] += 1
+            else:
+                self.counters["shared"] += 1
+
+        if not leader:
+            tracing.count("rag_single_flight_shared_total", flight=self.name)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    self.counters["timeouts"] += 1
+                raise TimeoutError(f"Gave up after {timeout}s waiting for an identical in-flight request")
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def do_async(self, key, fn, *args, timeout: float = None, **kwargs):
+        with self._lock:
+            call = self._async_calls.get(key)
+            leader = call is None
+            if leader:
+                # the work runs as its own task, so the leader being cancelled doesn't take it down
+                # for the followers; it is only cancelled once nobody is waiting for it any more
+                call = self._async_calls[key] = {"task": asyncio.ensure_future(fn(*args, **kwargs)), "waiters": 0}
+                call["task"].add_done_callback(lambda task: self._forget_async(key, call))
+                self.counters["leaders"] += 1
+            else:
+                self.counters["shared"] += 1
+            call["waiters"] += 1
+
+        if not leader:
+            tracing.count("rag_single_flight_shared_total", flight=self.name)
+        try:
+            # shielded, a caller timing out or being cancelled must not cancel the result for the others
+            return await asyncio.wait_for(asyncio.shield(call["task"]), None if leader else timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.counters["timeouts"] += 1
+            raise TimeoutError(f"Gave up after {timeout}s waiting for an identical in-flight request")
+        finally:
+            with self._lock:
+                call["waiters"] -= 1
+                abandoned = call["waiters"] == 0
+            if abandoned and not call["task"].done():
+                call["task"].cancel()
+
+    def _forget_async(self, key, call):
+        with self._lock:
+            if self._async_calls.get(key) is call:
+                del self._async_calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "inflight": len(self._calls) + len(self._async_calls)}
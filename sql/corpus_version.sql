@@ -0,0 +1,16 @@
+-- Corpus version counter read by corpus.py (CORPUS_VERSION_TABLE) and bumped by ingest_db.py.
+-- Run once in the Supabase SQL editor.
+create table if not exists corpus_version (
+  id int primary key,
+  version bigint not null default 0
+);
+
+-- Atomic increment: concurrent ingest runs each get their own version, none is lost.
+create or replace function bump_corpus_version()
+returns bigint
+language sql
+as $$
+  insert into corpus_version (id, version) values (1, 1)
+  on conflict (id) do update set version = corpus_version.version + 1
+  returning version;
+$$;
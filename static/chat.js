@@ -1,3 +1,11 @@
+const STAGE_LABELS = {
+    planning: "Planning...",
+    retrieving: "Searching disclosures...",
+    reranking: "Ranking passages...",
+    generating: "Writing answer...",
+    grounding: "Checking answer against sources..."
+};
+
 async function sendMessage() {
     const input = document.getElementById("user-input");
     const chatbox = document.getElementById("chat-box");
@@ -7,15 +15,77 @@ async function sendMessage() {
     appendMessage("user-message", message);
     input.value = "";
     addLoadingMessage();
-    const response = await fetch("/chat", {
+    const response = await fetch("/chat/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ message })
     });
 
-    const data = await response.json();
-    removeLoadingMessage();
-    appendMessage("bot-message", data.answer);
+    if (!response.ok) {
+        removeLoadingMessage();
+        appendMessage("bot-message", "Something went wrong, please try again.");
+        return;
+    }
+
+    let botMessage = null;
+    await readEvents(response, (event, data) => {
+        if (event === "stage") {
+            setLoadingStage(STAGE_LABELS[data.stage] || data.stage);
+        } else if (event === "token") {
+            // answer text is rendered as it arrives from the model
+            if (!botMessage) {
+                removeLoadingMessage();
+                botMessage = appendMessage("bot-message", "");
+            }
+            botMessage.innerText += data.text;
+        } else if (event === "done") {
+            removeLoadingMessage();
+            if (!botMessage) botMessage = appendMessage("bot-message", "");
+            // the grounding verdict may replace what was streamed with the fallback answer
+            botMessage.innerText = data.answer;
+            appendSources(botMessage, data.sources);
+        } else if (event === "error") {
+            removeLoadingMessage();
+            appendMessage("bot-message", "Something went wrong, please try again.");
+        }
+    });
+}
+
+async function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-Sent Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = "message";
+            let data = "";
+            for (const line of frame.split("\n")) {
+                if (line.startsWith("event: ")) event = line.slice(7);
+                else if (line.startsWith("data: ")) data += line.slice(6);
+            }
+            onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+function appendSources(msg, sources) {
+    if (!sources || !sources.length) return;
+    const cite = document.createElement("div");
+    cite.classList.add("sources");
+    cite.innerText = "Sources: " + sources
+        .map(s => `${(s.source || "unknown").split("/").pop()} #${s.chunk_id}`)
+        .join(", ");
+    msg.appendChild(cite);
 }
 
 function appendMessage(sender, text) {
@@ -27,6 +97,7 @@ function appendMessage(sender, text) {
     msg.innerText = text;
     chatBox.appendChild(msg);
     chatBox.scrollTop = chatBox.scrollHeight;
+    return msg;
 }
 
 function addLoadingMessage() {
@@ -47,6 +118,17 @@ function addLoadingMessage() {
   chatBox.appendChild(loadingDiv);
   chatBox.scrollTop = chatBox.scrollHeight;
 }
+function setLoadingStage(label) {
+  const loading = document.getElementById("loading-message");
+  if (!loading) return;
+  let stage = loading.querySelector(".stage");
+  if (!stage) {
+    stage = document.createElement("span");
+    stage.classList.add("stage");
+    loading.appendChild(stage);
+  }
+  stage.innerText = label;
+}
 function removeLoadingMessage() {
   const loading = document.getElementById("loading-message");
   if (loading) loading.remove();
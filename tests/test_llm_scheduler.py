@@ -0,0 +1,207 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import llm_scheduler
+from fakes import FakeModel, FakeRateLimitError
+from llm_scheduler import LLMScheduler, TokenBucket
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """An unthrottled scheduler installed as the shared one, so generate() / embed() go through it."""
+    scheduler = LLMScheduler(rpm=0, tpm=0)
+    monkeypatch.setattr(llm_scheduler, "_SCHEDULER", scheduler)
+    monkeypatch.setattr(llm_scheduler, "LLM_SCHEDULER_ENABLED", True)
+    monkeypatch.setattr(llm_scheduler, "backoff_delay", lambda attempt: 0.0)
+    return scheduler
+
+
+def wait_until(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+# Priorities
+def test_queued_jobs_run_highest_priority_first():
+    scheduler = LLMScheduler(rpm=0, tpm=0, concurrency=1)
+    started, release = threading.Event(), threading.Event()
+    blocker = scheduler.submit("answer", lambda: (started.set(), release.wait(2)))
+    assert started.wait(2)
+
+    # the only slot is taken, so these queue up behind it
+    order = []
+    futures = [scheduler.submit(purpose, lambda purpose=purpose: order.append(purpose))
+               for purpose in ("rerank", "plan", "rerank", "answer", "ground")]
+    release.set()
+    blocker.result(timeout=2)
+    for future in futures:
+        future.result(timeout=2)
+    assert order == ["answer", "plan", "ground", "rerank", "rerank"]
+
+
+# Token buckets
+def test_token_bucket_blocks_once_the_burst_is_spent():
+    bucket = TokenBucket(per_minute=600, burst_seconds=0.1) # 10 per second, holds 1
+    start = time.perf_counter()
+    for _ in range(4):
+        bucket.take(1)
+    assert time.perf_counter() - start >= 0.25
+
+def test_request_limit_spaces_out_calls():
+    scheduler = LLMScheduler(rpm=600, tpm=0, burst_seconds=0.1)
+    model = FakeModel()
+    start = time.perf_counter()
+    futures = [scheduler.submit("answer", lambda i=i: model.generate_content(f"prompt {i}")) for i in range(5)]
+    for future in futures:
+        future.result(timeout=5)
+    assert model.calls == 5
+    assert time.perf_counter() - start >= 0.35
+
+def test_token_limit_charges_estimated_tokens():
+    scheduler = LLMScheduler(rpm=0, tpm=6000, burst_seconds=0.1) # 100 tokens per second, holds 10
+    start = time.perf_counter()
+    futures = [scheduler.submit("answer", lambda: None, tokens=10) for _ in range(3)]
+    for future in futures:
+        future.result(timeout=5)
+    assert time.perf_counter() - start >= 0.18
+
+
+# Coalescing
+def test_identical_inflight_prompts_share_one_call(scheduler):
+    model = FakeModel(latency=0.1)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        replies = list(pool.map(lambda _: llm_scheduler.generate(model, "same prompt", "answer").text, range(8)))
+    assert model.calls == 1
+    assert len(set(replies)) == 1
+    assert scheduler.stats()["coalesced"] == 7
+
+def test_streams_and_different_prompts_are_not_coalesced(scheduler):
+    model = FakeModel(latency=0.05)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: llm_scheduler.generate(model, f"prompt {i % 2}", "answer"), range(4)))
+        list(pool.map(lambda _: list(llm_scheduler.generate(model, "streamed", "answer", stream=True)), range(2)))
+    assert model.calls == 2 + 2
+
+
+# Streams
+def test_stream_holds_its_slot_until_read():
+    scheduler = LLMScheduler(rpm=0, tpm=0, concurrency=1)
+    model = FakeModel(token_latency=0.01)
+    stream = scheduler.call("answer", lambda: model.generate_content("streamed", stream=True), stream=True)
+    waiting = scheduler.submit("answer", lambda: "next")
+    time.sleep(0.05)
+    assert not waiting.done() # the only slot belongs to the unread stream
+
+    chunks = list(stream)
+    assert chunks and waiting.result(timeout=1) == "next"
+
+def test_closed_stream_frees_its_slot():
+    scheduler = LLMScheduler(rpm=0, tpm=0, concurrency=1)
+    model = FakeModel()
+    for _ in range(3):
+        stream = scheduler.call("answer", lambda: model.generate_content("streamed", stream=True), stream=True)
+        next(iter(stream))
+        stream.close()
+    assert scheduler.call("answer", lambda: "next") == "next"
+
+def test_async_stream_holds_its_slot_until_read(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "_SCHEDULER", LLMScheduler(rpm=0, tpm=0, concurrency=1))
+    monkeypatch.setattr(llm_scheduler, "LLM_SCHEDULER_ENABLED", True)
+    model = FakeModel(token_latency=0.01)
+
+    async def main():
+        stream = await llm_scheduler.generate_async(model, "streamed", "answer", stream=True)
+        waiting = asyncio.ensure_future(llm_scheduler.generate_async(model, "other", "answer"))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        chunks = [chunk async for chunk in stream]
+        return chunks, await asyncio.wait_for(waiting, 1)
+    chunks, reply = asyncio.run(main())
+    assert chunks and reply.text
+
+
+# Retries
+def test_rate_limited_calls_are_retried(scheduler):
+    attempts = []
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeRateLimitError("429 Resource has been exhausted")
+        return "ok"
+    assert scheduler.call("answer", flaky) == "ok"
+    assert len(attempts) == 3
+    assert scheduler.stats()["retries"] == 2
+
+def test_other_errors_fail_without_retry(scheduler):
+    attempts = []
+    def broken():
+        attempts.append(1)
+        raise ValueError("bad request")
+    with pytest.raises(ValueError):
+        scheduler.call("answer", broken)
+    assert len(attempts) == 1
+    assert scheduler.stats()["failures"] == 1
+
+def test_retries_give_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "backoff_delay", lambda attempt: 0.0)
+    scheduler = LLMScheduler(rpm=0, tpm=0, max_retries=2)
+    model = FakeModel(quota=1)
+    model.generate_content("first") # spends this second's quota
+    with pytest.raises(FakeRateLimitError):
+        scheduler.call("answer", lambda: model.generate_content("second"))
+    assert model.rate_limited == 3
+
+
+# Async calls
+def test_async_identical_prompts_share_one_call(scheduler):
+    model = FakeModel(latency=0.05)
+
+    async def main():
+        return await asyncio.gather(*(llm_scheduler.generate_async(model, "same prompt", "answer")
+                                      for _ in range(5)))
+    replies = asyncio.run(main())
+    assert model.calls == 1
+    assert len({reply.text for reply in replies}) == 1
+
+def test_cancelled_async_call_releases_its_slot():
+    scheduler = LLMScheduler(rpm=0, tpm=0, concurrency=1)
+
+    async def main():
+        running = scheduler.submit_async("answer", lambda: asyncio.sleep(10))
+        await asyncio.sleep(0.05)
+        for task in list(scheduler._tasks):
+            task.cancel()
+        await asyncio.sleep(0.05)
+        assert running.done()
+
+        async def answer():
+            return 42
+        # the only slot must be free again
+        return await asyncio.wait_for(asyncio.wrap_future(scheduler.submit_async("answer", answer)), 1)
+    assert asyncio.run(main()) == 42
+
+def test_cancelled_while_queued_does_not_stall_the_dispatcher():
+    scheduler = LLMScheduler(rpm=0, tpm=0, concurrency=1)
+
+    async def main():
+        scheduler.submit_async("answer", lambda: asyncio.sleep(10)) # holds the only slot
+        await asyncio.sleep(0.05)
+        holder = set(scheduler._tasks)
+        scheduler.submit_async("rerank", lambda: asyncio.sleep(0)) # queued for that slot
+        await asyncio.sleep(0.05)
+        for task in scheduler._tasks - holder:
+            task.cancel()
+        await asyncio.sleep(0.05)
+        for task in holder:
+            task.cancel()
+
+        async def answer():
+            return "next"
+        return await asyncio.wait_for(asyncio.wrap_future(scheduler.submit_async("answer", answer)), 1)
+    assert asyncio.run(main()) == "next"
@@ -0,0 +1,17 @@
+from rerank_engine import parse_listwise_scores
+
+
+def test_whole_reply_json_list():
+    assert parse_listwise_scores("[7, 3.5, 0]", 3) == [7.0, 3.5, 0.0]
+    assert parse_listwise_scores("```json\n[7, 3]\n```", 2) == [7.0, 3.0]
+
+def test_indexed_lines_are_not_read_as_a_list():
+    assert parse_listwise_scores("[0] 8", 1) == [8.0]
+    assert parse_listwise_scores("[0]: 8\n[1]: 2\n[2]: 5", 3) == [8.0, 2.0, 5.0]
+
+def test_list_inside_text():
+    assert parse_listwise_scores("Scores: [7, 3, 9]", 3) == [7.0, 3.0, 9.0]
+
+def test_missing_scores_are_none():
+    assert parse_listwise_scores("[0] 8", 2) == [8.0, None]
+    assert parse_listwise_scores("no idea", 2) == [None, None]
@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from fakes import FakeModel
+from single_flight import SingleFlight
+
+
+def wait_until(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+def run_followers(flight, count: int, key, fn, **kwargs):
+    """Start `count` callers that join an in-flight call, return their outcomes once all have joined."""
+    outcomes = [None] * count
+    def call(i):
+        try:
+            outcomes[i] = ("result", flight.do(key, fn, **kwargs))
+        except BaseException as e:
+            outcomes[i] = ("error", e)
+    shared = flight.counters["shared"]
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: flight.counters["shared"] == shared + count)
+    return threads, outcomes
+
+
+# Threads
+def test_concurrent_identical_calls_run_once():
+    flight, model = SingleFlight("test"), FakeModel()
+    started, release = threading.Event(), threading.Event()
+    def answer():
+        started.set()
+        release.wait(2)
+        return model.generate_content("what is the fx markup").text
+
+    leader = threading.Thread(target=lambda: flight.do("q", answer))
+    leader.start()
+    assert started.wait(2)
+    threads, outcomes = run_followers(flight, 7, "q", answer)
+    release.set()
+    for thread in threads + [leader]:
+        thread.join(2)
+
+    assert model.calls == 1
+    assert len({value for kind, value in outcomes}) == 1 and outcomes[0][0] == "result"
+    assert flight.stats() == {"leaders": 1, "shared": 7, "timeouts": 0, "inflight": 0}
+
+def test_different_keys_and_later_repeats_run_separately():
+    flight, model = SingleFlight("test"), FakeModel()
+    flight.do("a", model.generate_content, "first")
+    flight.do("b", model.generate_content, "second")
+    flight.do("a", model.generate_content, "first") # the earlier call has returned, nothing is kept
+    assert model.calls == 3
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    def failing():
+        started.set()
+        release.wait(2)
+        raise RuntimeError("upstream failed")
+
+    errors = []
+    def lead():
+        try:
+            flight.do("q", failing)
+        except RuntimeError as e:
+            errors.append(e)
+    leader = threading.Thread(target=lead)
+    leader.start()
+    assert started.wait(2)
+    threads, outcomes = run_followers(flight, 3, "q", failing)
+    release.set()
+    for thread in threads + [leader]:
+        thread.join(2)
+
+    assert errors and all(kind == "error" and value is errors[0] for kind, value in outcomes)
+    assert flight.stats()["inflight"] == 0
+
+def test_follower_gives_up_after_its_timeout():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    def slow():
+        started.set()
+        release.wait(2)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("q", slow)))
+    leader.start()
+    assert started.wait(2)
+    with pytest.raises(TimeoutError):
+        flight.do("q", slow, timeout=0.05)
+    release.set()
+    leader.join(2)
+
+    assert results == ["answer"] # the leader isn't affected by a follower giving up
+    assert flight.counters["timeouts"] == 1
+
+
+# Coroutines
+def test_async_identical_calls_run_once():
+    flight, model = SingleFlight("test"), FakeModel(latency=0.05)
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("q", model.generate_content_async, "prompt")
+                                      for _ in range(6)))
+    replies = asyncio.run(main())
+    assert model.calls == 1
+    assert len({reply.text for reply in replies}) == 1
+    assert flight.stats() == {"leaders": 1, "shared": 5, "timeouts": 0, "inflight": 0}
+
+def test_async_follower_timeout_leaves_the_leader_running():
+    flight = SingleFlight("test")
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return "answer"
+
+    async def main():
+        leader = asyncio.create_task(flight.do_async("q", slow))
+        await asyncio.sleep(0.01)
+        with pytest.raises(TimeoutError):
+            await flight.do_async("q", slow, timeout=0.05)
+        return await leader
+    assert asyncio.run(main()) == "answer"
+    assert flight.counters["timeouts"] == 1
+
+def test_async_leader_error_reaches_followers():
+    flight = SingleFlight("test")
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream failed")
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("q", failing) for _ in range(3)), return_exceptions=True)
+    errors = asyncio.run(main())
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert flight.stats()["inflight"] == 0
+
+def test_async_cancelled_leader_still_answers_followers():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def slow(answer):
+        calls.append(answer)
+        await asyncio.sleep(0.1)
+        return answer
+
+    async def main():
+        leader = asyncio.create_task(flight.do_async("q", slow, "answer"))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flight.do_async("q", slow, "answer"))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert await follower == "answer"
+        assert flight.stats()["inflight"] == 0
+        return await flight.do_async("q", slow, "fresh") # a new call for the same key starts a fresh flight
+    assert asyncio.run(main()) == "fresh"
+    assert calls == ["answer", "fresh"]
+
+def test_async_work_is_cancelled_once_every_caller_is_gone():
+    flight = SingleFlight("test")
+    finished = []
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        finished.append(True)
+
+    async def main():
+        callers = [asyncio.create_task(flight.do_async("q", slow)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.3)
+        assert flight.stats()["inflight"] == 0
+    asyncio.run(main())
+    assert finished == []
@@ -0,0 +1,226 @@
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+# Lightweight tracing and Prometheus metrics for the chat pipeline
+#   spans   : one per agent stage and external call, tagged with the request id (a contextvar, so it follows
+#             the request into worker threads submitted through propagate())
+#   metrics : counters and latency histograms rendered in the Prometheus text format by GET /metrics
+#   span log: optional JSON lines file (TRACE_LOG_PATH), written by a background thread so requests never
+#             block on it
+# With TRACING_ENABLED=0 span() hands back a shared no-op object and the counters return immediately.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "") # '' disables the span log
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REQUEST_ID = contextvars.ContextVar("request_id", default=None)
+_CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+
+# Request ids
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+def current_request_id():
+    return _REQUEST_ID.get()
+
+class request_context:
+    """Bind a request id (a fresh one when None) for everything run in this context."""
+
+    def __init__(self, request_id: str = None):
+        self.request_id = request_id or new_request_id()
+
+    def __enter__(self):
+        self._token = _REQUEST_ID.set(self.request_id)
+        return self.request_id
+
+    def __exit__(self, *exc):
+        _REQUEST_ID.reset(self._token)
+
+def propagate(fn):
+    """Wrap fn so a worker thread runs it with the caller's request id and parent span."""
+    if not TRACING_ENABLED:
+        return fn
+    context = contextvars.copy_context()
+    # a context can only be entered by one thread at a time, so every call runs in its own copy
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+# Spans
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:8]
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _CURRENT_SPAN.get()
+        self._token = _CURRENT_SPAN.set(self)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        _CURRENT_SPAN.reset(self._token)
+        status = "error" if exc_type else "ok"
+        observe("rag_span_seconds", duration, span=self.name)
+        if exc_type:
+            count("rag_span_errors_total", span=self.name)
+        if _SPAN_LOG is not None:
+            _SPAN_LOG.put({
+                "request_id": _REQUEST_ID.get(),
+                "span_id": self.span_id,
+                "parent_id": self.parent.span_id if self.parent else None,
+                "name": self.name,
+                "start": self.start,
+                "duration_ms": round(duration * 1000, 3),
+                "status": status,
+                "error": repr(exc) if exc else None,
+                "attributes": self.attributes,
+            })
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name: str, **attributes):
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+# Process start, the reference for a worker's start-to-ready time
+def process_start_time():
+    """Wall-clock time this process started (from /proc on Linux, else when this module was imported)."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19]) # field 22, starttime since boot
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+PROCESS_STARTED = process_start_time()
+
+
+# Metrics
+_COUNTERS = {}   # (name, labels) -> value
+_HISTOGRAMS = {} # (name, labels) -> [bucket counts..., sum, count]
+_COLLECTORS = [] # callables yielding (name, labels dict, value) for values owned elsewhere, e.g. cache stats
+_METRICS_LOCK = threading.Lock()
+
+def _labels(labels: dict):
+    return tuple(sorted(labels.items()))
+
+def count(name: str, value: float = 1, **labels):
+    if not TRACING_ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _METRICS_LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+def observe(name: str, seconds: float, **labels):
+    if not TRACING_ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _METRICS_LOCK:
+        values = _HISTOGRAMS.get(key)
+        if values is None:
+            values = _HISTOGRAMS[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+def record_llm(purpose: str, response):
+    """Count one Gemini call and the tokens reported in its usage metadata."""
+    if not TRACING_ENABLED:
+        return
+    count("rag_llm_calls_total", purpose=purpose)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        count("rag_llm_tokens_total", getattr(usage, "prompt_token_count", 0) or 0, purpose=purpose, kind="prompt")
+        count("rag_llm_tokens_total", getattr(usage, "candidates_token_count", 0) or 0, purpose=purpose,
+              kind="completion")
+
+def add_collector(collector):
+    _COLLECTORS.append(collector)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels) + "}"
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    with _METRICS_LOCK:
+        counters = dict(_COUNTERS)
+        histograms = {key: list(values) for key, values in _HISTOGRAMS.items()}
+    for collector in _COLLECTORS:
+        for name, labels, value in collector():
+            counters[(name, _labels(labels))] = value
+
+    lines, typed = [], set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), values in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, bucket in zip(BUCKETS, values):
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {bucket}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+def reset_metrics():
+    with _METRICS_LOCK:
+        _COUNTERS.clear()
+        _HISTOGRAMS.clear()
+
+
+# Span log
+class SpanLog:
+    def __init__(self, path: str):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        threading.Thread(target=self._write, daemon=True, name="span-log").start()
+
+    def put(self, record: dict):
+        self.queue.put(record)
+
+    def _write(self):
+        with open(self.path, "a") as f:
+            while True:
+                record = self.queue.get()
+                f.write(json.dumps(record, default=str) + "\n")
+                if self.queue.empty():
+                    f.flush()
+
+_SPAN_LOG = SpanLog(TRACE_LOG_PATH) if TRACING_ENABLED and TRACE_LOG_PATH else None
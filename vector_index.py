@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from corpus import get_corpus_version
+
+# Local dense index
+#   vectors.npy        : L2-normalised float32 matrix, opened with mmap so every worker shares the same pages
+#   chunks.json        : content + metadata (source, chunk_id) for each row, in matrix order
+#   vectors_int8.npy   : the same rows quantized to int8 with one scale per dimension (int8_scale.npy), 4x smaller
+#   vectors_binary.npy : one sign bit per dimension packed into bytes, 32x smaller
+# With INDEX_QUANTIZATION set, search scans the quantized matrix (held in memory) for the RESCORE_CANDIDATES
+# best rows, then rescores only those against the float32 vectors, so the float matrix stays on disk and
+# just the shortlisted rows are paged in.
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "supabase") # "supabase" or "local"
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "index")
+INDEX_QUANTIZATION = os.getenv("INDEX_QUANTIZATION", "none") # none | int8 | binary
+RESCORE_CANDIDATES = int(os.getenv("RESCORE_CANDIDATES", "100"))
+
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.json"
+INT8_FILE = "vectors_int8.npy"
+INT8_SCALE_FILE = "int8_scale.npy"
+BINARY_FILE = "vectors_binary.npy"
+
+SCAN_BLOCK = 4096 # int8 rows widened to float32 at a time, small enough to stay in cache
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def quantize_int8(vectors, scale):
+    return np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+
+def int8_scale(vectors):
+    # symmetric per-dimension scale, the largest magnitude in each column maps to 127
+    peak = np.abs(vectors).max(axis=0) if len(vectors) else np.zeros(vectors.shape[1], dtype=np.float32)
+    return np.where(peak > 0, peak / 127, 1.0).astype(np.float32)
+
+def quantize_binary(vectors):
+    return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+def hamming(codes, query_code):
+    if hasattr(np, "bitwise_count") and codes.shape[-1] % 8 == 0:
+        # numpy >= 2.0: hardware popcount over 64-bit words
+        return np.bitwise_count(codes.view(np.uint64) ^ query_code.view(np.uint64)).sum(axis=1, dtype=np.int32)
+    return POPCOUNT[codes ^ query_code].sum(axis=1, dtype=np.int32)
+
+
+class VectorIndex:
+    def __init__(self, vectors, records: list, int8=None, scale=None, binary=None,
+                 quantization: str = INDEX_QUANTIZATION):
+        self.vectors = vectors
+        self.records = records
+        self.int8 = int8
+        self.scale = scale
+        self.binary = binary
+        self.quantization = quantization
+
+    @classmethod
+    def load(cls, path: str = LOCAL_INDEX_DIR, quantization: str = INDEX_QUANTIZATION):
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(path, CHUNKS_FILE)) as f:
+            records = json.load(f)
+
+        # the quantized copies are memory-mapped like the float32 vectors, so workers share their pages too
+        int8 = scale = binary = None
+        if quantization == "int8" and os.path.exists(os.path.join(path, INT8_FILE)):
+            int8 = np.load(os.path.join(path, INT8_FILE), mmap_mode="r")
+            scale = np.load(os.path.join(path, INT8_SCALE_FILE))
+        elif quantization == "binary" and os.path.exists(os.path.join(path, BINARY_FILE)):
+            binary = np.load(os.path.join(path, BINARY_FILE), mmap_mode="r")
+        elif quantization != "none":
+            print(f"No {quantization} vectors in {path}, rebuild it with `python vector_index.py`; "
+                  f"searching the float32 vectors")
+            quantization = "none"
+        return cls(vectors, records, int8, scale, binary, quantization)
+
+    def __len__(self):
+        return len(self.records)
+
+    def normalize(self, query_embedding):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm else query
+
+    def scores(self, query_embedding):
+        return self.vectors @ self.normalize(query_embedding)
+
+    def shortlist(self, query, count: int, quantization: str):
+        """Rows of the `count` best approximate scores from the quantized matrix."""
+        if quantization == "int8":
+            # asymmetric: int8 rows against the float query folded with the scales, no query rounding error
+            folded = query * self.scale
+            order = np.empty(len(self), dtype=np.float32)
+            for start in range(0, len(self), SCAN_BLOCK):
+                order[start:start + SCAN_BLOCK] = -(self.int8[start:start + SCAN_BLOCK].astype(np.float32) @ folded)
+        else:
+            order = hamming(self.binary, quantize_binary(query))
+        if count >= len(order):
+            return np.arange(len(order))
+        return np.sort(np.argpartition(order, count - 1)[:count]) # sorted rows read the mmap in file order
+
+    def search(self, query_embedding, top_k: int = 10, quantization: str = None):
+        """Cosine top-k, returned in the same shape as the match_documents RPC rows."""
+        if not len(self):
+            return []
+        quantization = quantization or self.quantization
+        query = self.normalize(query_embedding)
+        if quantization == "none":
+            rows = np.arange(len(self))
+            scores = self.vectors @ query
+        else:
+            rows = self.shortlist(query, max(top_k, RESCORE_CANDIDATES), quantization)
+            scores = self.vectors[rows] @ query # full precision rescoring of the shortlist only
+
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.result(rows[i], scores[i]) for i in top]
+
+    def memory_bytes(self, quantization: str = None):
+        """Bytes the search scan reads for every query: the full matrix, or the quantized copy plus the shortlist."""
+        quantization = quantization or self.quantization
+        row_bytes = self.vectors.shape[1] * self.vectors.itemsize if len(self) else 0
+        if quantization == "int8":
+            return self.int8.nbytes + self.scale.nbytes + min(RESCORE_CANDIDATES, len(self)) * row_bytes
+        if quantization == "binary":
+            return self.binary.nbytes + min(RESCORE_CANDIDATES, len(self)) * row_bytes
+        return len(self) * row_bytes
+
+    def result(self, row: int, similarity: float):
+        record = self.records[row]
+        return {
+            "content": record["content"],
+            "metadata": record["metadata"],
+            "similarity": float(similarity)
+        }
+
+
+# Building
+def parse_embedding(embedding):
+    # pgvector columns come back from PostgREST as "[0.1,0.2,...]" strings
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    return embedding
+
+def build_index(rows: list, path: str = LOCAL_INDEX_DIR):
+    """Write rows with content, embedding and metadata to an index directory."""
+    rows = sorted(rows, key=lambda r: (r["metadata"].get("source"), r["metadata"].get("chunk_id")))
+    dim = len(parse_embedding(rows[0]["embedding"])) if rows else 0
+
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    vectors = np.lib.format.open_memmap(
+        os.path.join(tmp_path, VECTORS_FILE), mode="w+", dtype=np.float32, shape=(len(rows), dim)
+    )
+    for i, row in enumerate(rows):
+        vector = np.asarray(parse_embedding(row["embedding"]), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vectors[i] = vector / norm if norm else vector
+    vectors.flush()
+
+    # quantized copies for INDEX_QUANTIZATION, always written so switching needs no rebuild
+    scale = int8_scale(vectors)
+    np.save(os.path.join(tmp_path, INT8_SCALE_FILE), scale)
+    np.save(os.path.join(tmp_path, INT8_FILE), quantize_int8(vectors, scale))
+    np.save(os.path.join(tmp_path, BINARY_FILE), quantize_binary(vectors))
+    del vectors
+
+    with open(os.path.join(tmp_path, CHUNKS_FILE), "w") as f:
+        json.dump([{"content": r["content"], "metadata": r["metadata"]} for r in rows], f)
+
+    # swap the finished index in so running workers never see a half-written one
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f"Built local index with {len(rows)} chunks at {path}")
+
+def fetch_rows(client, table: str = "documents", columns: str = "content,embedding,metadata",
+               page_size: int = 1000):
+    rows = []
+    while True:
+        response = (client.table(table)
+                    .select(columns)
+                    .range(len(rows), len(rows) + page_size - 1)
+                    .execute())
+        rows.extend(response.data)
+        if len(response.data) < page_size:
+            return rows
+
+
+# Shared instance
+_INDEX = None # (corpus version, index)
+_INDEX_LOCK = threading.Lock()
+
+def get_index(path: str = LOCAL_INDEX_DIR):
+    """The shared index, reloaded once the corpus version moves so workers pick up a rebuild by ingest."""
+    global _INDEX
+    version = get_corpus_version()
+    loaded = _INDEX
+    if loaded is None or loaded[0] != version:
+        with _INDEX_LOCK:
+            loaded = _INDEX
+            if loaded is None or loaded[0] != version:
+                _INDEX = loaded = (version, VectorIndex.load(path))
+    return loaded[1]
+
+def reset_index():
+    global _INDEX
+    with _INDEX_LOCK:
+        _INDEX = None
+
+def use_local_index():
+    return RETRIEVAL_BACKEND == "local"
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Build the local vector index from the Supabase documents table")
+    parser.add_argument("--out", default=LOCAL_INDEX_DIR)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+    build_index(fetch_rows(client), args.out)